@@ -227,6 +227,9 @@ class Ui_MainWindow(object):
         self.mog_rb.setChecked(False)
         self.mog_rb.setObjectName("mog_rb")
         self.gridLayout_6.addWidget(self.mog_rb, 1, 0, 1, 1)
+        self.modelBackground_rb = QtWidgets.QRadioButton(self.frame_5)
+        self.modelBackground_rb.setObjectName("modelBackground_rb")
+        self.gridLayout_6.addWidget(self.modelBackground_rb, 3, 0, 1, 1)
         self.gridLayout_17.addWidget(self.frame_5, 0, 0, 1, 1)
         self.formLayout_4.setWidget(0, QtWidgets.QFormLayout.SpanningRole, self.groupBox_19)
         self.tabWidget_2.addTab(self.tab_6, "")
@@ -372,6 +375,9 @@ class Ui_MainWindow(object):
         self.interpolate_b = QtWidgets.QPushButton(self.groupBox_11)
         self.interpolate_b.setObjectName("interpolate_b")
         self.verticalLayout_3.addWidget(self.interpolate_b)
+        self.kalman_b = QtWidgets.QPushButton(self.groupBox_11)
+        self.kalman_b.setObjectName("kalman_b")
+        self.verticalLayout_3.addWidget(self.kalman_b)
         self.ppUndo_B = QtWidgets.QPushButton(self.groupBox_11)
         self.ppUndo_B.setObjectName("ppUndo_B")
         self.verticalLayout_3.addWidget(self.ppUndo_B)
@@ -559,6 +565,8 @@ class Ui_MainWindow(object):
         self.firstFrame_rb.setText(_translate("MainWindow", "Use first frame as background"))
         self.specifyBackground_rb.setText(_translate("MainWindow", "Specify background image"))
         self.mog_rb.setText(_translate("MainWindow", "MOG background subtraction"))
+        self.modelBackground_rb.setToolTip(_translate("MainWindow", "Median of frames sampled over the video, cached next to the video."))
+        self.modelBackground_rb.setText(_translate("MainWindow", "Use median of sampled frames as background"))
         self.tabWidget_2.setTabText(self.tabWidget_2.indexOf(self.tab_6), _translate("MainWindow", "Detection"))
         self.groupBox_6.setTitle(_translate("MainWindow", "Block-out regions:"))
         self.enableBlock_b.setText(_translate("MainWindow", "Enable"))
@@ -590,6 +598,8 @@ class Ui_MainWindow(object):
         self.ppBlank_B.setToolTip(_translate("MainWindow", "Removed erroneous data from selected rows in the table."))
         self.ppBlank_B.setText(_translate("MainWindow", "Blank selected rows on track "))
         self.interpolate_b.setText(_translate("MainWindow", "Interpolate blank rows"))
+        self.kalman_b.setToolTip(_translate("MainWindow", "Smooths the active track with a Kalman filter."))
+        self.kalman_b.setText(_translate("MainWindow", "Kalman smooth track"))
         self.ppUndo_B.setToolTip(_translate("MainWindow", "Reverts active track back to its orginal state."))
         self.ppUndo_B.setText(_translate("MainWindow", "Undo changes to active track"))
         self.saveTrackEdits_b.setText(_translate("MainWindow", "Save track as ..."))
@@ -15,6 +15,14 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from gui import tracker_ui
 from gui import calibration_ui
 from tracking import videoTracking
+from tracking import backgroundModel
+from tracking import blockOutRegions
+from tracking import trackingEngine
+from tracking import kalmanTracker
+from util import DLT as DLTx
+from util import trackStorage
+from util import calibrationModel
+from util import calibrationService
 
 class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
 
@@ -86,6 +94,7 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
         self.ppBlank_B.clicked.connect(self.blankRows)
         self.ppUndo_B.clicked.connect(self.changesUndo)
         self.interpolate_b.clicked.connect(self.interpolateBlanks)
+        self.kalman_b.clicked.connect(self.kalmanSmooth)
 
         self.newCalibration_b.clicked.connect(self.init_Calibration)
         self.loadCal_b.clicked.connect(self.loadCalibration)
@@ -135,7 +144,13 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
         if pointFilePath[0] != '':
 
             ### Coefficients of currently loaded calibration
-            self.calib=Calibration(pointFilePath[0],self)
+            try:
+                self.calib=Calibration(pointFilePath[0],self)
+            except ValueError as e:
+                self.errMessage="%s Load a calibration file saved from the calibration window." % str(e)
+                self.errorTitle="Incorrect calibration file!"
+                self.errorMsg()
+                return None
 
             self.calib.populateTable()
             self.calStyleSheet = "::section{Background-color:rgb(190,1,1);border-radius:14px;}"
@@ -177,13 +192,41 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
 
         To define a block, write 'Block' in a text file followed by a space and then the block's 'name'. On each line below, write an integer value for the top x pixel coordinate of the block, an integer value for the top y pixel coordinate, an integer value for the bottom x pixel coordinate, an integer value for the bottom y pixel coordinate. 
 
+        Polygon and ellipse regions can be loaded from a .json file written by
+        saveBlock() or by tracking.blockOutRegions.saveRegions().
+
         1 - prompt's user to load file
         2 - reads each line looking for 'Block'
         3 - once found, read in the values on the next four lines 
         """
 
         self.savedBlocksPath=PyQt5.QtWidgets.QFileDialog.getOpenFileName(self,
-        "Load blockout region file",filter="Text Files( *.csv *.txt)")
+        "Load blockout region file",filter="Text Files( *.csv *.txt *.json)")
+
+        if self.savedBlocksPath[0].lower().endswith('.json'):
+
+            try:
+                regions=blockOutRegions.loadRegions(self.savedBlocksPath[0])
+            except (ValueError, KeyError, TypeError):
+                self.errMessage="This file is not the right format. Have a look inside the file to see if it follows the correct format."
+                self.errorTitle="Incorrect file format!"
+                self.errorMsg()
+                return None
+
+            for count, region in enumerate(regions):
+                ID=str(region.ID) if region.ID is not None else '%s_%d' % (region.kind, count+1)
+
+                if ID in self.blockOutRegions.keys():
+                    self.errMessage="There is already a block out region named %s!" % ID
+                    self.errorTitle="Region already exists!"
+                    self.errorMsg()
+                    break
+
+                self.blockOutRegions[ID]=BlockOutRegion(self,True)
+                self.blockOutRegions[ID].ID=ID
+                self.blockOutRegions[ID].region=region
+                self.blockRegions_lw.addItem(ID)
+            return None
 
         if self.savedBlocksPath[0]!='':
 
@@ -239,15 +282,24 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
 
         1 - Prompts user for file name
         2 - Saves data in self.blockOutRegions[key].top* or self.blockOutRegions[key].bottom* to file
+
+        Saving to a .json file keeps polygon and ellipse regions, the text
+        format only holds rectangles.
         """
 
         path = PyQt5.QtWidgets.QFileDialog.getSaveFileName(
-                self, 'Save File', self.path, 'CSV(*.txt)')[0]
+                self, 'Save File', self.path, 'CSV(*.txt);;JSON(*.json)')[0]
+
+        if path.lower().endswith('.json'):
+            blockOutRegions.saveRegions(path, [self.blockOutRegions[key].toRegion() for key in self.blockOutRegions])
+            return None
 
         if path != '':
             outF = open(path, "w")
 
             for count, key in enumerate(self.blockOutRegions.keys()):
+                if self.blockOutRegions[key].toRegion().kind != 'rectangle':
+                    continue
                 outF.write("Block %s \n" %str(self.blockOutRegions[key].ID))
                 outF.write(str(self.blockOutRegions[key].topx)+"\n")
                 outF.write(str(self.blockOutRegions[key].topy)+"\n")
@@ -303,7 +355,8 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
 
         """Opens and OpenCV window to allow user to scroll to the desired video frame to use for background selection.
 
-        Writes the selected frame to file calling it 'firstFrame.jpg' in the current working directory. 
+        Writes the selected frame to the backgrounds folder next to the video
+        (see tracking.backgroundModel.cacheFolder), as <video name>_frame<number>.png.
         """
 
         try:
@@ -326,18 +379,25 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
         cv2.namedWindow('Select')
         cv2.createTrackbar( 'Frame #', 'Select', self.start, length, onChange )
         cap.set(cv2.CAP_PROP_POS_FRAMES,cv2.getTrackbarPos('Frame #','Select'))
-        err,self.background = cap.read()
-        self.background = cv2.cvtColor(self.background, cv2.COLOR_BGR2GRAY)
-
-        cv2.imwrite('firstFrame.jpg',self.background)
-        cv2.imshow("Select", self.background)
+        err,img = cap.read()
+        cv2.imshow("Select", img)
         
         self.statusBar().showMessage("Press any key once background frame has been chosen to exit.")
 
         onChange(0)
         cv2.waitKey()
-         
+
+        #The background is the frame the trackbar was left on
+        frameNumber=cv2.getTrackbarPos('Frame #','Select')
+        cap.set(cv2.CAP_PROP_POS_FRAMES,frameNumber)
+        err,img = cap.read()
         cap.release()
+        if err:
+            self.background = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            folder=backgroundModel.cacheFolder(self.video)
+            os.makedirs(folder, exist_ok=True)
+            name=os.path.splitext(os.path.basename(self.video))[0]
+            cv2.imwrite(os.path.join(folder, '%s_frame%d.png' % (name, frameNumber)),self.background)
         cv2.destroyAllWindows()   
         
         self.statusBar().showMessage("") 
@@ -501,7 +561,7 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
 
     def loadTracks(self):
 
-        self.trackPaths = PyQt5.QtWidgets.QFileDialog.getOpenFileNames(self,"CSV files", self.path, filter="Text Files (*.csv)")[0]
+        self.trackPaths = PyQt5.QtWidgets.QFileDialog.getOpenFileNames(self,"Track files", self.path, filter="Track Files (*.csv *.npz *.parquet)")[0]
         print(self.trackPaths)
 
         if not self.trackPaths:
@@ -516,7 +576,7 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
                     self.tracksDict[self.currentTrack.trackID]=self.currentTrack    
                     self.tracks_lw.addItem(self.currentTrack.trackID)  
 
-                except ValueError:
+                except (ValueError, OSError, KeyError):
 
                     self.errMessage="You are trying to load a incorrect file format for a track (it should only have 3 columns, one for the frame number, one for the x pixel coordinate and one for the y pixel coordinate). Try a correctly formatted file."
                     self.errorTitle="Incorrect file format!"
@@ -528,6 +588,10 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
         self.selectedItemText=self.tracks_lw.currentItem().text()
         self.tracksDict[self.selectedItemText].interpolateBlanks()       
 
+    def kalmanSmooth(self):
+        self.selectedItemText=self.tracks_lw.currentItem().text()
+        self.tracksDict[self.selectedItemText].kalmanSmooth()
+
     def blankRows(self):
         """
         Calls postProcessing2D method to remove selected rows in the table from
@@ -626,10 +690,12 @@ class MainWindow(PyQt5.QtWidgets.QMainWindow, tracker_ui.Ui_MainWindow):
         try:
             self.reconGroup.xyz  
             path = PyQt5.QtWidgets.QFileDialog.getSaveFileName(
-                    self, 'Save File', '', 'CSV(*.csv)')[0]
+                    self, 'Save File', '', 'CSV(*.csv);;NPZ(*.npz)')[0]
             
             if path:
-                self.reconGroup.xyz.to_csv(path,sep=',',index=False)
+                metadata={'views': [track.trackID for track in self.reconGroup.views],
+                          'calibration': self.calib.calID if hasattr(self, 'calib') else None}
+                trackStorage.saveTrack(path, self.reconGroup.xyz, metadata)
                 self.errorTitle="3D track Successfully saved!"
                 self.errMessage="Saved successfully to: %s" % path
                 self.errorMsg()
@@ -688,6 +754,8 @@ class BlockOutRegion(PyQt5.QtWidgets.QWidget):
         super().__init__()
         self.MainWindow=MainWindow
         self.valid=True
+        ## Polygon or ellipse loaded from file, None for rectangles defined by top*/bottom*
+        self.region=None
 
         if load == False:
 
@@ -731,6 +799,13 @@ class BlockOutRegion(PyQt5.QtWidgets.QWidget):
             self.bottomx=1
             self.bottomy=1
 
+    def toRegion(self):
+        """Returns the region as a tracking.blockOutRegions object for the tracking engine."""
+
+        if self.region is not None:
+            return self.region
+        return blockOutRegions.RectangleRegion(self.topx, self.topy, self.bottomx, self.bottomy, ID=self.ID)
+
     def checkInput(self, okPressed, input):
         if okPressed:
             return True
@@ -1077,57 +1152,35 @@ class DLT:
         L: array of the 8 or 11 parameters of the calibration matrix
         err: error of the DLT (mean residual of the DLT transformation in units of camera coordinates).
         """
-        #Convert all variables to numpy array:
-        xyz = np.asarray(xyz)
-        uv = np.asarray(uv)
-        #number of points:
-        np = xyz.shape[0]
-        #Check the parameters:
-        if uv.shape[0] != np:
-            raise ValueError('xyz (%d points) and uv (%d points) have different number of points.' %(np, uv.shape[0]))
-        if (nd == 2 and xyz.shape[1] != 2) or (nd == 3 and xyz.shape[1] != 3):
-            raise ValueError('Incorrect number of coordinates (%d) for %dD DLT (it should be %d).' %(xyz.shape[1],nd,nd))
-        if nd == 3 and np < 6 or nd == 2 and np < 4:
-            raise ValueError('%dD DLT requires at least %d calibration points. Only %d points were entered.' %(nd, 2*nd, np))
-            
-        #Normalize the data to improve the DLT quality (DLT is dependent of the system of coordinates).
-        #This is relevant when there is a considerable perspective distortionp.
-        #Normalization: mean position at origin and mean distance equals to 1 at each directionp.
-        Txyz, xyzn = self.Normalization(nd, xyz)
-        Tuv, uvn = self.Normalization(2, uv)
-
-        A = []
-        if nd == 2: #2D DLT
-            for i in range(np):
-                x,y = xyzn[i,0], xyzn[i,1]
-                u,v = uvn[i,0], uvn[i,1]
-                A.append( [x, y, 1, 0, 0, 0, -u*x, -u*y, -u] )
-                A.append( [0, 0, 0, x, y, 1, -v*x, -v*y, -v] )
-        elif nd == 3: #3D DLT
-            for i in range(np):
-                x,y,z = xyzn[i,0], xyzn[i,1], xyzn[i,2]
-                u,v = uvn[i,0], uvn[i,1]
-                A.append( [x, y, z, 1, 0, 0, 0, 0, -u*x, -u*y, -u*z, -u] )
-                A.append( [0, 0, 0, 0, x, y, z, 1, -v*x, -v*y, -v*z, -v] )
-
-        #convert A to array
-        A = np.asarray(A) 
-        #Find the 11 (or 8 for 2D DLT) parameters:
-        U, S, Vh = np.linalg.svd(A)
-        #The parameters are in the last line of Vh and normalize them:
-        L = Vh[-1,:] / Vh[-1,-1]
-        #Camera projection matrix:
-        H = L.reshape(3,nd+1)
-        #Denormalization:
-        H = np.dot( np.dot( np.linalg.pinv(Tuv), H ), Txyz );
-        H = H / H[-1,-1]
-        self.L = H.flatten(0)
-        #Mean error of the DLT (mean residual of the DLT transformation in units of camera coordinates):
-        uv2 = np.dot( H, np.concatenate( (xyz.T, np.ones((1,xyz.shape[0]))) ) ) 
-        uv2 = uv2/uv2[2,:] 
-        #mean distance:
-        self.err = np.sqrt( np.mean(np.sum( (uv2[0:2,:].T - uv)**2,1 )) ) 
+        self.L, self.err = DLTx.DLTcalib(nd, xyz, uv)
+        return self.L, self.err
+
+    def DLTcalib_robust(self, nd, xyz, uv, trials=500, threshold=3.):
+        """
+        Camera calibration by DLT that rejects mis-clicked calibration points.
 
+        Runs util.DLT.DLTcalib_robust(): trials calibrations on random subsets of
+        the points, solved in one batch, keep the one that agrees with most points
+        within threshold pixels and recalibrate from those points.
+        Outputs:
+        L, err: as for DLTcalib(), from the points kept
+        inliers: boolean array, False for the points rejected
+        """
+        self.L, self.err, inliers = DLTx.DLTcalib_robust(nd, xyz, uv, trials=trials, threshold=threshold)
+        return self.L, self.err, inliers
+
+    def DLTcalib_refine(self, nd, xyz, uv, L=None, distortion=False):
+        """
+        Non-linear refinement of a DLT calibration by util.DLT.DLTcalib_refine().
+
+        Minimizes the reprojection error of the calibration points starting from
+        L (the linear DLT by default). With distortion=True, the 5 lens distortion
+        terms of the extended DLT are estimated too and L has 16 parameters.
+        Outputs:
+        L: refined parameters
+        err: root mean square reprojection error in pixels
+        """
+        self.L, self.err = DLTx.DLTcalib_refine(nd, xyz, uv, L=L, distortion=distortion)
         return self.L, self.err
 
     def Normalization(self,nd,x):
@@ -1142,18 +1195,7 @@ class DLT:
             x: the transformed data
         '''
 
-        x = np.asarray(x)
-        m, s = np.mean(x,0), np.std(x)
-        if nd==2:
-            Tr = np.array([[s, 0, m[0]], [0, s, m[1]], [0, 0, 1]])
-        else:
-            Tr = np.array([[s, 0, 0, m[0]], [0, s, 0, m[1]], [0, 0, s, m[2]], [0, 0, 0, 1]])
-            
-        Tr = np.linalg.inv(Tr)
-        x = np.dot( Tr, np.concatenate( (x.T, np.ones((1,x.shape[0]))) ) )
-        x = x[0:nd,:].T
-
-        return Tr, x
+        return DLTx.Normalization(nd, x)
 
     def DLTrecon(self,nd, nc, Ls, uvs):
         '''
@@ -1225,6 +1267,33 @@ class DLT:
             
         return xyz, True
 
+    def DLTrecon_batch(self, nd, nc, Ls, uvs, visible=None):
+        '''
+        Reconstruction of all frames of a track at once based on the DLT parameters.
+
+        Same checks as DLTrecon() but uvs holds every frame, with shape
+        (number of frames, nc, 2), and is solved by util.DLT.DLTrecon_batch in
+        one vectorized call. visible is an optional (number of frames, nc)
+        boolean mask of the views that saw the object on each frame; frames
+        seen by less than two views are returned as NaN.
+        Outputs:
+        xyz: (number of frames, nd) array of point coordinates in space
+        '''
+
+        Ls = np.asarray(Ls)
+        if Ls.ndim == 1 and nc != 1 or Ls.ndim > 1 and nc != Ls.shape[0]:
+            self.errMessage="Number of views (%d) and number of sets of camera calibration parameters (%d) are different. Either add/remove views or load the correct calibration file." % (nc, len(Ls))
+            self.errorTitle="Wrong # of views!"
+            self.errorMsg()
+            return None,False
+        if nd == 3 and Ls.ndim == 1:
+            self.errMessage='At least two sets of camera calibration parameters are needed for 3D point reconstruction.'
+            self.errorTitle="No enough views!"
+            self.errorMsg()
+            return None,False
+
+        return DLTx.DLTrecon_batch(Ls, uvs, visible), True
+
     def errorMsg(self):
         msg = PyQt5.QtWidgets.QMessageBox()
         msg.setWindowIcon(PyQt5.QtGui.QIcon('dice.png'))
@@ -1248,6 +1317,14 @@ class CalibrationWindow(PyQt5.QtWidgets.QMainWindow, calibration_ui.Ui_Calibrati
         
         self.scenes={}
         self.calibrate=DLT(3,2)
+        ## Reject mis-clicked calibration points with DLT.DLTcalib_robust(), off to keep existing calibrations unchanged
+        self.robustCalibration=False
+        ## Refine the linear calibration by minimizing the reprojection error
+        self.refineCalibration=False
+        ## Also estimate lens distortion (extended 16 parameter DLT), implies refineCalibration
+        self.lensDistortion=False
+        ## Number of bootstrap calibrations giving confidence intervals, 0 for none
+        self.bootstrapSamples=0
         self.tableCreated=False
         self.calStyleSheet = "::section{Background-color:rgb(190,1,1);border-radius:14px;}"
         # self.tableWidget.horizontalHeader().setStyleSheet(calStyleSheet)
@@ -1617,55 +1694,44 @@ class CalibrationWindow(PyQt5.QtWidgets.QMainWindow, calibration_ui.Ui_Calibrati
     def calibrate3D(self):
 
         try:
-            x=list(self.pointData['x'])
-            y=list(self.pointData['y'])
-            z=list(self.pointData['z'])
+            xyz=self.pointData[['x','y','z']].to_numpy(dtype=float)
+            uvs=np.stack([self.pointData[[self.scenes[key].headx_px, self.scenes[key].heady_px]].to_numpy(dtype=float)
+                          for key in self.scenes], axis=1)
 
-        except AttributeError:
+        except (AttributeError, KeyError, ValueError):
             self.errMessage="Fully populate the calibration table to continue."
             self.errorTitle="Calibration table not correctly populated!"
             self.errorMsg()
             return None   
 
-        #set up xyz coords list
-        xyz=[]
-
-        for i in range(len(x)):
-                point=[]
-                point.append(x[i])
-                point.append(y[i])
-                point.append(z[i])
-                print(point)
-                xyz.append(point)
- 
-        px_coords=[]
-        for key in self.scenes:
-            view_coords=[]
-            x_px=list(self.pointData[self.scenes[key].headx_px])
-            y_px=list(self.pointData[self.scenes[key].heady_px])
-            view_coords.append(x_px)
-            view_coords.append(y_px)
-            px_coords.append(view_coords)
-        
         self.nmbDim=3
-        self.coefficients=[]
-        errors=[]
-        
         self.nmbCam=self.nmbViews
-    
-        #get parameters for each view
-        for view in px_coords:
-            uv=[]
-            for i in range(len(view[0])):
-                
-                pair=[]
-                pair.append(view[0][i])
-                pair.append(view[1][i])
-                uv.append(pair)
-            L, err = self.calibrate.DLTcalib(self.nmbDim, xyz, uv)
-            
-            self.coefficients.append(L)
-            errors.append(err)
+
+        #calibrate all views at once
+        try:
+            self.calibrationResult=calibrationService.calibrateViews(xyz, uvs, nd=self.nmbDim, robust=self.robustCalibration,
+                refine=self.refineCalibration, distortion=self.lensDistortion, bootstrap=self.bootstrapSamples)
+        except ValueError as error:
+            self.errMessage=str(error)
+            self.errorTitle="Calibration table not correctly populated!"
+            self.errorMsg()
+            return None
+
+        self.coefficients=list(self.calibrationResult.coefficients)
+
+        rejected=["View %d: points %s" % (view+1, ', '.join(str(i+1) for i in points))
+                  for view, points in self.calibrationResult.rejected().items()]
+        if rejected:
+            self.errMessage="These calibration points are too far from the others' calibration and were left out:\n%s" % "\n".join(rejected)
+            self.errorTitle="Calibration points rejected"
+            self.errorMsg()
+
+        if self.bootstrapSamples:
+            (low, high)=self.calibrationResult.reconstructionErrorCI
+            self.errMessage="Reconstruction error of the calibration points: %.4f (%d%% confidence interval %.4f to %.4f, from %d bootstrap calibrations)." % (
+                self.calibrationResult.reconstructionError, round(100*self.calibrationResult.confidence), low, high, self.bootstrapSamples)
+            self.errorTitle="Calibration uncertainty"
+            self.errorMsg()
         
 
     def loadTestTableData(self):
@@ -1756,26 +1822,21 @@ class CalibrationWindow(PyQt5.QtWidgets.QMainWindow, calibration_ui.Ui_Calibrati
                 col+=2
 
 
-            xyz1234 = np.zeros((len(self.testXYZ),3))
-            
-            #use parameters to reconstruct input points 
-            for i in range(len(testPxCoords[0])):
-                print(self.numTestViews)
-                i_px_coords=[]
-                for view in testPxCoords:
-                    i_px_coords.append(view[i])
-                try:
-                    xyz1234[i,:], ret = self.calibrate.DLTrecon(3,self.numTestViews,self.coefficients,i_px_coords)
-                except AttributeError:
-                    self.errMessage="No calibration available"
-                    self.errorTitle="Perform a calibration, then try again."
-                    self.errorMsg()
-                    return None   
-                except ValueError:
-                    self.errMessage="Ensure you have loaded a valid calibration file and a valid marker test point file. The calibration file should have 12 columns and as many rows as were used to perform the calibration. The test point file should have 2x the number of views used to obtain the calibration plus 3 more columns for the object-space coordinates."
-                    self.errorTitle="Calibration and test point files are incompatabile!"
-                    self.errorMsg()
-                    return None                                       
+            #use parameters to reconstruct input points, all at once
+            try:
+                xyz1234, ret = self.calibrate.DLTrecon_batch(3,self.numTestViews,self.coefficients,np.stack(testPxCoords, axis=1))
+            except AttributeError:
+                self.errMessage="No calibration available"
+                self.errorTitle="Perform a calibration, then try again."
+                self.errorMsg()
+                return None   
+            except ValueError:
+                self.errMessage="Ensure you have loaded a valid calibration file and a valid marker test point file. The calibration file should have 12 (or 16, with lens distortion) columns and as many rows as were used to perform the calibration. The test point file should have 2x the number of views used to obtain the calibration plus 3 more columns for the object-space coordinates."
+                self.errorTitle="Calibration and test point files are incompatabile!"
+                self.errorMsg()
+                return None                                       
+            if not ret:
+                return None
 
 
             rec_xyz=pd.DataFrame(xyz1234,columns=['rec_x','rec_y','rec_z'])
@@ -1785,6 +1846,11 @@ class CalibrationWindow(PyQt5.QtWidgets.QMainWindow, calibration_ui.Ui_Calibrati
             self.results['y_e']=self.results['y']-self.results['rec_y']
             self.results['z_e']=self.results['z']-self.results['rec_z']
 
+            #pixel distance between the test points and the projection of their known coordinates
+            reprojErr=DLTx.DLTreprojection_error(self.coefficients, np.asarray(self.testXYZ, dtype=float), np.stack(testPxCoords, axis=1))
+            for view in range(reprojErr.shape[1]):
+                self.results['reproj_e_v%d' % (view+1)]=reprojErr[:, view]
+
             self.x_std=self.results['x_e'].abs().std()
             self.y_std=self.results['y_e'].abs().std()
             self.z_std=self.results['z_e'].abs().std()
@@ -1831,7 +1897,8 @@ class Processing3D:
 
     """For 3D processing of two or more 2D tracks, contains functions to view and save 3D tracks.
 
-    TODO: Add functionality for more than 2 cameras.
+    Any number of views can be reconstructed. Each frame is solved from the
+    views that saw the object on that frame, provided there are at least two.
     """
     
     def __init__(self,MainWindow):
@@ -1855,71 +1922,117 @@ class Processing3D:
 
         ## List of numpy arrays containing x_px and y_px locations
         ## for each track.
-        self.matrices=[None]*self.nc
+        self.matrices=[]
+        ## Boolean array (frames, views), True where a view saw the object
+        self.visible=None
+        ## Tracks in the order of their viewNumber
+        self.views=[]
+        ## (frames, views, K, 2) candidate blobs of all views, None unless every track has them
+        self.candidates=None
+        ## Frames with a larger reprojection error (in pixels) in any view are counted as suspect matches
+        self.reprojectionThreshold=5.
+        ## Refine each reconstructed point by minimizing its reprojection error
+        self.refineTriangulation=False
+        ## Candidate blobs reprojecting further than this (in pixels) are left out of a match
+        self.maxResidual=20.
         self.organizeViews()
 
     def organizeViews(self):
         """Organizes matrices in the order of their associated track's viewNumber.
 
-        Currently supports up to 4 views, however more can be added if ever
-        necessary.
+        Tracks shorter than the longest one are padded with NaN so that all
+        matrices have one row per frame. self.visible marks, for each frame and
+        view, whether the view has pixel coordinates for the object.
         """
-        for key in self.tracksDict.keys():
-            if self.tracksDict[key].viewNumber == 1:
-                self.matrices[0]=self.tracksDict[key].matrix
-                
-            elif self.tracksDict[key].viewNumber == 2:
-                self.matrices[1]=self.tracksDict[key].matrix
-                     
-            elif self.tracksDict[key].viewNumber == 3:
-                self.matrices[2]=self.tracksDict[key].matrix
-                       
-            elif self.tracksDict[key].viewNumber == 4:
-                self.matrices[3]=self.tracksDict[key].matrix
-                       
-    def find3DCoordinates(self):
+        views=sorted(self.tracksDict.values(), key=lambda track: track.viewNumber or 0)
+        self.views=views
+        if not views:
+            return None
+
+        nmbFrames=max(len(track.matrix) for track in views)
+        self.matrices=[]
+        for track in views:
+            matrix=np.full((nmbFrames, 2), np.nan)
+            matrix[:len(track.matrix)]=track.matrix
+            self.matrices.append(matrix)
 
-        """Uses DLT.DLTrecon() to determine 3D location of tracked object
+        self.visible=np.all(np.isfinite(np.stack(self.matrices, axis=1)), axis=2)
 
-        TODO: Add functionality to handle self.nc>2      
+        self.candidates=None
+        if all(track.candidates is not None for track in views):
+            K=max(track.candidates.shape[1] for track in views)
+            self.candidates=np.full((nmbFrames, len(views), K, 2), np.nan)
+            for (view, track) in enumerate(views):
+                self.candidates[:len(track.candidates), view, 0:track.candidates.shape[1]]=track.candidates
+            #Frames blanked in a track stay blank
+            self.candidates[~self.visible]=np.nan
 
-        1 - Gets calibration coefficients
-        2 - Creates self.xys array full of zeros
-        3 - Reconstructs the xyz coordinate frame by frame
-                - places pixel coordinates for each view in i_px_coords
-                - sends i_px_coords to get reconstructed
-                - breaks if there is an error in the loop
-                - will print error statement in DLT()
-        4 - sets self.xyz as a pandas dataframe
-        5 - populates self.pp_TV and sets label text  
+    def find3DCoordinates(self):
+
+        """Uses the CalibrationModel of the loaded calibration to determine 3D location of tracked object
+
+        1 - Gets calibration coefficients and model
+        2 - Reconstructs the xyz coordinates of all frames at once
+                - stacks the pixel coordinates of each view, or, when every
+                  track has candidate blobs, picks the candidate of each view
+                  that reprojects best with CalibrationModel.match(); frames
+                  edited in 2D processing (interpolated, smoothed or changed
+                  by hand, so no longer the largest candidate) keep their
+                  edited coordinates
+                - sends them and the views that saw them to CalibrationModel.reconstruct()
+                - frames seen by less than two views are left blank (NaN)
+        3 - sets self.xyz as a pandas dataframe, with the reprojection error of
+            each view (in pixels) in columns reproj_err_v1, reproj_err_v2, ...
+        4 - populates self.pp_TV and sets label text  
         """
         
         ## calibration coefficients 
         self.coefficients=self.MainWindow.calib.coefficients
+        ## CalibrationModel of the calibration
+        self.model=self.MainWindow.calib.model
 
-        if self.nc==2:
-            ## Array (or pd.DataFrame) containing 3D reconstructed points
-            self.xyz = np.zeros((len(self.matrices[0]), 3))
-
-            for i in range(len(self.matrices[0])):
-                i_px_coords=[]
-                for view in self.matrices:
-                    i_px_coords.append(view[i])
-                self.xyz[i,:], ret = self.DLT.DLTrecon(self.nd, self.nc, self.coefficients, i_px_coords) 
-                if ret == False:
-                    break     
+        if self.nc < 2:
+            self.MainWindow.errMessage="At least two views are needed for 3D reconstruction. Load more tracks and try again."
+            self.MainWindow.errorTitle="Not enough views!"
+            self.MainWindow.errorMsg()
+            return None
 
-            if ret == True:
-                self.xyz = pd.DataFrame(self.xyz, columns=['x', 'y', 'z'])
-        
-                self.populate_table()
-                self.MainWindow.tableItem_l.setText('Showing 3D coordinates of reconstructed track')
+        if self.model.nc != self.nc:
+            self.MainWindow.errMessage="Number of views (%d) and number of sets of camera calibration parameters (%d) are different. Either add/remove views or load the correct calibration file." % (self.nc, self.model.nc)
+            self.MainWindow.errorTitle="Wrong # of views!"
+            self.MainWindow.errorMsg()
+            return None
 
-        # Add additional camera functionality here
-        if self.nc==3:
-            pass
-        if self.nc==4:
-            pass
+        uvs=np.stack(self.matrices, axis=1)
+        visible=self.visible
+        rematched=0
+        edited=0
+        if self.candidates is not None:
+            matched, xyz, residual=self.model.match(self.candidates, self.maxResidual)
+            #Only frames where every view still holds its largest candidate (or is blank in both) are rematched
+            largest=self.candidates[:, :, 0]
+            with np.errstate(invalid='ignore'):
+                unedited=np.all((np.abs(largest - uvs) <= 0.01) | (np.isnan(largest) & np.isnan(uvs)), axis=(1, 2))
+                rematched=(np.any(np.abs(matched - uvs) > 1., axis=(1, 2)) & unedited & np.isfinite(matched).any(axis=(1, 2))).sum()
+            edited=(~unedited).sum()
+            uvs=np.where(unedited[:, np.newaxis, np.newaxis], matched, uvs)
+            visible=np.all(np.isfinite(uvs), axis=2)
+        xyz=self.model.reconstruct(uvs, visible, refine=self.refineTriangulation)
+
+        ## pd.DataFrame containing 3D reconstructed points and their reprojection errors
+        self.xyz = pd.DataFrame(xyz, columns=['x', 'y', 'z'])
+        ## (frames, views) reprojection errors in pixels
+        self.reprojectionError=self.model.reprojectionError(xyz, uvs, visible)
+        for view in range(self.nc):
+            self.xyz['reproj_err_v%d' % (view+1)]=self.reprojectionError[:, view]
+
+        with np.errstate(invalid='ignore'):
+            flagged=(np.fmax.reduce(self.reprojectionError, axis=1) > self.reprojectionThreshold).sum()
+
+        nmbViews=visible.sum(axis=1)
+        self.populate_table()
+        self.MainWindow.tableItem_l.setText('Showing 3D coordinates of reconstructed track (%d frames from all %d views, %d from a subset, %d not seen by two views, %d with a reprojection error above %g px, %d matched to other than the largest blobs, %d kept as edited in 2D processing)'
+            % ((nmbViews == self.nc).sum(), self.nc, ((nmbViews >= 2) & (nmbViews < self.nc)).sum(), (nmbViews < 2).sum(), flagged, self.reprojectionThreshold, rematched, edited))
 
 
     def plot3DPoints(self):
@@ -1964,12 +2077,15 @@ class Calibration:
         for index, row in self.dfCoefficients.iterrows():
             self.coefficients.append(np.asarray(list(row)))
 
+        ## Reconstruction and projection operators, built once for the calibration
+        self.model=calibrationModel.CalibrationModel(self.coefficients)
+
         self.calNumber=None
 
     def populateTable(self):
 
         self.calTable_orig=pd.read_csv(self.fileobj,header=None)
-        self.calTable_orig.columns= ['L1','L2','L3','L4','L5','L6','L7','L8','L9','L10','L11','L12']
+        self.calTable_orig.columns= ['L%d' % (i+1) for i in range(len(self.calTable_orig.columns))]
            
         self.calTable=self.calTable_orig.copy(deep=True)
         self.MainWindow.pp_TV.setModel(PandasModel(self.calTable))
@@ -1980,10 +2096,23 @@ class TrackProcessing():
         self.MainWindow=MainWindow
         self.fileobj=fileobj
         
-        self.orig_df=pd.read_csv(self.fileobj,header=None)
-        self.orig_df.columns= ['Image frame', 'x_px','y_px']
+        try:
+            self.orig_df, self.metadata=trackStorage.loadTrack(self.fileobj, columns=['Image frame', 'x_px','y_px'])
+        except ValueError:
+            #Multi-target tracks have a fourth column of track ids
+            self.orig_df, self.metadata=trackStorage.loadTrack(self.fileobj, columns=['Image frame', 'x_px','y_px','track_id'])
+        self.orig_df=self.orig_df.astype(float)
+
+        ## Track ids of a multi-target track, None for a single target
+        self.trackIDs=None
+        if 'track_id' in self.orig_df.columns:
+            ids, counts=np.unique(self.orig_df['track_id'], return_counts=True)
+            self.trackIDs=list(ids.astype(int))
+            ## Track id of the target used, the longest track by default
+            self.targetID=int(ids[np.argmax(counts)])
+            self.orig_df=self.selectTarget(self.orig_df, self.targetID)
+        #Sub-pixel centroids are kept as tracked
         self.orig_df=self.orig_df.replace(0.0, np.nan)
-        self.orig_df=self.orig_df.round(0)
            
         self.df=self.orig_df.copy(deep=True)
 
@@ -1991,14 +2120,43 @@ class TrackProcessing():
         self.trackID=os.path.splitext(self.basename)[0]
         
         self.getMatrix()
-        self.viewNumber=None
+        self.viewNumber=self.metadata.get('view')
+
+        ## Noise of the constant velocity model of kalmanSmooth(): acceleration
+        ## (pixels/frame^2) and tracked positions (pixels)
+        self.kalmanProcessNoise=2.
+        self.kalmanMeasurementNoise=1.
+
+        ## (frames, K, 2) candidate blobs saved next to the track by the tracker, None without
+        self.candidates=None
+        candidatesPath=trackingEngine.candidatesPath(self.fileobj)
+        if os.path.exists(candidatesPath):
+            candidates=np.load(candidatesPath).astype(float)
+            if len(candidates) == len(self.df):
+                self.candidates=candidates
+
+    def selectTarget(self, df, targetID):
+        """Returns the rows of one target of a multi-target track, one row per frame
+        from the first to the last frame of the track (NaN where the target was not
+        seen), like a single target track."""
+
+        frames=np.arange(df['Image frame'].min(), df['Image frame'].max() + 1)
+        target=df[df['track_id'] == targetID].drop_duplicates('Image frame')
+        target=target.set_index('Image frame').reindex(frames)
+        target.index.name='Image frame'
+        return target.reset_index()
 
     def saveTrack(self):
 
         print('this is the right function')
-        path = PyQt5.QtWidgets.QFileDialog.getSaveFileName(None, 'Save track as ...', self.MainWindow.path, 'CSV(*.csv)')[0]
+        path = PyQt5.QtWidgets.QFileDialog.getSaveFileName(None, 'Save track as ...', self.MainWindow.path, 'CSV(*.csv);;NPZ(*.npz)')[0]
+        if path == '':
+            return None
 
-        self.df.to_csv(path, header=False,index=False)        
+        metadata=dict(self.metadata)
+        if self.viewNumber is not None:
+            metadata['view']=self.viewNumber
+        trackStorage.saveTrack(path, self.df, metadata, header=False)
 
     def plotNoConditions(self):
         
@@ -2051,13 +2209,25 @@ class TrackProcessing():
     def interpolateBlanks(self):
 
         self.df=self.df.interpolate(limit_direction='both', limit_area='inside')
-        self.df=round(self.df)
+        self.populateTable()
+        self.plot_pixel_coordinates()
+
+    def kalmanSmooth(self):
+        """Smooths the pixel coordinates with a constant velocity Kalman filter run
+        forward and backward over the track (tracking.kalmanTracker.kalmanSmooth).
+        Blank rows stay blank, interpolate them first to fill them from the model.
+        """
+
+        positions=self.df[['x_px','y_px']].to_numpy(dtype=float)
+        smoothed=kalmanTracker.kalmanSmooth(positions, self.kalmanProcessNoise, self.kalmanMeasurementNoise)
+        self.df['x_px']=smoothed[:, 0]
+        self.df['y_px']=smoothed[:, 1]
         self.populateTable()
         self.plot_pixel_coordinates()
 
     def getMatrix(self):
         self.matrix = self.df[['x_px','y_px']]
-        self.matrix = self.matrix.as_matrix(columns=None)
+        self.matrix = self.matrix.to_numpy(dtype=float)
 
     def errorMsg(self):
         msg = PyQt5.QtWidgets.QMessageBox()
@@ -2068,9 +2238,11 @@ class TrackProcessing():
         retval = msg.exec_()        
      
 
-app = PyQt5.QtWidgets.QApplication(sys.argv)
-app.aboutToQuit.connect(app.deleteLater)
-form = MainWindow()
-form.show()
-app.exec_()
+if __name__ == '__main__':
+    #The guard keeps worker processes, which import this module on some platforms, from opening the GUI again
+    app = PyQt5.QtWidgets.QApplication(sys.argv)
+    app.aboutToQuit.connect(app.deleteLater)
+    form = MainWindow()
+    form.show()
+    app.exec_()
 
@@ -37,9 +37,7 @@ class postProcessing3D:
     def find_3D_coordinates(self):
         self.nd=3
         self.nc=2 
-        self.xyz = np.zeros((len(self.image_points_1), 3))
-        for i in range(len(self.image_points_1)):
-            self.xyz[i,:] = DLT.DLTrecon(self.nd, self.nc, self.calibrations, [self.image_points_1[i],self.image_points_2[i]])      
+        self.xyz = DLT.DLTrecon_batch(self.calibrations, np.stack(self.image_points_together, axis=1))
         self.xyz = pd.DataFrame(self.xyz, columns=['x', 'y', 'z'])
         
         if self.MainWindow.save_3D_track_cb.isChecked()==True:
@@ -11,6 +11,8 @@ import pandas as pd
 from glob import glob
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
+from pytracker3D.util import trackStorage
+from pytracker3D.util import trackStore
 
 
 def find_3D_tracks(path,prefix,extension):
@@ -34,18 +36,50 @@ def convert_to_dataframes(csvList):
     """Convert list of 3D tracks into pandas dataframes.
     
     Args:
-    csvList  (str): list containing 3D tracks to be converted to dataframes
+    csvList  (str): list containing 3D tracks (.csv, .npz or .parquet) to be
+                    converted to dataframes
     
     Returns:
     bool: list of pandas dataframes containing 3D tracks.
     """
     dataframes=[]
     for file in csvList:
-        dat = pd.read_csv(file, sep=',', engine='python') 
+        dat, metadata = trackStorage.loadTrack(file)
     
         dataframes.append(dat)
     return dataframes
 
+def build_track_store(path,prefix,extension,store_path):
+    """Write all 3D tracks found by find_3D_tracks into a single store file.
+    
+    Args:
+    path       (str): Path to folder to look in.
+    prefix     (str): User selected prefix used to identify 3D tracks.
+    extension  (str): File pattern of the tracks, e.g. '*.csv'.
+    store_path (str): Store file to write.
+    
+    Returns:
+    TrackStore: the memory mapped store, tracks keyed by their path relative to
+    the folder holding all of them (see trackStore.buildStore).
+    """
+    return trackStore.buildStore(store_path, find_3D_tracks(path,prefix,extension))
+
+def iterate_tracks(store,function,*args,**keyword_parameters):
+    """Lazily apply an analysis (e.g. smooth, calculate_vel_components or
+    check_direction) to every track of a TrackStore, one track at a time.
+    
+    Args:
+    store (TrackStore): store opened with trackStore.TrackStore(path)
+    function    (func): function taking a track dataframe as first argument
+    ids         (list): optional keyword, track ids to analyze (all by default)
+    
+    Returns:
+    generator: (track id, dataframe returned by function) pairs.
+    """
+    ids=keyword_parameters.pop('ids',None)
+    for track_id, df in store.tracks(ids):
+        yield track_id, function(df,*args,**keyword_parameters)
+
 
 def plot_2D_lines(df,columns,limits):
     """Plot multiple columms of a pandas dataframe on a line graph.
@@ -141,8 +175,9 @@ def smooth(df,columns,names,period,**keyword_parameters):
     """
     df=deepcopy(df)
     for i in range(len(columns)):
-        df[names[i]]=pd.rolling(df[columns[i]],period).mean()
+        df[names[i]]=df[columns[i]].rolling(period).mean()
             
+    shift=False
     if ('shift' in keyword_parameters):
         shift = keyword_parameters['shift']
     
@@ -61,7 +61,7 @@ This code is based on different implementations and teaching material on DLT
 
 import numpy as N
 
-def DLTcalib(nd, xyz, uv):
+def DLTcalib(nd, xyz, uv, weights=None):
     '''
     Camera calibration by DLT using known object points and their image points.
 
@@ -74,6 +74,9 @@ def DLTcalib(nd, xyz, uv):
      The coordinates (x,y,z and u,v) are given as columns and the different points as rows.
      For the 2D DLT (object planar space), only the first 2 columns (x and y) are used.
      There must be at least 6 calibration points for the 3D DLT and 4 for the 2D DLT.
+     weights (optional) are the relative weights of the points in the least squares
+      solution, e.g. to trust some markers less than others. Points with zero weight
+      are ignored.
     Outputs:
      L: array of the 8 or 11 parameters of the calibration matrix
      err: error of the DLT (mean residual of the DLT transformation in units of camera coordinates).
@@ -98,22 +101,14 @@ def DLTcalib(nd, xyz, uv):
     Txyz, xyzn = Normalization(nd, xyz)
     Tuv, uvn = Normalization(2, uv)
 
-    A = []
-    if nd == 2: #2D DLT
-        for i in range(np):
-            x,y = xyzn[i,0], xyzn[i,1]
-            u,v = uvn[i,0], uvn[i,1]
-            A.append( [x, y, 1, 0, 0, 0, -u*x, -u*y, -u] )
-            A.append( [0, 0, 0, x, y, 1, -v*x, -v*y, -v] )
-    elif nd == 3: #3D DLT
-        for i in range(np):
-            x,y,z = xyzn[i,0], xyzn[i,1], xyzn[i,2]
-            u,v = uvn[i,0], uvn[i,1]
-            A.append( [x, y, z, 1, 0, 0, 0, 0, -u*x, -u*y, -u*z, -u] )
-            A.append( [0, 0, 0, 0, x, y, z, 1, -v*x, -v*y, -v*z, -v] )
-
-    #convert A to array
-    A = N.asarray(A) 
+    A = DesignMatrix(nd, xyzn, uvn)
+    if weights is not None:
+        weights = N.asarray(weights, dtype=float)
+        if weights.shape != (np,):
+            raise ValueError('weights must have one value per point (%d), not shape %s.' %(np, str(weights.shape)))
+        #Both rows of a point are scaled by the square root of its weight
+        A = A * N.repeat(N.sqrt(weights), 2)[:,N.newaxis]
+
     #Find the 11 (or 8 for 2D DLT) parameters:
     U, S, Vh = N.linalg.svd(A)
     #The parameters are in the last line of Vh and normalize them:
@@ -123,7 +118,7 @@ def DLTcalib(nd, xyz, uv):
     #Denormalization:
     H = N.dot( N.dot( N.linalg.pinv(Tuv), H ), Txyz );
     H = H / H[-1,-1]
-    L = H.flatten(0)
+    L = H.flatten()
     #Mean error of the DLT (mean residual of the DLT transformation in units of camera coordinates):
     uv2 = N.dot( H, N.concatenate( (xyz.T, N.ones((1,xyz.shape[0]))) ) ) 
     uv2 = uv2/uv2[2,:] 
@@ -188,6 +183,495 @@ def DLTrecon(nd, nc, Ls, uvs):
     return xyz
 
 
+
+def DLTrecon_batch(Ls, uvs, visible=None):
+    '''
+    Reconstruction of many object points at once based on the DLT parameters.
+
+    Vectorized version of DLTrecon: the linear systems of all points are built
+    with numpy broadcasting and solved with a single stacked SVD, which avoids
+    one Python call and one small SVD per point.
+    Inputs:
+     Ls (array type) are the camera calibration parameters of each camera 
+      (is the output of DLTcalib function), one row per camera. The number of
+      parameters per camera (9 for 2D DLT, 12 for 3D DLT) sets the number of
+      dimensions and the number of rows sets the number of cameras (views).
+     uvs are the coordinates of the points in the image 2D space of each camera,
+      given as an array of shape (N, nc, 2): N points seen by nc cameras.
+     visible (optional) is a boolean array of shape (N, nc) telling which cameras
+      saw each point. By default a view is visible where its coordinates are not NaN.
+      Each point is solved from its visible views only; points seen by fewer than
+      2 cameras (1 for 2D DLT) are not reconstructed.
+    Outputs:
+     xyz: (N, nd) array of point coordinates in space (NaN where not reconstructed)
+    '''
+
+    #Convert Ls and uvs to arrays:
+    Ls, nd, distortion = CameraParameters(Ls)
+    uvs = N.asarray(uvs, dtype=float)
+    nc = Ls.shape[0]
+    if uvs.ndim == 2 and nc == 1:
+        uvs = uvs[:,N.newaxis,:]
+    #Check the parameters:
+    if uvs.ndim != 3 or uvs.shape[2] != 2:
+        raise ValueError('uvs must have shape (N, nc, 2), not %s.' %(str(uvs.shape)))
+    if uvs.shape[1] != nc:
+        raise ValueError('Number of views (%d) and number of sets of camera calibration parameters (%d) are different.' %(uvs.shape[1], nc))
+    if nd == 3 and nc < 2:
+        raise ValueError('At least two sets of camera calibration parameters are needed for 3D point reconstruction.')
+
+    if visible is None:
+        visible = N.all(N.isfinite(uvs), axis=2)
+    else:
+        visible = N.asarray(visible, dtype=bool) & N.all(N.isfinite(uvs), axis=2)
+    if visible.shape != uvs.shape[0:2]:
+        raise ValueError('visible must have shape %s, not %s.' %(str(uvs.shape[0:2]), str(visible.shape)))
+    if distortion is not None:
+        uvs = DLTundistort(distortion, Ls, uvs)
+
+    xyz = N.full((uvs.shape[0], nd), N.nan)
+    valid = N.sum(visible, axis=1) >= (2 if nd == 3 else 1)
+    #Views that did not see a point get zero coordinates; their rows are removed from M below
+    uv = N.where(visible[valid][:,:,N.newaxis], uvs[valid], 0.)
+
+    if nc == 1: #2D and 1 camera (view), the simplest (and fastest) case
+        Hinv = N.linalg.inv( Ls.reshape(3,3) )
+        uv1 = N.concatenate((uv[:,0,:], N.ones((uv.shape[0],1))), axis=1)
+        rec = N.dot(uv1, Hinv.T)
+        xyz[valid] = rec[:,0:2]/rec[:,2:3]
+    else:
+        #Rows of each camera's projection matrix: P[c] = [[L1..L4],[L5..L8],[L9..L12]] for 3D DLT
+        P = Ls.reshape(nc, 3, nd+1)
+        #M[n,c,0] = P[c,0]-u*P[c,2] and M[n,c,1] = P[c,1]-v*P[c,2], as in DLTrecon
+        M = P[N.newaxis,:,0:2,:] - uv[:,:,:,N.newaxis]*P[N.newaxis,:,2:3,:]
+        #Zero rows do not change the solution, so hidden views simply drop out of the system
+        M = M * visible[valid][:,:,N.newaxis,N.newaxis]
+        M = M.reshape(uv.shape[0], 2*nc, nd+1)
+        #Find the xyz coordinates of all points with one stacked SVD:
+        U, S, Vh = N.linalg.svd(M, full_matrices=False)
+        #Point coordinates in space:
+        xyz[valid] = Vh[:,-1,0:-1] / Vh[:,-1,-1:]
+
+    return xyz
+
+def DLTproject(Ls, xyz):
+    '''
+    Projection of object points into the image of each camera based on the DLT parameters.
+
+    Inputs:
+     Ls (array type) are the camera calibration parameters of each camera, one row
+      per camera (8 or 9 parameters for 2D DLT, 11 or 12 for 3D DLT, 16 for the
+      extended 3D DLT with lens distortion).
+     xyz are the coordinates of the points in space, shape (N, nd).
+    Outputs:
+     uvs: (N, nc, 2) array of image coordinates of every point in every camera,
+      (N, 2) if Ls holds the parameters of a single camera as a 1D array.
+    '''
+
+    single = N.ndim(Ls) == 1
+    Ls, nd, distortion = CameraParameters(Ls)
+    xyz = N.asarray(xyz, dtype=float)
+    if xyz.ndim != 2 or xyz.shape[1] != nd:
+        raise ValueError('xyz must have shape (N, %d), not %s.' %(nd, str(xyz.shape)))
+
+    P = Ls.reshape(Ls.shape[0], 3, nd+1)
+    X = N.concatenate((xyz, N.ones((xyz.shape[0],1))), axis=1)
+    uvw = N.einsum('cij,nj->nci', P, X)
+    uvs = uvw[:,:,0:2] / uvw[:,:,2:3]
+    if distortion is not None:
+        uvs = DLTdistort(distortion, Ls, uvs)
+    return uvs[:,0,:] if single else uvs
+
+
+def DLTreprojection_error(Ls, xyz, uvs):
+    '''
+    Distance (in pixels) between measured image points and the projection of their
+    reconstructed object points, for every point and camera.
+
+    Inputs:
+     Ls: calibration parameters, as for DLTproject.
+     xyz: (N, nd) reconstructed points.
+     uvs: (N, nc, 2) measured image coordinates.
+    Outputs:
+     err: (N, nc) array, NaN where the point was not reconstructed or not seen by the camera.
+    '''
+
+    uvs = N.asarray(uvs, dtype=float)
+    proj = DLTproject(N.atleast_2d(Ls), xyz)
+    return N.sqrt(N.sum((proj - uvs.reshape(proj.shape))**2, axis=2))
+
+
+def CameraParameters(Ls):
+    '''
+    Splits calibration parameters into the linear DLT parameters and the lens distortion terms.
+
+    Inputs:
+     Ls: calibration parameters, one row per camera, with 8 or 9 (2D DLT), 11 or 12
+      (3D DLT) or 16 (extended 3D DLT: L1 to L11 then the distortion terms L12 to L16) columns.
+    Outputs:
+     Ls: (nc, 9) or (nc, 12) array of linear parameters, the last one set to 1 where missing
+     nd: number of dimensions
+     distortion: (nc, 5) array of distortion terms, None without distortion
+    '''
+
+    Ls = N.atleast_2d(N.asarray(Ls, dtype=float))
+    nc = Ls.shape[0]
+    distortion = None
+    if Ls.shape[1] == 16:
+        distortion = Ls[:,11:16]
+        Ls = Ls[:,0:11]
+    if Ls.shape[1] in (8, 11): #the last parameter is normalized to 1 by DLTcalib
+        Ls = N.concatenate((Ls, N.ones((nc,1))), axis=1)
+    if Ls.shape[1] == 9:
+        nd = 2
+    elif Ls.shape[1] == 12:
+        nd = 3
+    else:
+        raise ValueError('Calibration parameters must have 8, 9, 11, 12 or 16 columns, not %d.' %(Ls.shape[1]))
+    return Ls, nd, distortion
+
+
+def DLTprincipal_point(Ls):
+    '''
+    Principal point (u0, v0) of each camera from its 3D DLT parameters, shape (nc, 2).
+    '''
+
+    Ls = N.atleast_2d(N.asarray(Ls, dtype=float))
+    d = N.sum(Ls[:,8:11]**2, axis=1)
+    u0 = N.sum(Ls[:,0:3]*Ls[:,8:11], axis=1) / d
+    v0 = N.sum(Ls[:,4:7]*Ls[:,8:11], axis=1) / d
+    return N.stack((u0, v0), axis=1)
+
+
+def DLTdistortion(distortion, Ls, uvs):
+    '''
+    Lens distortion correction of the extended (16 parameter) DLT.
+
+    With xi, eta the image coordinates relative to the principal point and
+    r2 = xi**2 + eta**2, the measured coordinates (u, v) are corrected to
+    (u + du, v + dv), which follow the linear DLT, where
+      du = xi*(L12*r2 + L13*r2**2 + L14*r2**3) + L15*(r2 + 2*xi**2) + L16*xi*eta
+      dv = eta*(L12*r2 + L13*r2**2 + L14*r2**3) + L15*xi*eta + L16*(r2 + 2*eta**2)
+    Inputs:
+     distortion: (nc, 5) terms L12 to L16 of each camera
+     Ls: (nc, 12) linear parameters of each camera
+     uvs: (N, nc, 2) measured image coordinates
+    Outputs:
+     (N, nc, 2) corrections (du, dv)
+    '''
+
+    xi = uvs - DLTprincipal_point(Ls)[N.newaxis]
+    r2 = N.sum(xi**2, axis=2)
+    k = distortion[N.newaxis]
+    radial = k[:,:,0]*r2 + k[:,:,1]*r2**2 + k[:,:,2]*r2**3
+    cross = xi[:,:,0]*xi[:,:,1]
+    du = xi[:,:,0]*radial + k[:,:,3]*(r2 + 2*xi[:,:,0]**2) + k[:,:,4]*cross
+    dv = xi[:,:,1]*radial + k[:,:,3]*cross + k[:,:,4]*(r2 + 2*xi[:,:,1]**2)
+    return N.stack((du, dv), axis=2)
+
+
+def DLTundistort(distortion, Ls, uvs):
+    '''Corrects measured (N, nc, 2) image coordinates for lens distortion, see DLTdistortion.'''
+
+    uvs = N.asarray(uvs, dtype=float)
+    return uvs + DLTdistortion(distortion, Ls, uvs)
+
+
+def DLTdistort(distortion, Ls, uvs, iterations=20):
+    '''Inverse of DLTundistort: measured coordinates of linear DLT (N, nc, 2) projections,
+    found by fixed point iteration.'''
+
+    uvs = N.asarray(uvs, dtype=float)
+    measured = uvs.copy()
+    for i in range(iterations):
+        measured = uvs - DLTdistortion(distortion, Ls, measured)
+    return measured
+
+
+def DLTcalib_refine(nd, xyz, uv, L=None, distortion=False, iterations=100, tolerance=1e-12):
+    '''
+    Non-linear refinement of a DLT camera calibration (Levenberg-Marquardt).
+
+    The linear DLT minimizes an algebraic error; this refinement minimizes the
+    reprojection error in pixels instead, starting from the linear solution.
+    With distortion=True (3D DLT only) the five lens distortion terms of the
+    extended DLT (see DLTdistortion) are estimated as well.
+    Inputs:
+     nd, xyz, uv: as for DLTcalib.
+     L: initial parameters, by default the result of DLTcalib.
+     distortion: estimate the lens distortion terms.
+     iterations, tolerance: stopping criteria on the number of iterations and
+      the relative decrease of the squared error.
+    Outputs:
+     L: 9 (2D), 12 (3D) or 16 (3D with distortion) parameters
+     err: root mean square reprojection error in pixels
+    '''
+
+    xyz = N.asarray(xyz, dtype=float)[:,0:nd]
+    uv = N.asarray(uv, dtype=float)
+    if distortion and nd != 3:
+        raise ValueError('Lens distortion terms are only available for 3D DLT.')
+    if L is None:
+        L, err = DLTcalib(nd, xyz, uv)
+    L = N.asarray(L, dtype=float)
+    nl = 3*(nd+1) - 1
+    p = L[0:nl] / (L[nl] if len(L) > nl and len(L) != 16 else 1.)
+
+    #The distortion terms are optimized in units of the image size to keep the problem well conditioned
+    scale = N.sqrt(N.mean(N.sum((uv - N.mean(uv, axis=0))**2, axis=1)))
+    units = N.array([scale**2, scale**4, scale**6, scale, scale])
+    if distortion:
+        k = L[11:16] if len(L) == 16 else N.zeros(5)
+        p = N.concatenate((p, k*units))
+
+    X = N.concatenate((xyz, N.ones((xyz.shape[0],1))), axis=1)
+
+    def residuals(p):
+        H = N.append(p[0:nl], 1.).reshape(3, nd+1)
+        proj = N.dot(X, H.T)
+        proj = proj[:,0:2] / proj[:,2:3]
+        corrected = uv
+        if distortion:
+            corrected = uv + DLTdistortion((p[nl:]/units)[N.newaxis], H.reshape(1,-1), uv[:,N.newaxis,:])[:,0,:]
+        return (corrected - proj).ravel()
+
+    #Finite difference steps relative to the size of each group of parameters (the scaled distortion terms are of order 1 at most)
+    typical = N.ones(len(p))
+    for group in [N.arange(0, 2*(nd+1)), N.arange(2*(nd+1), nl)]:
+        typical[group] = max(N.max(N.abs(p[group])), 1e-12)
+
+    r = residuals(p)
+    cost = N.dot(r, r)
+    lam = 1e-3
+    for it in range(iterations):
+        h = 1e-6*N.maximum(N.abs(p), 1e-3*typical)
+        J = N.empty((len(r), len(p)))
+        for j in range(len(p)):
+            dp = N.zeros(len(p))
+            dp[j] = h[j]
+            J[:,j] = (residuals(p + dp) - residuals(p - dp)) / (2*h[j])
+        A = N.dot(J.T, J)
+        g = N.dot(J.T, r)
+        while lam < 1e12:
+            step = N.linalg.solve(A + lam*N.diag(N.diag(A)), -g)
+            rNew = residuals(p + step)
+            costNew = N.dot(rNew, rNew)
+            if costNew < cost:
+                break
+            lam = lam*10
+        else:
+            break
+        p, r = p + step, rNew
+        lam = max(lam/10, 1e-12)
+        converged = cost - costNew < tolerance*cost
+        cost = costNew
+        if converged:
+            break
+
+    err = N.sqrt(cost / len(uv))
+    if distortion:
+        return N.concatenate((p[0:nl], p[nl:]/units)), err
+    return N.append(p[0:nl], 1.), err
+
+
+def DLTrecon_refine(Ls, uvs, visible=None, xyz=None, iterations=10):
+    '''
+    Non-linear refinement of reconstructed points (Gauss-Newton with Levenberg-Marquardt damping).
+
+    Each point is moved to minimize the sum of its squared reprojection errors over
+    the cameras that saw it, starting from the linear DLTrecon_batch solution. All
+    points are refined together with (N, nd, nd) normal equations.
+    Inputs:
+     Ls, uvs, visible: as for DLTrecon_batch (Ls may have the 16 parameters of the
+      extended DLT, the image points are then corrected for distortion first).
+     xyz: (N, nd) initial points, by default DLTrecon_batch(Ls, uvs, visible).
+     iterations: number of iterations.
+    Outputs:
+     xyz: (N, nd) refined points, NaN where not reconstructed
+    '''
+
+    Ls, nd, distortion = CameraParameters(Ls)
+    nc = Ls.shape[0]
+    uvs = N.asarray(uvs, dtype=float)
+    if uvs.ndim == 2 and nc == 1:
+        uvs = uvs[:,N.newaxis,:]
+    if visible is None:
+        visible = N.all(N.isfinite(uvs), axis=2)
+    else:
+        visible = N.asarray(visible, dtype=bool) & N.all(N.isfinite(uvs), axis=2)
+    if distortion is not None:
+        uvs = DLTundistort(distortion, Ls, uvs)
+    if xyz is None:
+        xyz = DLTrecon_batch(Ls, uvs, visible)
+    xyz = N.array(xyz, dtype=float)
+
+    valid = N.all(N.isfinite(xyz), axis=1)
+    P = Ls.reshape(nc, 3, nd+1)
+    uv = N.where(visible[valid][:,:,N.newaxis], uvs[valid], 0.)
+    weight = visible[valid][:,:,N.newaxis].astype(float)
+    X = xyz[valid]
+
+    def evaluate(X):
+        Xh = N.concatenate((X, N.ones((X.shape[0],1))), axis=1)
+        a = N.einsum('cij,nj->nci', P, Xh)
+        proj = a[:,:,0:2] / a[:,:,2:3]
+        r = (proj - uv)*weight
+        return a, proj, r, N.sum(r**2, axis=(1,2))
+
+    a, proj, r, cost = evaluate(X)
+    lam = N.full(X.shape[0], 1e-3)
+    for it in range(iterations):
+        #d(u, v)/dX = (P[c,0:2,0:nd] - (u, v)*P[c,2,0:nd]) / w
+        J = (P[N.newaxis,:,0:2,0:nd] - proj[:,:,:,N.newaxis]*P[N.newaxis,:,2:3,0:nd]) / a[:,:,2:3,N.newaxis]
+        J = J*weight[:,:,:,N.newaxis]
+        A = N.einsum('ncki,nckj->nij', J, J)
+        g = N.einsum('ncki,nck->ni', J, r)
+        D = A*(1. + lam[:,N.newaxis,N.newaxis]*N.eye(nd))
+        step = N.linalg.solve(D + 1e-12*N.eye(nd), -g[:,:,N.newaxis])[:,:,0]
+        aNew, projNew, rNew, costNew = evaluate(X + step)
+        better = costNew < cost
+        X[better] = X[better] + step[better]
+        a[better], proj[better], r[better], cost[better] = aNew[better], projNew[better], rNew[better], costNew[better]
+        lam = N.where(better, lam/10, lam*10)
+
+    xyz[valid] = X
+    return xyz
+
+
+def DesignMatrix(nd, xyzn, uvn):
+    '''
+    Linear system of the DLT calibration, built without looping over points.
+
+    Inputs:
+     nd: number of dimensions (2 for 2D; 3 for 3D)
+     xyzn, uvn: (normalized) object and image coordinates, points at rows. Any
+      leading dimensions are kept, e.g. (T, np, nd) for T sets of points.
+    Outputs:
+     A: (..., 2*np, 3*(nd+1)) matrix with, for each point, the rows
+      [x, y, z, 1, 0, 0, 0, 0, -u*x, -u*y, -u*z, -u] and
+      [0, 0, 0, 0, x, y, z, 1, -v*x, -v*y, -v*z, -v] (3D DLT)
+    '''
+
+    xyzn = N.asarray(xyzn, dtype=float)
+    uvn = N.asarray(uvn, dtype=float)
+    X = N.concatenate((xyzn[...,0:nd], N.ones(xyzn.shape[:-1]+(1,))), axis=-1)
+    O = N.zeros_like(X)
+    rowu = N.concatenate((X, O, -uvn[...,0:1]*X), axis=-1)
+    rowv = N.concatenate((O, X, -uvn[...,1:2]*X), axis=-1)
+    A = N.stack((rowu, rowv), axis=-2)
+    return A.reshape(A.shape[:-3]+(2*A.shape[-3], A.shape[-1]))
+
+
+def NormalizationBatch(nd, x):
+    '''
+    Normalization of many sets of points at once, as Normalization.
+
+    Inputs:
+     nd: number of dimensions (2 for 2D; 3 for 3D)
+     x: (T, np, nd) array, T sets of np points
+    Outputs:
+     Tr: (T, nd+1, nd+1) transformation matrices
+     x: the transformed data
+    '''
+
+    x = N.asarray(x, dtype=float)
+    m = N.mean(x, axis=1)
+    s = N.std(x.reshape(x.shape[0], -1), axis=1)
+    Tr = N.zeros((x.shape[0], nd+1, nd+1))
+    Tr[:,N.arange(nd),N.arange(nd)] = 1./s[:,N.newaxis]
+    Tr[:,0:nd,nd] = -m/s[:,N.newaxis]
+    Tr[:,nd,nd] = 1.
+    return Tr, (x - m[:,N.newaxis,:])/s[:,N.newaxis,N.newaxis]
+
+
+def DLTcalib_batch(nd, xyz, uv, subsets):
+    '''
+    DLT camera calibrations of many subsets of the calibration points at once.
+
+    The linear systems of all subsets are built and solved together with one
+    stacked SVD, which makes running hundreds of trial calibrations (see
+    DLTcalib_robust) cheap.
+    Inputs:
+     nd is the number of dimensions of the object space: 3 for 3D DLT and 2 for 2D DLT.
+     xyz, uv are the calibration points, as for DLTcalib.
+     subsets is a (T, k) integer array, each row the indices of the points of one
+      calibration (k at least 6 for 3D DLT and 4 for 2D DLT).
+    Outputs:
+     Ls: (T, 3*(nd+1)) array, the calibration parameters of each subset. Degenerate
+      subsets (e.g. coplanar points for 3D DLT) give meaningless or NaN parameters.
+    '''
+
+    xyz = N.asarray(xyz, dtype=float)[:,0:nd]
+    uv = N.asarray(uv, dtype=float)
+    subsets = N.asarray(subsets)
+    Txyz, xyzn = NormalizationBatch(nd, xyz[subsets])
+    Tuv, uvn = NormalizationBatch(2, uv[subsets])
+
+    A = DesignMatrix(nd, xyzn, uvn)
+    U, S, Vh = N.linalg.svd(A, full_matrices=True)
+    with N.errstate(divide='ignore', invalid='ignore'):
+        H = (Vh[:,-1,:] / Vh[:,-1,-1:]).reshape(-1, 3, nd+1)
+        #Denormalization:
+        H = N.matmul(N.matmul(N.linalg.inv(Tuv), H), Txyz)
+        H = H / H[:,-1:,-1:]
+    return H.reshape(H.shape[0], -1)
+
+
+def DLTcalib_robust(nd, xyz, uv, trials=500, threshold=3., subsetSize=None, seed=None, redundancy=2):
+    '''
+    Camera calibration by DLT that rejects mis-clicked calibration points (RANSAC).
+
+    trials calibrations on random minimal subsets of the points are solved at once
+    with DLTcalib_batch. The calibration that agrees with the most points (within
+    threshold pixels of reprojection error, ties broken by the smallest total error)
+    is kept, and the final parameters are computed by DLTcalib from all the points
+    that agree with it. Points are only rejected if at least redundancy points
+    beyond the subset size are left, otherwise all of them are kept: with the
+    usual 8 points of a 3D calibration, no point is rejected by default.
+    Inputs:
+     nd, xyz, uv: as for DLTcalib.
+     trials: number of random subsets tried.
+     threshold: largest reprojection error (in pixels) of a point kept as an inlier.
+     subsetSize: number of points per subset, by default the minimum (6 for 3D, 4 for 2D).
+     seed: seed of the random subsets, for repeatable results.
+     redundancy: number of points beyond subsetSize the inliers must count.
+    Outputs:
+     L, err: as for DLTcalib, computed from the inliers
+     inliers: boolean array, False for the points rejected as outliers
+    '''
+
+    xyz = N.asarray(xyz, dtype=float)
+    uv = N.asarray(uv, dtype=float)
+    np = xyz.shape[0]
+    k = subsetSize or 2*nd
+    if np < k + redundancy:
+        L, err = DLTcalib(nd, xyz, uv)
+        return L, err, N.ones(np, dtype=bool)
+
+    rng = N.random.default_rng(seed)
+    subsets = N.argsort(rng.random((trials, np)), axis=1)[:,0:k]
+    Hs = DLTcalib_batch(nd, xyz, uv, subsets).reshape(trials, 3, nd+1)
+
+    #Reprojection error of every point for every trial calibration:
+    X = N.concatenate((xyz[:,0:nd], N.ones((np,1))), axis=1)
+    with N.errstate(divide='ignore', invalid='ignore'):
+        proj = N.matmul(Hs, X.T)
+        proj = proj[:,0:2,:] / proj[:,2:3,:]
+        res = N.sqrt(N.sum((proj - uv.T[N.newaxis])**2, axis=1))
+    res[~N.isfinite(res)] = N.inf
+
+    inlier = res <= threshold
+    count = N.sum(inlier, axis=1)
+    cost = N.sum(N.where(inlier, res, 0.), axis=1)
+    best = N.lexsort((cost, -count))[0]
+    inliers = inlier[best]
+    if N.sum(inliers) < k + redundancy:
+        inliers = N.ones(np, dtype=bool)
+
+    L, err = DLTcalib(nd, xyz[inliers], uv[inliers])
+    return L, err, inliers
+
+
 def Normalization(nd,x):
     '''
     Normalization of coordinates (centroid to the origin and mean distance of sqrt(2 or 3).
@@ -0,0 +1,193 @@
+"""
+Experiment track store.
+
+A TrackStore holds many tracks with the same columns in a single file: the
+rows of all tracks are concatenated into one array that is memory mapped on
+opening, and a json index gives the first row and length of each track by
+its id. Tracks are only read from disk when they are sliced, so analyses can
+run over thousands of tracks without loading them all.
+
+File layout:
+
+    8 bytes   magic b'PT3DSTOR'
+    8 bytes   little endian uint64 offset of the index
+    ...       data, C ordered (rows, columns) array
+    ...       json index: columns, dtype, tracks {id: [first row, rows]}, metadata
+"""
+
+import json
+import os
+import struct
+
+import numpy as np
+import pandas as pd
+
+from pytracker3D.util import trackStorage
+
+
+magic=b'PT3DSTOR'
+## Offset of the data, after the magic and the index offset
+dataOffset=16
+
+
+class TrackStoreWriter():
+
+    """Appends tracks to a new store file, one track at a time.
+
+    Usage:
+        with TrackStoreWriter('experiment.pts', ['x', 'y', 'z']) as writer:
+            writer.add('fish_001', df)
+    """
+
+    def __init__(self, path, columns, dtype=np.float64):
+
+        self.path=path
+        self.columns=[str(column) for column in columns]
+        self.dtype=np.dtype(dtype)
+        self.tracks={}
+        self.metadata={}
+        self.rows=0
+
+        self.fp=open(path, 'wb')
+        self.fp.write(magic)
+        self.fp.write(struct.pack('<Q', 0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, trackID, df, metadata=None):
+        """Appends a track DataFrame, whose columns must be the columns of the store."""
+
+        trackID=str(trackID)
+        if trackID in self.tracks:
+            raise ValueError("Track '%s' is already in the store." % trackID)
+        if [str(column) for column in df.columns] != self.columns:
+            raise ValueError("Track '%s' has columns %s, the store has %s." % (trackID, list(df.columns), self.columns))
+
+        data=np.ascontiguousarray(df.to_numpy(dtype=self.dtype))
+        self.fp.write(data.tobytes())
+        self.tracks[trackID]=[self.rows, len(data)]
+        if metadata:
+            self.metadata[trackID]=metadata
+        self.rows=self.rows + len(data)
+
+    def close(self):
+        """Writes the index and closes the file."""
+
+        if self.fp.closed:
+            return None
+        indexOffset=self.fp.tell()
+        index={'columns': self.columns, 'dtype': self.dtype.str, 'rows': self.rows,
+               'tracks': self.tracks, 'metadata': self.metadata}
+        self.fp.write(json.dumps(index).encode())
+        self.fp.seek(len(magic))
+        self.fp.write(struct.pack('<Q', indexOffset))
+        self.fp.close()
+
+
+class TrackStore():
+
+    """Read only, memory mapped view of a store file.
+
+    Usage:
+        store=TrackStore('experiment.pts')
+        for trackID, df in store.tracks():
+            ...
+        xyz=store.array('fish_001')
+
+    array() returns a view of the mapped file without copying, track() a
+    DataFrame copy of one track.
+    """
+
+    def __init__(self, path):
+
+        self.path=path
+        with open(path, 'rb') as fp:
+            if fp.read(len(magic)) != magic:
+                raise ValueError("%s is not a track store file." % path)
+            indexOffset=struct.unpack('<Q', fp.read(8))[0]
+            fp.seek(indexOffset)
+            index=json.loads(fp.read().decode())
+
+        self.columns=index['columns']
+        self.dtype=np.dtype(index['dtype'])
+        ## First row and number of rows of each track, by track id
+        self.index={trackID: tuple(span) for trackID, span in index['tracks'].items()}
+        self.metadata=index['metadata']
+
+        shape=(index['rows'], len(self.columns))
+        if index['rows'] > 0:
+            self.data=np.memmap(path, dtype=self.dtype, mode='r', offset=dataOffset, shape=shape)
+        else:
+            self.data=np.zeros(shape, self.dtype)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, trackID):
+        return trackID in self.index
+
+    def ids(self):
+        """Returns the track ids in the order the tracks were added."""
+
+        return list(self.index)
+
+    def array(self, trackID, columns=None):
+        """Returns the (rows, columns) array of one track as a view of the file."""
+
+        (first, rows)=self.index[trackID]
+        data=self.data[first:first+rows]
+        if columns is not None:
+            data=data[:, [self.columns.index(column) for column in columns]]
+        return data
+
+    def track(self, trackID):
+        """Returns one track as a DataFrame."""
+
+        return pd.DataFrame(np.array(self.array(trackID)), columns=self.columns)
+
+    def tracks(self, ids=None):
+        """Generator of (track id, DataFrame) pairs, reading one track at a time."""
+
+        for trackID in (self.ids() if ids is None else ids):
+            yield trackID, self.track(trackID)
+
+
+def buildStore(path, files, ids=None, dtype=np.float64):
+    """Writes the track files (any trackStorage format) to a store and returns it opened.
+
+    ids defaults to the paths of the files relative to their common folder,
+    without extension and with / separators: the file names when all the
+    files are in one folder, 'view1/pixels_run' and 'view2/pixels_run' for
+    files of the same name in two folders. A ValueError is raised before
+    anything is written if two tracks would have the same id. Files are read
+    one at a time, so the tracks never need to fit in memory together.
+    """
+
+    files=list(files)
+    if ids is None:
+        folder=os.path.commonpath([os.path.dirname(os.path.abspath(file)) for file in files]) if files else ''
+        ids=[os.path.splitext(os.path.relpath(os.path.abspath(file), folder))[0].replace(os.sep, '/') for file in files]
+    ids=[str(trackID) for trackID in ids]
+    duplicates=sorted(set(trackID for trackID in ids if ids.count(trackID) > 1))
+    if duplicates:
+        raise ValueError("Several tracks have the id(s) %s." % ', '.join("'%s'" % trackID for trackID in duplicates))
+
+    writer=None
+    try:
+        for trackID, file in zip(ids, files):
+            df, metadata=trackStorage.loadTrack(file)
+            if writer is None:
+                writer=TrackStoreWriter(path, df.columns, dtype)
+            metadata=dict(metadata)
+            metadata['file']=file
+            writer.add(trackID, df, metadata)
+        if writer is None:
+            writer=TrackStoreWriter(path, [], dtype)
+    finally:
+        if writer is not None:
+            writer.close()
+    return TrackStore(path)
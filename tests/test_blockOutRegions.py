@@ -0,0 +1,19 @@
+"""
+Tests of the block out masks against cv2's drawing.
+"""
+
+import cv2
+import numpy as np
+
+from tracking.blockOutRegions import BlockOutMask
+
+
+def test_mask_matches_drawn_rectangles():
+    rng=np.random.default_rng(0)
+    regions=[(10, 5, 40, 30), (60, 50, 90, 70)]
+    for shape in ((80, 100), (80, 100, 3)):
+        img=rng.integers(0, 256, shape, dtype=np.uint8)
+        drawn=img.copy()
+        for (topx, topy, bottomx, bottomy) in regions:
+            drawn=cv2.rectangle(drawn, (topx, topy), (bottomx, bottomy), 100, -1)
+        np.testing.assert_array_equal(BlockOutMask(regions).apply(img.copy()), drawn)
@@ -0,0 +1,79 @@
+"""
+Tests of the candidate matching of CalibrationModel on synthetic cameras.
+"""
+
+import numpy as np
+
+from util.calibrationModel import CalibrationModel
+
+
+def cameras(nc=3):
+    """Returns the (nc, 12) DLT coefficients of nc cameras around the origin."""
+
+    K=np.array([[800, 0, 320], [0, 800, 240], [0, 0, 1.]])
+    Ls=[]
+    for angle in np.linspace(-0.5, 0.5, nc):
+        (c, s)=(np.cos(angle), np.sin(angle))
+        P=K @ np.array([[c, 0, -s, 0], [0, 1, 0, 0], [s, 0, c, 10.]])
+        Ls.append((P/P[2, 3]).ravel())
+    return np.array(Ls)
+
+
+def test_distractor_alone_in_one_view_is_left_out():
+    model=CalibrationModel(cameras(3))
+    xyz=np.array([[0.3, -0.2, 0.5]])
+    uvs=model.project(xyz)
+
+    candidates=np.full((1, 3, 2, 2), np.nan)
+    candidates[0, :, 0]=uvs[0]
+    #The only blob of the last view is debris far from the object
+    candidates[0, 2, 0]=uvs[0, 2] + (150., -90.)
+
+    matched, rec, residual=model.match(candidates)
+    np.testing.assert_allclose(matched[0, 0:2], uvs[0, 0:2])
+    assert np.all(np.isnan(matched[0, 2]))
+    np.testing.assert_allclose(rec, xyz, atol=1e-6)
+    assert residual[0] < 1e-6
+
+
+def test_distractor_larger_than_object_is_rejected():
+    model=CalibrationModel(cameras(2))
+    xyz=np.array([[0.3, -0.2, 0.5], [-1., 0.4, 0.1]])
+    uvs=model.project(xyz)
+
+    candidates=np.full((2, 2, 2, 2), np.nan)
+    candidates[:, :, 1]=uvs
+    candidates[:, 1, 0]=uvs[:, 1] + (0., 200.)
+
+    matched, rec, residual=model.match(candidates)
+    np.testing.assert_allclose(matched, uvs)
+    np.testing.assert_allclose(rec, xyz, atol=1e-6)
+
+
+def test_largest_blob_beats_consistent_debris():
+    model=CalibrationModel(cameras(2))
+    xyz=np.array([[0.3, -0.2, 0.5]])
+    uvs=model.project(xyz)
+
+    candidates=np.full((1, 2, 2, 2), np.nan)
+    #The object is the largest blob of both views, seen with a few pixels of noise
+    candidates[0, :, 0]=uvs[0] + ((0., 2.), (0., -2.))
+    #Smaller debris that reprojects exactly
+    candidates[0, :, 1]=model.project(np.array([[-0.8, 0.6, 0.2]]))[0]
+
+    matched, rec, residual=model.match(candidates)
+    np.testing.assert_allclose(matched[0], candidates[0, :, 0])
+    np.testing.assert_allclose(rec, xyz, atol=0.02)
+    matched, rec, residual=model.match(candidates, rankPenalty=0.)
+    np.testing.assert_allclose(matched[0], candidates[0, :, 1])
+
+
+def test_two_views_without_a_consistent_pair_are_not_reconstructed():
+    model=CalibrationModel(cameras(2))
+    uvs=model.project(np.array([[0.3, -0.2, 0.5]]))
+
+    candidates=uvs[:, :, np.newaxis, :].copy()
+    candidates[0, 1, 0, 1]+=200.
+
+    matched, rec, residual=model.match(candidates)
+    assert np.all(np.isnan(rec)) and np.isnan(residual[0])
@@ -0,0 +1,59 @@
+"""
+Tests of the calibration service on synthetic cameras.
+"""
+
+import numpy as np
+
+from util import calibrationService
+
+
+def synthetic(n=30, noise=0.5, seed=0):
+    """Returns (n, 3) object points and their (n, 2, 2) noisy image points in two cameras."""
+
+    rng=np.random.default_rng(seed)
+    xyz=rng.uniform(-2, 2, (n, 3))
+    K=np.array([[800, 0, 320], [0, 800, 240], [0, 0, 1.]])
+    uvs=[]
+    for angle in (-0.4, 0.4):
+        (c, s)=(np.cos(angle), np.sin(angle))
+        P=K @ np.array([[c, 0, -s, 0], [0, 1, 0, 0], [s, 0, c, 10.]])
+        uvw=np.hstack((xyz, np.ones((n, 1)))) @ P.T
+        uvs.append(uvw[:, 0:2]/uvw[:, 2:3] + rng.normal(0, noise, (n, 2)))
+    return xyz, np.stack(uvs, axis=1)
+
+
+def test_bootstrap_intervals_contain_the_estimates():
+    xyz, uvs=synthetic()
+    result=calibrationService.calibrateViews(xyz, uvs, robust=False, bootstrap=300, seed=1)
+
+    (low, high)=result.reconstructionErrorCI
+    assert low <= result.reconstructionError <= high
+    assert np.all((result.errorsCI[0] <= result.errors) & (result.errors <= result.errorsCI[1]))
+    assert np.all((result.coefficientsCI[0] <= result.coefficients) & (result.coefficients <= result.coefficientsCI[1]))
+
+
+def test_robust_bootstrap_rejects_the_outlier_in_every_resample():
+    xyz, uvs=synthetic()
+    uvs[5, 1]+=40.
+    result=calibrationService.calibrateViews(xyz, uvs, robust=True, bootstrap=40, seed=1)
+
+    assert not result.inliers[5, 1]
+    assert result.errorsCI[1, 1] < 2.
+
+
+def test_robust_bootstrap_does_not_depend_on_the_workers():
+    xyz, uvs=synthetic(n=12)
+    uvs[5, 1]+=40.
+    single=calibrationService.calibrateViews(xyz, uvs, robust=True, bootstrap=20, workers=1, seed=2)
+    pooled=calibrationService.calibrateViews(xyz, uvs, robust=True, bootstrap=20, workers=3, seed=2)
+
+    np.testing.assert_array_equal(pooled.coefficientsCI, single.coefficientsCI)
+    np.testing.assert_array_equal(pooled.errorsCI, single.errorsCI)
+
+
+def test_robust_keeps_every_point_without_redundancy():
+    xyz, uvs=synthetic(n=8)
+    uvs[5, 1]+=40.
+    result=calibrationService.calibrateViews(xyz, uvs, robust=True)
+
+    assert result.inliers.all() and not result.rejected()
@@ -0,0 +1,37 @@
+"""
+Tests of the experiment track store.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from util import trackStorage
+from util.trackStore import buildStore
+
+
+def saveTracks(folder, names):
+    files=[]
+    for (i, name) in enumerate(names):
+        path=os.path.join(folder, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        trackStorage.saveTrack(path, pd.DataFrame({'x': [i, i+1.], 'y': [0., i]}))
+        files.append(path)
+    return files
+
+
+def test_tracks_of_the_same_name_in_two_folders_are_kept(tmp_path):
+    files=saveTracks(str(tmp_path), [os.path.join('view1', 'run.csv'), os.path.join('view2', 'run.csv')])
+    store=buildStore(str(tmp_path / 'store.pts'), files)
+
+    assert sorted(store.ids()) == ['view1/run', 'view2/run']
+    np.testing.assert_array_equal(store.array('view2/run'), [[1., 0.], [2., 1.]])
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    files=saveTracks(str(tmp_path), ['a.csv', 'b.csv'])
+    with pytest.raises(ValueError):
+        buildStore(str(tmp_path / 'store.pts'), files, ids=['fish', 'fish'])
+    assert not os.path.exists(str(tmp_path / 'store.pts'))
@@ -0,0 +1,64 @@
+"""
+Tests of the GUI-free tracking engine on the example video.
+"""
+
+import os
+
+import numpy as np
+
+from tracking.trackingEngine import TrackingConfig, TrackingEngine, readBlockFile
+
+
+example=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example', 'trackingExample')
+video=os.path.join(example, 'videos', 'view1.mp4')
+blocks=os.path.join(example, 'blockOutRegions', 'blocks.txt')
+
+
+def mogConfig(**keywords):
+    return TrackingConfig(backgroundMethod='mog', medianSize=5, detector='components',
+                          blockOutRegions=readBlockFile(blocks), **keywords)
+
+
+def test_parallel_mog_matches_sequential():
+    sequential=TrackingEngine(video, mogConfig(stop=150)).track()
+    parallel=TrackingEngine(video, mogConfig(stop=150)).trackParallel(workers=3, warmup=None)
+    np.testing.assert_array_equal(parallel, sequential)
+
+
+def test_parallel_mog_range_matches_sequential():
+    sequential=TrackingEngine(video, mogConfig(start=60, stop=150)).track()
+    parallel=TrackingEngine(video, mogConfig(start=60, stop=150)).trackParallel(workers=2, warmup=None)
+    np.testing.assert_array_equal(parallel, sequential)
+
+
+def test_resumed_mog_matches_uninterrupted():
+    sequential=TrackingEngine(video, mogConfig(stop=150)).track()
+    engine=TrackingEngine(video, mogConfig(stop=150))
+    first=engine.resume(100, warmup=None)
+    resumed=engine.track(first=first, warmup=engine.config.start - first)
+    np.testing.assert_array_equal(resumed, sequential[sequential[:, 0] > 100])
+
+
+def test_resumed_multi_target_continues_ids():
+    config=lambda: TrackingConfig(medianSize=5, detector='components', blockOutRegions=readBlockFile(blocks),
+                                  multiTarget=True, maxTargetMissed=3, stop=150)
+    sequential=TrackingEngine(video, config()).track()
+    recorded=sequential[sequential[:, 0] <= 100]
+    engine=TrackingEngine(video, config())
+    first=engine.resume(100, tracks=recorded)
+    resumed=engine.track(first=first)
+    np.testing.assert_array_equal(resumed, sequential[sequential[:, 0] > 100])
+    assert len(np.unique(sequential[:, 3])) > 1
+
+
+def test_drifting_background_is_tracked_in_order():
+    config=lambda: TrackingConfig(medianSize=5, detector='components', blockOutRegions=readBlockFile(blocks),
+                                  backgroundUpdate=0.05, stop=150)
+    sequential=TrackingEngine(video, config()).track()
+    parallel=TrackingEngine(video, config()).trackParallel(workers=2)
+    np.testing.assert_array_equal(parallel, sequential)
+
+    engine=TrackingEngine(video, config())
+    first=engine.resume(100, warmup=None)
+    resumed=engine.track(first=first, warmup=engine.config.start - first)
+    np.testing.assert_array_equal(resumed, sequential[sequential[:, 0] > 100])
@@ -0,0 +1,234 @@
+"""
+Background model of a video.
+
+The absolute difference methods compare every frame to one grayscale
+background image. buildBackground() learns that image from frames sampled
+evenly over the whole video instead of taking a single frame: the per pixel
+median (moving objects are only seen on a few samples and drop out) or the
+mode of the samples. Both are computed in a stream with bounded memory,
+whatever the number of samples:
+
+    median      remedian of the samples (Rousseeuw and Bassett, 1990): the
+                samples are reduced by medians of base frames at a time, so
+                at most base frames per level of log(samples)/log(base)
+                levels are kept
+    mode        per pixel histogram of bins gray level bins, with the peak
+                refined between neighbouring bins
+
+loadBackground() caches the model next to the video (in a backgrounds
+folder), keyed by the path, size and modification time of the video and the
+sampling parameters, so it is only computed once per video and settings.
+"""
+
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+
+## Statistics buildBackground() can compute
+statistics=('median', 'mode')
+
+
+class Remedian():
+
+    """Approximate per pixel median of a stream of images.
+
+    Usage:
+        median=Remedian()
+        for img in images:
+            median.add(img)
+        background=median.result()
+
+    Every base images of a level are replaced by their median in the next
+    level; base is odd so that the medians are pixel values of the images.
+    """
+
+    def __init__(self, base=9):
+
+        if base < 3 or base % 2 == 0:
+            raise ValueError("The remedian base must be an odd number of at least 3.")
+        self.base=base
+        ## Images waiting at each level, level l stands for base**l samples
+        self.levels=[]
+
+    def add(self, img):
+        level=0
+        while True:
+            if level == len(self.levels):
+                self.levels.append([])
+            self.levels[level].append(img)
+            if len(self.levels[level]) < self.base:
+                return None
+            stack=np.stack(self.levels[level])
+            img=np.partition(stack, self.base//2, axis=0)[self.base//2]
+            self.levels[level]=[]
+            level=level + 1
+
+    def result(self, rows=64):
+        """Returns the median of the images added, as the median of the images
+        kept at all levels weighted by the number of samples they stand for."""
+
+        images=[img for level in self.levels for img in level]
+        if not images:
+            return None
+        weights=np.array([self.base**l for (l, level) in enumerate(self.levels) for img in level], dtype=float)
+        stack=np.stack(images)
+        median=np.empty(stack.shape[1:], stack.dtype)
+        #Row blocks bound the memory of the sort
+        for start in range(0, stack.shape[1], rows):
+            block=stack[:, start:start+rows]
+            order=np.argsort(block, axis=0, kind='stable')
+            cumulative=np.cumsum(weights[order], axis=0)
+            i=np.argmax(cumulative >= weights.sum()/2., axis=0)
+            median[start:start+rows]=np.take_along_axis(block, np.take_along_axis(order, i[np.newaxis], axis=0), axis=0)[0]
+        return median
+
+
+class BinnedMode():
+
+    """Per pixel mode of a stream of 8 bit images.
+
+    Usage as Remedian. Each pixel keeps the count of its samples in bins
+    gray level bins (a power of 2), bins*2 bytes per pixel; the mode is the
+    fullest bin, refined by a parabola through its count and the counts of
+    its two neighbours.
+    """
+
+    def __init__(self, bins=16):
+
+        if bins < 2 or bins > 256 or bins & (bins - 1):
+            raise ValueError("The number of mode bins must be a power of 2 between 2 and 256.")
+        self.bins=bins
+        self.shift=8 - int(np.log2(bins))
+        self.counts=None
+
+    def add(self, img):
+        if self.counts is None:
+            self.counts=np.zeros((self.bins,) + img.shape, np.uint16)
+        n=img.size
+        #Every pixel adds to exactly one bin: one scatter over the flat counts
+        index=(img.ravel() >> self.shift).astype(np.intp)*n + np.arange(n)
+        self.counts.reshape(-1)[index]+=1
+
+    def result(self):
+        if self.counts is None:
+            return None
+        width=256 // self.bins
+        peak=np.argmax(self.counts, axis=0)
+        counts=self.counts.astype(float)
+        c0=np.take_along_axis(counts, peak[np.newaxis], axis=0)[0]
+        below=np.take_along_axis(counts, np.maximum(peak - 1, 0)[np.newaxis], axis=0)[0]
+        above=np.take_along_axis(counts, np.minimum(peak + 1, self.bins - 1)[np.newaxis], axis=0)[0]
+        curvature=below - 2*c0 + above
+        with np.errstate(divide='ignore', invalid='ignore'):
+            offset=np.where(curvature < 0, 0.5*(below - above)/curvature, 0.)
+        mode=peak*width + (width - 1)/2. + np.clip(offset, -0.5, 0.5)*width
+        return np.clip(np.rint(mode), 0, 255).astype(np.uint8)
+
+
+def sampleIndices(frameCount, samples):
+    """Returns the 0 based indices of samples frames spread evenly over frameCount frames."""
+
+    if frameCount <= 0:
+        return np.zeros(0, dtype=int)
+    return np.unique(np.linspace(0, frameCount - 1, min(samples, frameCount)).round().astype(int))
+
+
+def readSamples(video, indices, seekGap=30):
+    """Generator of the grayscale frames of video at the sorted indices.
+
+    Frames closer than seekGap frames apart are reached by decoding, as
+    seeking costs more than decoding a few frames with most codecs.
+    """
+
+    cap=cv2.VideoCapture(video)
+    position=0
+    try:
+        for index in indices:
+            if index - position > seekGap:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, int(index))
+                position=int(index)
+            while position < index:
+                cap.grab()
+                position=position + 1
+            (grabbed, frame)=cap.read()
+            position=position + 1
+            if not grabbed:
+                break
+            yield frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    finally:
+        cap.release()
+
+
+def buildBackground(video, samples=50, statistic='median', bins=16):
+    """Returns the grayscale background of video learned from samples frames.
+
+    statistic is 'median' or 'mode' (see the module documentation), bins the
+    number of gray level bins of the mode.
+    """
+
+    if statistic == 'median':
+        model=Remedian()
+    elif statistic == 'mode':
+        model=BinnedMode(bins)
+    else:
+        raise ValueError("Unknown background statistic '%s'." % statistic)
+
+    cap=cv2.VideoCapture(video)
+    frameCount=int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    for frame in readSamples(video, sampleIndices(frameCount, samples)):
+        model.add(frame)
+    background=model.result()
+    if background is None:
+        raise ValueError("No frame could be read from %s to build the background." % video)
+    return background
+
+
+def cacheFolder(video):
+    """Returns the folder backgrounds of video are saved to."""
+
+    return os.path.join(os.path.dirname(os.path.abspath(video)), 'backgrounds')
+
+
+def cachePath(video, samples=50, statistic='median', bins=16):
+    """Returns the cache file of the background of video built with the given
+    parameters. The name changes with the video file and the parameters."""
+
+    stat=os.stat(video)
+    key={'video': os.path.abspath(video), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+         'samples': samples, 'statistic': statistic}
+    if statistic == 'mode':
+        key['bins']=bins
+    digest=hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()[0:12]
+    name=os.path.splitext(os.path.basename(video))[0]
+    return os.path.join(cacheFolder(video), '%s_%s_%s.png' % (name, statistic, digest))
+
+
+def loadBackground(video, samples=50, statistic='median', bins=16, cache=True):
+    """Returns buildBackground(), read from the cache if it was built before.
+
+    With cache=True a new background is saved to cachePath(); a folder that
+    cannot be written to only disables the cache.
+    """
+
+    if not cache:
+        return buildBackground(video, samples, statistic, bins)
+
+    path=cachePath(video, samples, statistic, bins)
+    if os.path.exists(path):
+        background=cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if background is not None:
+            return background
+
+    background=buildBackground(video, samples, statistic, bins)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, background)
+    except OSError:
+        pass
+    return background
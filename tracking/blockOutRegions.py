@@ -0,0 +1,212 @@
+"""
+Block out regions.
+
+Regions are small serializable shape objects (rectangles, polygons and
+ellipses). BlockOutMask compiles the enabled regions once per frame size into
+a mask that is applied to each frame with a single np.copyto, instead of
+drawing every region onto every frame. It also gives the bounding box of the
+area left unblocked, so that frames can be cropped before processing.
+"""
+
+import json
+
+import cv2
+import numpy as np
+
+
+class RectangleRegion():
+
+    """Axis aligned rectangle between two opposite corners (both included)."""
+
+    kind='rectangle'
+
+    def __init__(self, topx, topy, bottomx, bottomy, ID=None):
+        self.ID=ID
+        self.topx=int(topx)
+        self.topy=int(topy)
+        self.bottomx=int(bottomx)
+        self.bottomy=int(bottomy)
+
+    def draw(self, mask, value=255):
+        return cv2.rectangle(mask, (self.topx, self.topy), (self.bottomx, self.bottomy), value, -1)
+
+    def translated(self, dx, dy):
+        return RectangleRegion(self.topx+dx, self.topy+dy, self.bottomx+dx, self.bottomy+dy, ID=self.ID)
+
+    def toDict(self):
+        return {'kind': self.kind, 'ID': self.ID, 'topx': self.topx, 'topy': self.topy,
+                'bottomx': self.bottomx, 'bottomy': self.bottomy}
+
+
+class PolygonRegion():
+
+    """Filled polygon through a list of (x, y) vertices."""
+
+    kind='polygon'
+
+    def __init__(self, points, ID=None):
+        self.ID=ID
+        self.points=[(int(x), int(y)) for (x, y) in points]
+
+    def draw(self, mask, value=255):
+        return cv2.fillPoly(mask, [np.array(self.points, np.int32)], value)
+
+    def translated(self, dx, dy):
+        return PolygonRegion([(x+dx, y+dy) for (x, y) in self.points], ID=self.ID)
+
+    def toDict(self):
+        return {'kind': self.kind, 'ID': self.ID, 'points': [list(p) for p in self.points]}
+
+
+class EllipseRegion():
+
+    """Filled ellipse given by its centre, half axes and rotation angle in degrees."""
+
+    kind='ellipse'
+
+    def __init__(self, centerx, centery, axisx, axisy, angle=0, ID=None):
+        self.ID=ID
+        self.centerx=int(centerx)
+        self.centery=int(centery)
+        self.axisx=int(axisx)
+        self.axisy=int(axisy)
+        self.angle=float(angle)
+
+    def draw(self, mask, value=255):
+        return cv2.ellipse(mask, (self.centerx, self.centery), (self.axisx, self.axisy), self.angle, 0, 360, value, -1)
+
+    def translated(self, dx, dy):
+        return EllipseRegion(self.centerx+dx, self.centery+dy, self.axisx, self.axisy, self.angle, ID=self.ID)
+
+    def toDict(self):
+        return {'kind': self.kind, 'ID': self.ID, 'centerx': self.centerx, 'centery': self.centery,
+                'axisx': self.axisx, 'axisy': self.axisy, 'angle': self.angle}
+
+
+## Region classes by their 'kind' key
+regionKinds={RectangleRegion.kind: RectangleRegion,
+             PolygonRegion.kind: PolygonRegion,
+             EllipseRegion.kind: EllipseRegion}
+
+
+def regionFromDict(data):
+    """Rebuilds a region from the output of its toDict() method."""
+
+    data=dict(data)
+    try:
+        regionClass=regionKinds[data.pop('kind')]
+    except KeyError:
+        raise ValueError("Unknown block out region kind in %s" % str(data))
+    return regionClass(**data)
+
+
+def asRegion(region):
+    """Returns region as a region object, (topx, topy, bottomx, bottomy) tuples become rectangles."""
+
+    if hasattr(region, 'draw'):
+        return region
+    return RectangleRegion(*region)
+
+
+def saveRegions(path, regions):
+    """Writes a list of regions to a json file."""
+
+    with open(path, 'w') as fp:
+        json.dump([asRegion(region).toDict() for region in regions], fp, indent=2)
+
+
+def loadRegions(path):
+    """Reads a list of regions from a json file written by saveRegions()."""
+
+    with open(path) as fp:
+        return [regionFromDict(data) for data in json.load(fp)]
+
+
+class BlockOutMask():
+
+    """Mask of a set of block out regions, compiled once per frame size.
+
+    apply() fills the blocked pixels of a grayscale or colour frame with fill,
+    giving the same result as drawing each region onto the frame with fill as
+    colour: as with cv2's drawing functions, a number fills the first channel
+    of colour frames (blue, (100, 0, 0) by default) and 0 the others.
+    """
+
+    def __init__(self, regions=(), fill=100):
+
+        self.regions=[asRegion(region) for region in regions]
+        self.fill=fill
+        self.compiled={}
+
+    def __bool__(self):
+        return len(self.regions) > 0
+
+    def mask(self, shape):
+        """Returns the uint8 mask (255 where blocked) for frames of (height, width) shape."""
+
+        shape=tuple(shape[:2])
+        if shape not in self.compiled:
+            mask=np.zeros(shape, np.uint8)
+            for region in self.regions:
+                mask=region.draw(mask)
+            self.compiled[shape]=mask
+        return self.compiled[shape]
+
+    def blocked(self, img):
+        """Returns the boolean blocked mask broadcastable against img."""
+
+        key=('blocked',)+img.shape[:2]+(img.ndim,)
+        if key not in self.compiled:
+            blocked=self.mask(img.shape) > 0
+            if img.ndim == 3:
+                blocked=blocked[:, :, np.newaxis]
+            self.compiled[key]=blocked
+        return self.compiled[key]
+
+    def fillValue(self, img):
+        """Returns the value copied to the blocked pixels of img."""
+
+        if img.ndim == 3 and np.isscalar(self.fill):
+            value=np.zeros(img.shape[2], img.dtype)
+            value[0]=self.fill
+            return value
+        return self.fill
+
+    def activeBounds(self, shape):
+        """Returns the (x0, y0, x1, y1) bounding box of the pixels that are not
+        blocked out in frames of (height, width) shape, x1 and y1 excluded.
+
+        Returns None if the whole frame is blocked out.
+        """
+
+        active=self.mask(shape) == 0
+        cols=np.flatnonzero(active.any(axis=0))
+        rows=np.flatnonzero(active.any(axis=1))
+        if len(cols) == 0:
+            return None
+        return int(cols[0]), int(rows[0]), int(cols[-1])+1, int(rows[-1])+1
+
+    def applyWindow(self, img, window, shape):
+        """Fills the blocked pixels of img, the (x0, y0, x1, y1) window of a frame
+        of (height, width) shape, in place and returns it."""
+
+        if self.regions:
+            (x0, y0, x1, y1)=window
+            blocked=self.mask(shape)[y0:y1, x0:x1] > 0
+            if img.ndim == 3:
+                blocked=blocked[:, :, np.newaxis]
+            np.copyto(img, self.fillValue(img), where=blocked)
+        return img
+
+    def cropped(self, bounds):
+        """Returns the mask of frames cropped to bounds, as given by activeBounds()."""
+
+        x0, y0=bounds[0], bounds[1]
+        return BlockOutMask([region.translated(-x0, -y0) for region in self.regions], fill=self.fill)
+
+    def apply(self, img):
+        """Fills the blocked pixels of img in place and returns it."""
+
+        if self.regions:
+            np.copyto(img, self.fillValue(img), where=self.blocked(img))
+        return img
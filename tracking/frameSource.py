@@ -0,0 +1,116 @@
+"""
+Decode-ahead video reader.
+
+FrameSource wraps cv2.VideoCapture and decodes frames on a background thread
+into a bounded queue, so decoding the next frames overlaps with processing the
+current one (OpenCV releases the GIL while decoding). read() behaves like
+cv2.VideoCapture.read().
+"""
+
+import queue
+import threading
+
+import cv2
+
+
+class FrameSource():
+
+    """Reads the frames of a video ahead of the caller.
+
+    Usage:
+        source=FrameSource('view1.mp4')
+        (grabbed, frame)=source.read()
+        source.release()
+
+    prefetch is the maximum number of decoded frames waiting in the queue. With
+    prefetch=0 frames are read synchronously on the calling thread, which suits
+    random access such as trackbar scrubbing.
+    """
+
+    def __init__(self, video, position=0, prefetch=8):
+
+        self.video=video
+        self.prefetch=prefetch
+        self.cap=cv2.VideoCapture(self.video)
+
+        ## Number of frames reported by the container
+        self.frameCount=int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+        self.thread=None
+        self.finished=False
+        self.seek(position)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def seek(self, position):
+        """Moves to the 0 based frame index position, like cv2.CAP_PROP_POS_FRAMES.
+
+        Frames already decoded ahead are discarded.
+        """
+
+        self.stopThread()
+        if position > 0 or self.cap.get(cv2.CAP_PROP_POS_FRAMES) != 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, position)
+        self.finished=False
+
+        if self.prefetch > 0:
+            self.queue=queue.Queue(maxsize=self.prefetch)
+            self.stopEvent=threading.Event()
+            self.thread=threading.Thread(target=self.decode, daemon=True)
+            self.thread.start()
+
+    def decode(self):
+        """Decoding thread, fills the queue until the video ends or the thread is stopped."""
+
+        while not self.stopEvent.is_set():
+            (grabbed, frame)=self.cap.read()
+
+            while not self.stopEvent.is_set():
+                try:
+                    self.queue.put((grabbed, frame), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+
+            if not grabbed:
+                break
+
+    def read(self):
+        """Returns the next (grabbed, frame) pair; grabbed is False at the end of the video."""
+
+        if self.finished:
+            return False, None
+
+        if self.thread is None:
+            (grabbed, frame)=self.cap.read()
+        else:
+            (grabbed, frame)=self.queue.get()
+
+        if not grabbed:
+            self.finished=True
+        return grabbed, frame
+
+    def stopThread(self):
+        """Stops the decoding thread and empties the queue."""
+
+        if self.thread is None:
+            return None
+
+        self.stopEvent.set()
+        while self.thread.is_alive():
+            try:
+                self.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.thread.join()
+        self.thread=None
+
+    def release(self):
+        """Stops decoding and releases the video."""
+
+        self.stopThread()
+        self.cap.release()
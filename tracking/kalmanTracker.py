@@ -0,0 +1,214 @@
+"""
+Kalman filter of a tracked position.
+
+KalmanTracker follows one target with a constant velocity Kalman filter
+(state x, y, vx, vy; white noise acceleration). In predictive search mode
+(TrackingConfig.predictiveSearch) the tracking engine asks it for the window
+the target should be in on the next frame and only processes the pixels of
+that window, falling back to the full frame when nothing is found there and
+dropping the window altogether once the target has been lost for maxLost
+frames. The full frame is also searched every few frames so that a larger
+object appearing elsewhere takes over from whatever the window followed; a
+detection outside the predicted window restarts the filter there.
+
+kalmanSmooth() runs the same model forward and backward (Rauch-Tung-Striebel)
+over a recorded track to smooth it.
+"""
+
+import numpy as np
+
+
+def constantVelocity(processNoise):
+    """Returns the (4, 4) transition and process noise matrices of one frame step."""
+
+    F=np.eye(4)
+    F[0, 2]=1.
+    F[1, 3]=1.
+    #White noise acceleration, in pixels/frame^2
+    q=np.array([[1/4., 1/2.], [1/2., 1.]])*processNoise**2
+    Q=np.zeros((4, 4))
+    Q[np.ix_([0, 2], [0, 2])]=q
+    Q[np.ix_([1, 3], [1, 3])]=q
+    return F, Q
+
+
+class KalmanTracker():
+
+    """Constant velocity Kalman filter of one target and its search window.
+
+    Usage:
+        kalman=KalmanTracker()
+        for frame in frames:
+            window=kalman.predict(shape)
+            ...detect in window, or in the full frame if window is None...
+            kalman.update(position)   #None when nothing was detected
+
+    processNoise is the standard deviation of the acceleration (pixels/frame^2)
+    and measurementNoise that of the detected positions (pixels). The window
+    is centred on the predicted position and reaches margin pixels plus sigmas
+    standard deviations of the prediction plus the size of the last detected
+    blob on each side, so that the whole of an object seen as several blobs
+    stays in the window.
+    """
+
+    def __init__(self, processNoise=2., measurementNoise=1., margin=40, sigmas=4., maxLost=5):
+
+        self.F, self.Q=constantVelocity(processNoise)
+        self.H=np.eye(2, 4)
+        self.R=np.eye(2)*measurementNoise**2
+        self.margin=margin
+        self.sigmas=sigmas
+        ## Consecutive frames without a detection after which the target is lost
+        self.maxLost=maxLost
+        self.reset()
+
+    def reset(self):
+        """Forgets the target, the next window is the full frame."""
+
+        self.x=None
+        self.P=None
+        self.lost=0
+        ## (width, height) of the bounding box of the last detected blob
+        self.size=(0, 0)
+
+    @property
+    def tracking(self):
+        return self.x is not None
+
+    def predict(self, shape=None):
+        """Steps the filter to the next frame and returns its search window.
+
+        The window is (x0, y0, x1, y1) in full frame pixels, clipped to shape
+        (height, width) if given, or None while no target is followed.
+        """
+
+        if self.x is None:
+            return None
+        self.x=self.F @ self.x
+        self.P=self.F @ self.P @ self.F.T + self.Q
+        return self.window(shape)
+
+    def window(self, shape=None):
+        """Returns the search window around the predicted position, see predict()."""
+
+        if self.x is None:
+            return None
+        (x, y)=self.x[0:2]
+        hx=self.margin + self.sigmas*np.sqrt(self.P[0, 0]) + self.size[0]
+        hy=self.margin + self.sigmas*np.sqrt(self.P[1, 1]) + self.size[1]
+        window=[int(np.floor(x - hx)), int(np.floor(y - hy)), int(np.ceil(x + hx)) + 1, int(np.ceil(y + hy)) + 1]
+        if shape is not None:
+            (height, width)=shape[0:2]
+            window=[min(max(window[0], 0), width), min(max(window[1], 0), height),
+                    min(max(window[2], 0), width), min(max(window[3], 0), height)]
+        if window[2] <= window[0] or window[3] <= window[1]:
+            return None
+        return tuple(window)
+
+    def update(self, position, size=None):
+        """Corrects the filter with the detected (x, y) position, None if nothing was detected.
+
+        size is the optional (width, height) of the bounding box of the detected blob.
+
+        A position outside the predicted window belongs to another object, the
+        filter restarts from it.
+        """
+
+        if position is None:
+            if self.x is not None:
+                self.lost=self.lost + 1
+                if self.lost > self.maxLost:
+                    self.reset()
+            return None
+
+        z=np.asarray(position, dtype=float)
+        window=self.window()
+        if window is not None and not (window[0] <= z[0] < window[2] and window[1] <= z[1] < window[3]):
+            self.reset()
+        if self.x is None:
+            self.x=np.array([z[0], z[1], 0., 0.])
+            #Unknown velocity: its variance covers a fast target
+            self.P=np.diag([self.R[0, 0], self.R[1, 1], self.margin**2, self.margin**2])
+        else:
+            S=self.H @ self.P @ self.H.T + self.R
+            K=self.P @ self.H.T @ np.linalg.inv(S)
+            self.x=self.x + K @ (z - self.H @ self.x)
+            self.P=(np.eye(4) - K @ self.H) @ self.P
+        if size is not None:
+            self.size=(int(size[0]), int(size[1]))
+        self.lost=0
+
+    def position(self):
+        """Returns the filtered (x, y) position, None while no target is followed."""
+
+        return None if self.x is None else (self.x[0], self.x[1])
+
+
+def kalmanSmooth(positions, processNoise=2., measurementNoise=1., fillGaps=False):
+    """Smooths an (n, 2) track of positions, one row per frame, NaN on missing frames.
+
+    Runs the constant velocity Kalman filter of KalmanTracker forward and a
+    Rauch-Tung-Striebel smoother backward. The x and y axes are independent
+    in this model and are filtered together as a batch of two 2 state
+    filters. Returns the (n, 2) smoothed positions; missing frames stay NaN
+    unless fillGaps is True (frames before the first and after the last
+    detection always stay NaN).
+    """
+
+    positions=np.asarray(positions, dtype=float)
+    n=len(positions)
+    smoothed=np.full((n, 2), np.nan)
+    found=np.flatnonzero(np.all(np.isfinite(positions), axis=1))
+    if len(found) == 0:
+        return smoothed
+    first, last=found[0], found[-1]
+    z=positions[first:last+1]
+    m=len(z)
+
+    #Per axis model: state (position, velocity), F=[[1, 1], [0, 1]]. The
+    #covariance only depends on which frames were measured, it is the same
+    #for both axes, and the recursions are written out on floats since the
+    #2x2 matrix products of numpy cost more than the arithmetic.
+    (q11, q12, q22)=(processNoise**2/4., processNoise**2/2., processNoise**2)
+    r=measurementNoise**2
+    measured=np.all(np.isfinite(z), axis=1).tolist()
+
+    x=[None]*m          #filtered (x, vx, y, vy) of each frame
+    xp=[None]*m         #predicted (x, vx, y, vy)
+    C=[None]*m          #smoother gains (c11, c12, c21, c22)
+    zs=z.tolist()
+
+    (p11, p12, p22)=(r, 0., (10.*processNoise)**2 + r)
+    (px, vx, py, vy)=(zs[0][0], 0., zs[0][1], 0.)
+    x[0]=(px, vx, py, vy)
+    for k in range(1, m):
+        #Prediction
+        (a11, a12, a22)=(p11 + 2*p12 + p22 + q11, p12 + p22 + q12, p22 + q22)
+        det=a11*a22 - a12*a12
+        #Smoother gain of frame k-1: P[k-1] F' inv(Pp[k])
+        (b11, b12, b21, b22)=(p11 + p12, p12, p12 + p22, p22)
+        C[k-1]=((b11*a22 - b12*a12)/det, (b12*a11 - b11*a12)/det, (b21*a22 - b22*a12)/det, (b22*a11 - b21*a12)/det)
+        (px, py)=(px + vx, py + vy)
+        xp[k]=(px, vx, py, vy)
+        (p11, p12, p22)=(a11, a12, a22)
+        if measured[k]:
+            (k1, k2)=(a11/(a11 + r), a12/(a11 + r))
+            (ex, ey)=(zs[k][0] - px, zs[k][1] - py)
+            (px, vx, py, vy)=(px + k1*ex, vx + k2*ex, py + k1*ey, vy + k2*ey)
+            (p11, p12, p22)=(a11 - k1*a11, a12 - k1*a12, a22 - k2*a12)
+        x[k]=(px, vx, py, vy)
+
+    xs=[None]*m
+    (sx, svx, sy, svy)=xs[m-1]=x[m-1]
+    for k in range(m-2, -1, -1):
+        (c11, c12, c21, c22)=C[k]
+        (fx, fvx, fy, fvy)=x[k]
+        (qx, qvx, qy, qvy)=xp[k+1]
+        (dx, dvx, dy, dvy)=(sx - qx, svx - qvx, sy - qy, svy - qvy)
+        (sx, svx, sy, svy)=xs[k]=(fx + c11*dx + c12*dvx, fvx + c21*dx + c22*dvx, fy + c11*dy + c12*dvy, fvy + c21*dy + c22*dvy)
+    xs=np.array(xs)
+
+    smoothed[first:last+1]=xs[:, [0, 2]]
+    if not fillGaps:
+        smoothed[~np.all(np.isfinite(positions), axis=1)]=np.nan
+    return smoothed
@@ -0,0 +1,177 @@
+"""
+Multi-target linking.
+
+In multi-target mode the tracker keeps every blob that passes the area
+thresholds instead of only the largest one, and MultiTargetTracker links the
+blobs of consecutive frames into tracks with persistent ids. Each track's
+position on the next frame is predicted with a constant velocity model, the
+distances between all predictions and all blobs are computed at once as a
+matrix, and the pairs are assigned greedily (closest pair first) or, with
+method='hungarian', optimally by scipy's linear_sum_assignment. Blobs left
+unassigned start new tracks; tracks unassigned for more than maxMissed frames
+are ended. restore() picks the linking up again from the rows of an
+interrupted run, so a resumed run keeps numbering its tracks after them.
+"""
+
+import numpy as np
+
+
+class MultiTargetTracker():
+
+    """Links the blobs of consecutive frames into tracks.
+
+    Usage:
+        tracker=MultiTargetTracker(maxDistance=40)
+        for centroids in frames:
+            ids=tracker.update(centroids)
+
+    ids[i] is the track id of centroids[i], ids start at 1.
+    """
+
+    def __init__(self, maxDistance=50., maxMissed=10, method='greedy'):
+
+        if method not in ('greedy', 'hungarian'):
+            raise ValueError("Unknown assignment method '%s'." % method)
+        if method == 'hungarian':
+            try:
+                import scipy.optimize
+            except ImportError:
+                raise ValueError("The hungarian assignment method needs the scipy package.")
+
+        ## Largest distance (pixels) between the predicted position of a track and a blob assigned to it
+        self.maxDistance=maxDistance
+        ## Number of frames a track can go without a blob before it is ended
+        self.maxMissed=maxMissed
+        self.method=method
+        self.reset()
+
+    def reset(self):
+        """Ends all tracks, ids start from 1 again."""
+
+        self.ids=np.zeros(0, np.int32)
+        self.positions=np.zeros((0, 2))
+        self.velocities=np.zeros((0, 2))
+        ## Frames since each track was last assigned a blob
+        self.missed=np.zeros(0, np.int32)
+        self.nextID=1
+
+    def restore(self, rows, lastFrame):
+        """Continues the tracks of rows, the (n, 4) frame, x, y, id rows recorded up to frame lastFrame.
+
+        New ids start after the largest id of rows, and the tracks seen within
+        maxMissed frames of lastFrame are kept, with the velocity of their last
+        two rows, as update() left them after frame lastFrame.
+        """
+
+        self.reset()
+        rows=np.asarray(rows, dtype=float).reshape(-1, 4)
+        rows=rows[rows[:, 0] <= lastFrame]
+        if len(rows) == 0:
+            return None
+        self.nextID=int(rows[:, 3].max()) + 1
+
+        #Rows by id, then frame: the last row of each id ends its block
+        rows=rows[np.lexsort((rows[:, 0], rows[:, 3]))]
+        last=np.flatnonzero(np.append(np.diff(rows[:, 3]) != 0, True))
+        previous=last - 1
+        hasPrevious=(previous >= 0) & (rows[np.maximum(previous, 0), 3] == rows[last, 3])
+        previous=np.where(hasPrevious, previous, last)
+
+        missed=lastFrame - rows[last, 0]
+        keep=missed <= self.maxMissed
+        (last, previous)=(last[keep], previous[keep])
+        steps=np.maximum(rows[last, 0] - rows[previous, 0], 1)[:, np.newaxis]
+
+        #Tracks in id order, the order update() creates them in
+        self.ids=rows[last, 3].astype(np.int32)
+        self.positions=rows[last, 1:3].copy()
+        self.velocities=(rows[last, 1:3] - rows[previous, 1:3]) / steps
+        self.missed=missed[keep].astype(np.int32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def predict(self):
+        """Returns the (tracks, 2) positions predicted for the next frame."""
+
+        return self.positions + self.velocities*(self.missed[:, np.newaxis] + 1)
+
+    def distances(self, centroids):
+        """Returns the (tracks, blobs) matrix of distances between predictions and blobs."""
+
+        difference=self.predict()[:, np.newaxis, :] - centroids[np.newaxis, :, :]
+        return np.sqrt(np.einsum('tbi,tbi->tb', difference, difference))
+
+    def assignGreedy(self, distances):
+        """Returns the (track, blob) index pairs, closest pair first, within maxDistance."""
+
+        distances=np.where(distances <= self.maxDistance, distances, np.inf)
+        tracks=[]
+        blobs=[]
+        for i in range(min(distances.shape)):
+            k=np.argmin(distances)
+            (t, b)=np.unravel_index(k, distances.shape)
+            if not np.isfinite(distances[t, b]):
+                break
+            tracks.append(t)
+            blobs.append(b)
+            distances[t, :]=np.inf
+            distances[:, b]=np.inf
+        return np.array(tracks, dtype=int), np.array(blobs, dtype=int)
+
+    def assignHungarian(self, distances):
+        """Returns the (track, blob) index pairs minimizing the total distance, within maxDistance."""
+
+        from scipy.optimize import linear_sum_assignment
+
+        gated=distances > self.maxDistance
+        cost=np.where(gated, 2*self.maxDistance*max(distances.shape) + 1., distances)
+        tracks, blobs=linear_sum_assignment(cost)
+        keep=~gated[tracks, blobs]
+        return tracks[keep], blobs[keep]
+
+    def update(self, centroids):
+        """Assigns the (blobs, 2) centroids of the next frame to tracks.
+
+        Returns the (blobs,) int32 array of the track id of each centroid.
+        """
+
+        centroids=np.asarray(centroids, dtype=float).reshape(-1, 2)
+        ids=np.zeros(len(centroids), np.int32)
+
+        tracks=np.zeros(0, dtype=int)
+        blobs=np.zeros(0, dtype=int)
+        if len(self.ids) and len(centroids):
+            distances=self.distances(centroids)
+            if self.method == 'hungarian':
+                tracks, blobs=self.assignHungarian(distances)
+            else:
+                tracks, blobs=self.assignGreedy(distances)
+
+        #Assigned tracks: new velocity over the frames since the track was last seen
+        steps=(self.missed[tracks] + 1)[:, np.newaxis]
+        self.velocities[tracks]=(centroids[blobs] - self.positions[tracks]) / steps
+        self.positions[tracks]=centroids[blobs]
+        ids[blobs]=self.ids[tracks]
+
+        assigned=np.zeros(len(self.ids), bool)
+        assigned[tracks]=True
+        self.missed[~assigned]+=1
+        self.missed[assigned]=0
+        keep=self.missed <= self.maxMissed
+        self.ids=self.ids[keep]
+        self.positions=self.positions[keep]
+        self.velocities=self.velocities[keep]
+        self.missed=self.missed[keep]
+
+        #Unassigned blobs start new tracks
+        new=np.flatnonzero(ids == 0)
+        if len(new):
+            newIDs=np.arange(self.nextID, self.nextID + len(new), dtype=np.int32)
+            self.nextID=self.nextID + len(new)
+            ids[new]=newIDs
+            self.ids=np.concatenate((self.ids, newIDs))
+            self.positions=np.concatenate((self.positions, centroids[new]))
+            self.velocities=np.concatenate((self.velocities, np.zeros((len(new), 2))))
+            self.missed=np.concatenate((self.missed, np.zeros(len(new), np.int32)))
+        return ids
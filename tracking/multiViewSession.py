@@ -0,0 +1,265 @@
+"""
+Synchronized multi-view tracking.
+
+MultiViewSession tracks the videos of all cameras of an experiment in one
+pass: the videos are decoded in lockstep, shifted by a per camera frame offset
+so that the frames processed together show the same instant, every view is
+processed by its own TrackingEngine in a worker thread (OpenCV releases the GIL
+while decoding and filtering), and, given a calibration, each frame is
+reconstructed in 3D as soon as all views are processed. This replaces tracking
+each video to a 2D csv and pairing the csv files up in Processing3D
+afterwards:
+
+    python -m tracking.multiViewSession view1.mp4 view2.mp4 --calibration cal.csv --offsets 0 12 -o track3D.csv
+"""
+
+import argparse
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from tracking import trackWriter
+from tracking.trackingEngine import TrackingConfig, TrackingEngine, readBlockFile
+from util import calibrationModel
+from util import trackStorage
+
+
+## Result of processing one synchronized frame of all views, yielded by MultiViewSession.frames()
+SessionResult = namedtuple('SessionResult', ['count', 'results', 'uvs', 'visible', 'xyz'])
+
+
+class MultiViewSession():
+
+    """Tracks several synchronized views together and reconstructs them in 3D.
+
+    Usage:
+        session=MultiViewSession(['view1.mp4', 'view2.mp4'], config, offsets=[0, 12], model=model)
+        xyz=session.track()
+
+    config is one TrackingConfig shared by all views or a list of one per
+    view (block out regions differ between cameras). offsets[c] is the frame
+    number in video c of the instant shown by frame 0 of the session, e.g.
+    the frame of a sync flash in each video; only differences between
+    offsets matter. Session frame numbers are those of the video with the
+    smallest offset. model is a util.calibrationModel.CalibrationModel, or
+    None to track in 2D only. The 2D tracks of every view are kept in the
+    buffers of self.engines, as for single view runs. When the configs keep
+    several candidate blobs per frame (TrackingConfig.candidates), the
+    candidates of the views are matched by model.match() instead of taking
+    the largest blob of each view; candidates reprojecting further than
+    maxResidual pixels are left out.
+    """
+
+    def __init__(self, videos, config, offsets=None, model=None, refine=False, workers=None, maxResidual=20.):
+
+        self.videos=list(videos)
+        ## Number of views (cameras)
+        self.nc=len(self.videos)
+        configs=config if isinstance(config, (list, tuple)) else [config]*self.nc
+        if len(configs) != self.nc:
+            raise ValueError("%d videos but %d tracking configurations." % (self.nc, len(configs)))
+
+        offsets=np.zeros(self.nc, dtype=int) if offsets is None else np.asarray(offsets, dtype=int)
+        if offsets.shape != (self.nc,):
+            raise ValueError("%d videos but %d frame offsets." % (self.nc, offsets.size))
+        ## Frame offsets, shifted so that the smallest is 0
+        self.offsets=offsets - offsets.min()
+
+        if model is not None and model.nc != self.nc:
+            raise ValueError("Number of views (%d) and number of sets of camera calibration parameters (%d) are different." % (self.nc, model.nc))
+        self.model=model
+        ## Refine each reconstructed point by minimizing its reprojection error
+        self.refine=refine
+        ## Largest reprojection error (pixels) of a candidate blob kept by model.match()
+        self.maxResidual=maxResidual
+        self.workers=workers or self.nc
+
+        self.engines=[TrackingEngine(video, config) for (video, config) in zip(self.videos, configs)]
+        counts=[engine.frameCount - offset for (engine, offset) in zip(self.engines, self.offsets)]
+        self.reset(max(1, min(counts)))
+
+    def reset(self, capacity):
+        """Clears the recorded frames, sized for capacity frames up front."""
+
+        self.size=0
+        self.frameNumbers=np.zeros(capacity, np.int32)
+        ## (frames, nc, 2) pixel coordinates, NaN where a view has no detection
+        self.uvs=np.full((capacity, self.nc, 2), np.nan)
+        ## (frames, nc) True where a view detected the object
+        self.visible=np.zeros((capacity, self.nc), bool)
+        nd=self.model.nd if self.model is not None else 3
+        ## (frames, nd) reconstructed points, NaN where not reconstructed
+        self.xyz=np.full((capacity, nd), np.nan)
+
+    def record(self, count, uvs, visible, xyz):
+        if self.size == len(self.frameNumbers):
+            extra=len(self.frameNumbers)
+            self.frameNumbers=np.concatenate((self.frameNumbers, np.zeros(extra, np.int32)))
+            self.uvs=np.concatenate((self.uvs, np.full((extra, self.nc, 2), np.nan)))
+            self.visible=np.concatenate((self.visible, np.zeros((extra, self.nc), bool)))
+            self.xyz=np.concatenate((self.xyz, np.full((extra, self.xyz.shape[1]), np.nan)))
+
+        i=self.size
+        self.frameNumbers[i]=count
+        self.uvs[i]=uvs
+        self.visible[i]=visible
+        if xyz is not None:
+            self.xyz[i]=xyz
+        self.size=i + 1
+
+    def frames(self):
+        """Generator tracking all views frame by frame, in lockstep.
+
+        Yields a SessionResult for every synchronized frame: the FrameResult of
+        each view, the (nc, 2) pixel coordinates and (nc,) visibility of the
+        detections and the reconstructed point (None without a calibration, NaN
+        when fewer than two views saw the object). Frames outside the start/stop
+        bounds of a view count as not seen. The run ends with the shortest video.
+        """
+
+        self.reset(len(self.frameNumbers))
+        generators=[engine.frames(first=1 + offset) for (engine, offset) in zip(self.engines, self.offsets)]
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    jobs=[executor.submit(next, generator, None) for generator in generators]
+                    results=[job.result() for job in jobs]
+                    if any(result is None for result in results):
+                        break
+
+                    count=results[0].count - self.offsets[0]
+                    uvs=np.full((self.nc, 2), np.nan)
+                    visible=np.zeros(self.nc, bool)
+                    for (view, result) in enumerate(results):
+                        if result.detection is not None and len(result.areas) > 0:
+                            uvs[view]=result.detection
+                            visible[view]=True
+
+                    if self.model is not None and any(result.candidates is not None for result in results):
+                        uvs=self.model.match(self.candidates(results), self.maxResidual)[0][0]
+                        visible=np.all(np.isfinite(uvs), axis=1)
+
+                    xyz=None
+                    if self.model is not None:
+                        xyz=self.model.reconstruct(uvs[np.newaxis], visible[np.newaxis], refine=self.refine)[0]
+
+                    self.record(count, uvs, visible, xyz)
+                    yield SessionResult(count, results, uvs, visible, xyz)
+        finally:
+            for generator in generators:
+                generator.close()
+
+    def candidates(self, results):
+        """Returns the (1, nc, K, 2) candidates of the FrameResults of one frame, NaN padded."""
+
+        K=max(1 if result.candidates is None else max(1, len(result.candidates)) for result in results)
+        candidates=np.full((1, self.nc, K, 2), np.nan)
+        for (view, result) in enumerate(results):
+            if result.candidates is not None:
+                candidates[0, view, 0:len(result.candidates)]=result.candidates
+            elif result.detection is not None and len(result.areas) > 0:
+                candidates[0, view, 0]=result.detection
+        return candidates
+
+    def track(self, writer=None):
+        """Tracks all views without any display and returns toDataFrame().
+
+        Each reconstructed frame (frame, x, y, z, NaN where not reconstructed)
+        is also appended to writer (a TrackWriter) if given, as soon as all
+        views of the frame are processed.
+        """
+
+        for result in self.frames():
+            if writer is not None and result.xyz is not None:
+                writer.append(result.count, *result.xyz)
+        return self.toDataFrame()
+
+    def toDataFrame(self):
+        """Returns the recorded frames as a DataFrame of the frame number, the
+        reconstructed point and reprojection errors (with a calibration) and the
+        pixel coordinates of every view.
+        """
+
+        data={'Image frame': self.frameNumbers[:self.size]}
+        if self.model is not None:
+            for (axis, name) in enumerate(['x', 'y', 'z'][0:self.model.nd]):
+                data[name]=self.xyz[:self.size, axis]
+            reprojectionError=self.model.reprojectionError(self.xyz[:self.size], self.uvs[:self.size], self.visible[:self.size])
+            for view in range(self.nc):
+                data['reproj_err_v%d' % (view+1)]=reprojectionError[:, view]
+        for view in range(self.nc):
+            data['x_px_v%d' % (view+1)]=self.uvs[:self.size, view, 0]
+            data['y_px_v%d' % (view+1)]=self.uvs[:self.size, view, 1]
+        return pd.DataFrame(data)
+
+    def save(self, path, calibration=None):
+        """Saves toDataFrame() in any trackStorage format, with the videos and offsets as metadata."""
+
+        metadata={'videos': [os.path.basename(video) for video in self.videos],
+                  'offsets': [int(offset) for offset in self.offsets]}
+        if calibration is not None:
+            metadata['calibration']=calibration
+        trackStorage.saveTrack(path, self.toDataFrame(), metadata)
+
+
+def main(argv=None):
+
+    parser=argparse.ArgumentParser(description="Track the videos of all cameras together and reconstruct the 3D track.")
+    parser.add_argument('videos', nargs='+', help="video file of each view, in the order of the calibration")
+    parser.add_argument('-o', '--output', required=True, help="file the 3D track (or the pixel coordinates of all views) is saved to")
+    parser.add_argument('--calibration', help="calibration csv of the views, without it the views are only tracked in 2D")
+    parser.add_argument('--offsets', type=int, nargs='+', help="frame of each video showing the same instant (e.g. a sync flash)")
+    parser.add_argument('--live', help="csv the frame, x, y, z rows are written to as they are reconstructed")
+    parser.add_argument('--refine', action='store_true', help="refine each 3D point by minimizing its reprojection error")
+    parser.add_argument('--background', default='firstFrame', choices=['firstFrame', 'model', 'mog'], help="background removal method")
+    parser.add_argument('--threshold', type=int, default=25, help="threshold applied after background removal")
+    parser.add_argument('--median', type=int, help="median filter kernel size")
+    parser.add_argument('--gauss', type=int, help="Gaussian filter kernel size")
+    parser.add_argument('--erode', type=int, help="erosion kernel size")
+    parser.add_argument('--dilate', type=int, help="dilation kernel size")
+    parser.add_argument('--min-area', type=float, help="ignore contours smaller than this area")
+    parser.add_argument('--max-area', type=float, help="ignore contours larger than this area")
+    parser.add_argument('--detector', default='contours', choices=['contours', 'components'], help="blob detector, components gives sub-pixel centroids")
+    parser.add_argument('--candidates', type=int, default=1, help="number of largest blobs of each view matched across the views")
+    parser.add_argument('--max-residual', type=float, default=20., help="reprojection error in pixels above which a candidate blob is left out of the match")
+    parser.add_argument('--blocks', nargs='+', help="block out region file of each view saved from the GUI")
+    args=parser.parse_args(argv)
+
+    if args.blocks and len(args.blocks) != len(args.videos):
+        parser.error("give one block out region file per video")
+
+    configs=[]
+    for view in range(len(args.videos)):
+        config=TrackingConfig(backgroundMethod=args.background,
+                              threshold=args.threshold,
+                              medianSize=args.median,
+                              gaussSize=args.gauss,
+                              erodeSize=args.erode,
+                              dilateSize=args.dilate,
+                              highPassThresh=args.min_area,
+                              lowPassThresh=args.max_area,
+                              detector=args.detector,
+                              candidates=args.candidates)
+        if args.blocks:
+            config.blockOutRegions=readBlockFile(args.blocks[view])
+        configs.append(config)
+
+    model=calibrationModel.CalibrationModel.fromFile(args.calibration) if args.calibration else None
+    session=MultiViewSession(args.videos, configs, offsets=args.offsets, model=model, refine=args.refine, maxResidual=args.max_residual)
+
+    if args.live:
+        with trackWriter.TrackWriter(args.live) as writer:
+            session.track(writer)
+    else:
+        session.track()
+    calibration=os.path.splitext(os.path.basename(args.calibration))[0] if args.calibration else None
+    session.save(args.output, calibration)
+    print("Tracked %d synchronized frames of %d views, saved to %s" % (session.size, session.nc, args.output))
+
+
+if __name__ == '__main__':
+    main()
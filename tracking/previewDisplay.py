@@ -0,0 +1,146 @@
+"""
+Rate limited preview windows.
+
+PreviewDisplay shows frames at most maxFps times a second and/or every k-th
+frame. Preparing a frame for display (drawing overlays, converting colours)
+is handed to a consumer thread that only ever prepares the latest frame, so
+tracking runs at full speed while the display keeps up as it can. HighGUI is
+not thread-safe and the Qt and Cocoa backends must be driven from the GUI
+thread: every cv2 window call (namedWindow, imshow, waitKey, destroyWindow)
+is made on the thread calling due(), show() and close(), which displays the
+frames the consumer has prepared. With enabled=False nothing is drawn or
+displayed at all.
+"""
+
+import threading
+import time
+
+import cv2
+
+
+class PreviewDisplay():
+
+    """Throttled display of one or more named OpenCV windows.
+
+    Usage:
+        preview=PreviewDisplay(["Tracking"], maxFps=15)
+        for frame in frames:
+            if preview.due():
+                preview.show(frame, prepare=drawOverlay)
+            if preview.quit:
+                break
+        preview.close()
+
+    due() tells whether the next frame will be displayed, so that the caller
+    only prepares displayed frames; it also displays the frames prepared
+    since the last call. show() takes one image per window and an optional
+    prepare(*images) function returning the images to display, which runs on
+    the consumer thread. quit is set once 'q' is pressed in a window.
+    """
+
+    def __init__(self, windows, maxFps=None, every=1, enabled=True, threaded=True):
+
+        self.windows=list(windows)
+        self.maxFps=maxFps
+        self.every=max(1, int(every))
+        self.enabled=enabled
+        self.threaded=threaded
+
+        self.quit=False
+        self.count=0
+        self.lastShown=None
+
+        ## (images, prepare) waiting for the consumer thread
+        self.latest=None
+        ## Images prepared by the consumer thread, waiting to be displayed
+        self.ready=None
+        self.condition=threading.Condition()
+        self.closing=False
+        self.thread=None
+
+        if self.enabled:
+            for window in self.windows:
+                cv2.namedWindow(window, cv2.WINDOW_NORMAL)
+            if self.threaded:
+                self.thread=threading.Thread(target=self.consume, daemon=True)
+                self.thread.start()
+
+    def due(self):
+        """Counts a frame and returns True if it should be displayed."""
+
+        if not self.enabled:
+            return False
+
+        self.present()
+        self.count=self.count + 1
+        if (self.count - 1) % self.every != 0:
+            return False
+        if self.maxFps:
+            now=time.perf_counter()
+            if self.lastShown is not None and now - self.lastShown < 1.0/self.maxFps:
+                return False
+            self.lastShown=now
+        return True
+
+    def show(self, *images, prepare=None):
+        """Displays one image per window, replacing any frame not displayed yet.
+
+        With the consumer thread the images are prepared there and displayed
+        by the next call to due(), show() or close().
+        """
+
+        if not self.enabled:
+            return None
+
+        if self.thread is None:
+            self.display(images if prepare is None else prepare(*images))
+            return None
+
+        with self.condition:
+            self.latest=(images, prepare)
+            self.condition.notify()
+        self.present()
+
+    def present(self):
+        """Displays the images last prepared by the consumer thread, if any."""
+
+        with self.condition:
+            images, self.ready=self.ready, None
+        if images is not None:
+            self.display(images)
+
+    def display(self, images):
+        for window, image in zip(self.windows, images):
+            cv2.imshow(window, image)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            self.quit=True
+
+    def consume(self):
+        """Consumer thread, prepares the latest frame until close(). Makes no HighGUI call."""
+
+        while True:
+            with self.condition:
+                while self.latest is None and not self.closing:
+                    self.condition.wait()
+                if self.closing:
+                    break
+                (images, prepare), self.latest=self.latest, None
+            if prepare is not None:
+                images=prepare(*images)
+            with self.condition:
+                self.ready=images
+
+    def close(self):
+        """Stops the consumer thread, displays the last prepared frame and closes the windows."""
+
+        if self.thread is not None:
+            with self.condition:
+                self.closing=True
+                self.condition.notify()
+            self.thread.join()
+            self.thread=None
+
+        if self.enabled:
+            self.present()
+            for window in self.windows:
+                cv2.destroyWindow(window)
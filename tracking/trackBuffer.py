@@ -0,0 +1,128 @@
+"""
+Columnar track buffer.
+
+TrackBuffer stores one row per tracked frame in preallocated NumPy columns
+that double in size when full, so recording a frame costs a few element
+writes instead of copying the whole history, and the recorded track is
+available at any time as zero-copy array views.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class TrackBuffer():
+
+    """Growable columns of frame, x, y, area and detected.
+
+    Usage:
+        track=TrackBuffer(capacity=frameCount)
+        track.append(frame, x, y, area, detected)
+        xs=track['x']
+
+    track[name] returns a view of the recorded rows of one column; it becomes
+    stale (but stays valid) when the buffer grows, so take views after
+    recording. detected is False on frames without a valid detection, where x
+    and y are 0.
+
+    With candidates=K > 0 the buffer also has a (K, 2) 'candidates' column of
+    the centroids of the K largest blobs of each frame, largest first, NaN
+    where a frame has fewer blobs. With targets=True (multi-target tracking)
+    there is one row per target and frame and an int32 'id' column of the
+    track ids.
+    """
+
+    ## Column names and dtypes
+    columns=(('frame', np.int32),
+             ('x', np.float64),
+             ('y', np.float64),
+             ('area', np.float64),
+             ('detected', np.bool_))
+
+    def __init__(self, capacity=1024, candidates=0, targets=False):
+
+        capacity=max(1, int(capacity))
+        self.data={name: np.zeros(capacity, dtype) for (name, dtype) in self.columns}
+        if candidates > 0:
+            self.data['candidates']=np.full((capacity, candidates, 2), np.nan)
+        if targets:
+            self.data['id']=np.zeros(capacity, np.int32)
+        self.size=0
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+    @property
+    def capacity(self):
+        return len(self.data['frame'])
+
+    @property
+    def candidates(self):
+        """Number of candidate blobs kept per frame, 0 without a candidates column."""
+
+        return self.data['candidates'].shape[1] if 'candidates' in self.data else 0
+
+    def reserve(self, capacity):
+        """Grows the columns to hold at least capacity rows."""
+
+        if capacity <= self.capacity:
+            return None
+        for (name, data) in self.data.items():
+            column=np.full((capacity,) + data.shape[1:], np.nan) if name == 'candidates' else np.zeros(capacity, data.dtype)
+            column[:self.size]=data[:self.size]
+            self.data[name]=column
+
+    def append(self, frame, x, y, area=0, detected=True, candidates=None, trackID=0):
+        """Records one frame, doubling the capacity when the buffer is full.
+
+        candidates is the (k, 2) array of candidate centroids, k at most the
+        number of candidates of the buffer, and trackID the track id of a
+        multi-target buffer.
+        """
+
+        if self.size == self.capacity:
+            self.reserve(2*self.capacity)
+
+        i=self.size
+        self.data['frame'][i]=frame
+        self.data['x'][i]=x
+        self.data['y'][i]=y
+        self.data['area'][i]=area
+        self.data['detected'][i]=detected
+        if candidates is not None and 'candidates' in self.data:
+            self.data['candidates'][i, :len(candidates)]=candidates
+        if 'id' in self.data:
+            self.data['id'][i]=trackID
+        self.size=i + 1
+
+    def extend(self, other):
+        """Appends all rows of another TrackBuffer (or a dict of equal length columns)."""
+
+        n=len(other['frame'])
+        if self.size + n > self.capacity:
+            self.reserve(max(self.size + n, 2*self.capacity))
+        for name in self.data:
+            self.data[name][self.size:self.size+n]=other[name]
+        self.size=self.size + n
+
+    def arrays(self):
+        """Returns a dict of the recorded rows of every column (views)."""
+
+        return {name: self[name] for name in self.data}
+
+    def coords(self):
+        """Returns the (n, 3) float array of frame, x_px, y_px, (n, 4) with the track id of a multi-target buffer."""
+
+        if 'id' in self.data:
+            return np.column_stack((self['frame'], self['x'], self['y'], self['id'])).astype(float)
+        return np.column_stack((self['frame'], self['x'], self['y'])).astype(float)
+
+    def toDataFrame(self, columns=None):
+        """Returns the recorded rows as a DataFrame of the given columns (all by default)."""
+
+        if columns is None:
+            columns=[name for (name, dtype) in self.columns]
+        return pd.DataFrame({name: self[name] for name in columns}, columns=list(columns))
@@ -0,0 +1,95 @@
+"""
+Incremental track overlay.
+
+TrailOverlay keeps the tracked positions drawn on a persistent canvas, so each
+new detection costs one cv2.circle call, and composes the canvas onto the
+displayed frame with a single masked blend. Redrawing every earlier position
+on every frame made the display cost grow with the length of the track.
+"""
+
+from collections import deque
+
+import cv2
+import numpy as np
+
+
+class TrailOverlay():
+
+    """Trail of tracked positions drawn over the displayed frames.
+
+    Usage:
+        overlay=TrailOverlay()
+        overlay.add((x, y))
+        display=overlay.apply(frame)
+
+    With maxPoints only the last maxPoints positions are shown; the canvas is
+    then redrawn from those positions when the oldest one drops out, which is
+    bounded by maxPoints instead of growing with the track. alpha is the
+    opacity of the trail, 1 draws it opaque.
+    """
+
+    def __init__(self, radius=6, color=(0, 0, 255), alpha=1.0, maxPoints=None):
+
+        self.radius=radius
+        self.color=color
+        self.alpha=alpha
+        self.maxPoints=maxPoints
+        self.clear()
+
+    def clear(self):
+        """Removes all positions from the trail."""
+
+        ## Positions currently shown, only kept for a bounded trail
+        self.points=deque(maxlen=self.maxPoints) if self.maxPoints else None
+        ## Single channel canvas, 255 where the trail is drawn
+        self.mask=None
+        self.colorFrame=None
+        ## Positions added before the first frame gave the canvas size
+        self.pending=[]
+
+    def setupCanvas(self, shape):
+        self.mask=np.zeros(shape[:2], np.uint8)
+        self.colorFrame=np.zeros(tuple(shape[:2])+(3,), np.uint8)
+        self.colorFrame[:]=self.color
+
+    def drawPoint(self, point):
+        cv2.circle(self.mask, (int(round(point[0])), int(round(point[1]))), self.radius, 255, thickness=-1)
+
+    def add(self, point):
+        """Adds a position to the trail, (0, 0) and None (no detection) are skipped."""
+
+        if point is None or point[0] == 0:
+            return None
+        if self.mask is None:
+            self.pending.append(point)
+            return None
+
+        if self.points is None:
+            self.drawPoint(point)
+            return None
+
+        full=len(self.points) == self.points.maxlen
+        self.points.append(point)
+        if full:
+            self.mask[:]=0
+            for p in self.points:
+                self.drawPoint(p)
+        else:
+            self.drawPoint(point)
+
+    def apply(self, frame):
+        """Blends the trail onto a BGR frame in place and returns it."""
+
+        if self.mask is None:
+            self.setupCanvas(frame.shape)
+            pending, self.pending=self.pending, []
+            for point in pending:
+                self.add(point)
+
+        where=self.mask > 0
+        if self.alpha >= 1:
+            np.copyto(frame, self.colorFrame, where=where[:, :, np.newaxis])
+        else:
+            blended=cv2.addWeighted(frame, 1-self.alpha, self.colorFrame, self.alpha, 0)
+            np.copyto(frame, blended, where=where[:, :, np.newaxis])
+        return frame
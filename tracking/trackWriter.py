@@ -0,0 +1,108 @@
+"""
+Incremental track writer.
+
+TrackWriter appends tracked positions to a header-less csv of frame, x_px,
+y_px (the format of the 2DTracks/pixels_*.csv files), or of frame, x, y, z
+for 3D tracks, in chunks while the video is being tracked, calling os.fsync at regular intervals, so an
+interrupted run keeps everything up to the last flush and can be resumed from
+there instead of losing the whole track.
+"""
+
+import os
+import time
+
+
+def lastFrame(path):
+    """Returns the last frame number completely written to a track file, 0 if none.
+
+    A partly written last line, left by a crash during a write, is removed
+    from the file.
+    """
+
+    if not os.path.exists(path):
+        return 0
+
+    with open(path, 'rb+') as fp:
+        data=fp.read()
+        end=data.rfind(b'\n') + 1
+        if end != len(data):
+            fp.truncate(end)
+
+    for line in reversed(data[:end].splitlines()):
+        if line.strip():
+            try:
+                return int(float(line.split(b',')[0]))
+            except ValueError:
+                raise ValueError("Track file %s is not the right format." % path)
+    return 0
+
+
+class TrackWriter():
+
+    """Appends rows of frame, x_px, y_px (or any other numbers) to a csv file.
+
+    Usage:
+        with TrackWriter('pixels_view1.csv') as writer:
+            writer.append(frame, x, y)
+
+    Rows are written once chunkSize rows are waiting, at the start of the next
+    frame so that the rows of one frame (the targets of multi-target mode) are
+    always written together, and synced to disk at most every syncInterval
+    seconds. With resume=True rows are appended after the ones
+    already in the file and lastFrame holds the last frame found there.
+    """
+
+    def __init__(self, path, resume=False, chunkSize=500, syncInterval=5.0):
+
+        self.path=path
+        self.chunkSize=chunkSize
+        self.syncInterval=syncInterval
+
+        ## Last frame already in the file when resuming, 0 otherwise
+        self.lastFrame=lastFrame(path) if resume else 0
+        self.fp=open(path, 'a' if resume else 'w', newline='')
+
+        self.rows=[]
+        ## Frame of the last queued row
+        self.frame=None
+        self.lastSync=time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, frame, *values):
+        """Queues one row, writing the queued rows of the previous frames once chunkSize are waiting."""
+
+        if len(self.rows) >= self.chunkSize and frame != self.frame:
+            self.flush()
+        self.frame=frame
+        self.rows.append(",".join("%r" % float(value) for value in (frame,) + values) + "\n")
+
+    def extend(self, coords):
+        """Queues the rows of an (n, 3) array of frame, x_px, y_px (or an (n, columns) array)."""
+
+        for row in coords:
+            self.append(*row)
+
+    def flush(self, sync=False):
+        """Writes the queued rows, syncing them to disk if syncInterval has passed or sync is True."""
+
+        if self.rows:
+            self.fp.write(''.join(self.rows))
+            self.rows=[]
+        self.fp.flush()
+
+        if sync or time.monotonic() - self.lastSync >= self.syncInterval:
+            os.fsync(self.fp.fileno())
+            self.lastSync=time.monotonic()
+
+    def close(self):
+        """Writes and syncs the remaining rows and closes the file."""
+
+        if self.fp.closed:
+            return None
+        self.flush(sync=True)
+        self.fp.close()
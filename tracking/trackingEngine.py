@@ -0,0 +1,907 @@
+"""
+GUI-free tracking engine.
+
+TrackingEngine runs the same background removal, filtering and contour
+detection as the GUI but takes all of its parameters from a TrackingConfig
+set up once before the run, so it can be driven by VideoTracking or run
+headless from the command line:
+
+    python -m tracking.trackingEngine video.mp4 -o pixels_view1.csv --background mog
+
+Long videos can be split into frame ranges tracked in parallel worker
+processes with TrackingEngine.trackParallel() (--workers on the command line).
+Single process runs stream the track to the output file as they go, and an
+interrupted run can be continued with --resume. With --predictive, a Kalman
+filter (see kalmanTracker) predicts where the object is on the next frame and
+only a window around that position is processed while it is being followed.
+"""
+
+import argparse
+import copy
+import multiprocessing
+import os
+from collections import namedtuple
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from tracking import backgroundModel
+from tracking import blockOutRegions
+from tracking import frameSource
+from tracking import kalmanTracker
+from tracking import multiTarget
+from tracking import trackBuffer
+from tracking import trackWriter
+from util import trackStorage
+
+
+## Result of processing one frame, yielded by TrackingEngine.frames()
+FrameResult = namedtuple('FrameResult', ['count', 'frame', 'trackingFrame', 'areas', 'detection', 'candidates', 'targets'])
+
+## Immutable per-run processing parameters, built from a TrackingConfig by buildPipeline()
+PipelineSpec = namedtuple('PipelineSpec', ['version', 'threshold', 'ops', 'highPassThresh', 'lowPassThresh'])
+
+## TrackingConfig parameters that TrackingEngine.updateConfig() can change during a run
+liveParameters = ('threshold', 'medianSize', 'gaussSize', 'erodeSize', 'dilateSize', 'highPassThresh', 'lowPassThresh')
+
+## Frames the MOG2 model is trained on before a parallel range or a resumed run, the history of cv2's MOG2
+mogWarmup = 500
+
+
+class TrackingConfig():
+
+    """Processing parameters of a tracking run.
+
+    Any attribute can be set as a keyword argument, e.g.
+    TrackingConfig(backgroundMethod='mog', medianSize=5).
+    """
+
+    def __init__(self, **keywords):
+
+        ## Background removal method: 'firstFrame', 'specified', 'model' or 'mog'
+        self.backgroundMethod='firstFrame'
+        ## Grayscale background image used by the 'specified' method
+        self.background=None
+        ## Background of the 'model' method: backgroundStatistic ('median' or
+        ## 'mode') of backgroundSamples frames sampled over the whole video,
+        ## cached next to the video unless backgroundCache is False (see
+        ## backgroundModel)
+        self.backgroundStatistic='median'
+        self.backgroundSamples=50
+        self.backgroundCache=True
+        ## Rate at which the background of the absolute difference methods
+        ## follows slow lighting changes during a run (the pixels outside the
+        ## foreground are blended in with cv2.accumulateWeighted), 0 keeps it fixed
+        self.backgroundUpdate=0.
+        ## Threshold applied to the background removed frame
+        self.threshold=25
+
+        ## Kernel sizes of the filters, None disables the filter. Even sizes are
+        ## rounded up to the next odd number, as in the GUI.
+        self.medianSize=None
+        self.gaussSize=None
+        self.erodeSize=None
+        self.dilateSize=None
+
+        ## Contours with an area below highPassThresh or above lowPassThresh are
+        ## ignored, None disables the check
+        self.highPassThresh=None
+        self.lowPassThresh=None
+
+        ## Blob detector: 'contours' (cv2.findContours, integer centroids) or
+        ## 'components' (cv2.connectedComponentsWithStats, sub-pixel centroids)
+        self.detector='contours'
+
+        ## Number of largest blobs kept per frame as candidates for matching the
+        ## views (see CalibrationModel.match()), 1 keeps the largest blob only
+        self.candidates=1
+
+        ## Multi-target mode: every blob passing the area thresholds is kept and
+        ## linked to the blobs of the previous frames by a MultiTargetTracker
+        ## (see multiTarget), with its assignment method ('greedy' or
+        ## 'hungarian'), gate distance in pixels and frames a track may be lost
+        self.multiTarget=False
+        self.assignment='greedy'
+        self.maxTargetDistance=50.
+        self.maxTargetMissed=10
+
+        ## Predictive search (single target only): a KalmanTracker predicts the
+        ## position of the object on the next frame and only a window reaching
+        ## searchMargin pixels plus searchSigmas standard deviations of the
+        ## prediction around it is processed. The full frame is processed when
+        ## nothing is found in the window, and on every frame once the object
+        ## has been lost for maxLost frames. The noise parameters are those of
+        ## the constant velocity model: acceleration (pixels/frame^2) and
+        ## detected positions (pixels). Every searchRefresh frames the full
+        ## frame is searched anyway, so that a larger object appearing elsewhere
+        ## is picked up as without the window (0 never refreshes).
+        self.predictiveSearch=False
+        self.searchRefresh=10
+        self.searchMargin=40
+        self.searchSigmas=4.
+        self.maxLost=5
+        self.kalmanProcessNoise=2.
+        self.kalmanMeasurementNoise=1.
+
+        ## List of regions to block out (see blockOutRegions), plain
+        ## (topx, topy, bottomx, bottomy) tuples are taken as rectangles
+        self.blockOutRegions=[]
+
+        ## First and last frame numbers (1 based) to record, stop=None records to the end
+        self.start=0
+        self.stop=None
+
+        ## Number of frames decoded ahead on a background thread, 0 decodes synchronously
+        self.prefetch=8
+
+        ## Only process the bounding box of the area left by the block out regions
+        self.cropToActive=True
+
+        for key, value in keywords.items():
+            if not hasattr(self, key):
+                raise TypeError("TrackingConfig has no parameter '%s'" % key)
+            setattr(self, key, value)
+
+
+def oddKernel(size):
+    """Returns size rounded up to the next odd number (None stays None)."""
+
+    if size is None:
+        return None
+    size=int(size)
+    if size % 2 == 0:
+        size=size + 1
+    return size
+
+
+def buildPipeline(config, version=0):
+    """Freezes the filter and threshold parameters of config into a PipelineSpec.
+
+    ops is the ordered tuple of (function, arguments) pairs applied to the
+    binary frame, with the morphology structuring elements built once. An erode
+    followed by a dilate of the same size is fused into one opening.
+    """
+
+    ops=[]
+
+    medianSize=oddKernel(config.medianSize)
+    if medianSize is not None:
+        ops.append((cv2.medianBlur, (medianSize,)))
+
+    erodeSize=oddKernel(config.erodeSize)
+    dilateSize=oddKernel(config.dilateSize)
+    if erodeSize is not None and erodeSize == dilateSize:
+        kernel=cv2.getStructuringElement(cv2.MORPH_RECT, (erodeSize, erodeSize))
+        ops.append((cv2.morphologyEx, (cv2.MORPH_OPEN, kernel)))
+    else:
+        if erodeSize is not None:
+            ops.append((cv2.erode, (cv2.getStructuringElement(cv2.MORPH_RECT, (erodeSize, erodeSize)),)))
+        if dilateSize is not None:
+            ops.append((cv2.dilate, (cv2.getStructuringElement(cv2.MORPH_RECT, (dilateSize, dilateSize)),)))
+
+    gaussSize=oddKernel(config.gaussSize)
+    if gaussSize is not None:
+        ops.append((cv2.GaussianBlur, ((gaussSize, gaussSize), 0)))
+
+    return PipelineSpec(version, config.threshold, tuple(ops), config.highPassThresh, config.lowPassThresh)
+
+
+def readBlockFile(path):
+    """Reads a block out region file as written by MainWindow.saveBlock().
+
+    json files are read with blockOutRegions.loadRegions(), other files are
+    read as the text format of rectangles. Returns a list of regions.
+    """
+
+    if path.lower().endswith('.json'):
+        return blockOutRegions.loadRegions(path)
+
+    regions=[]
+    with open(path) as fp:
+        lines=[line.strip() for line in fp if line.strip()]
+
+    i=0
+    while i < len(lines):
+        if lines[i].startswith('Block'):
+            try:
+                corners=[int(v) for v in lines[i+1:i+5]]
+                regions.append(blockOutRegions.RectangleRegion(*corners, ID=' '.join(lines[i].split()[1:])))
+            except (ValueError, TypeError):
+                raise ValueError("Block out region file %s is not the right format." % path)
+            i=i+5
+        else:
+            i=i+1
+    return regions
+
+
+class TrackingEngine():
+
+    """Tracks the largest moving object in a video.
+
+    Usage:
+        engine=TrackingEngine('view1.mp4', TrackingConfig(backgroundMethod='mog'))
+        coords=engine.track()
+
+    coords is an array of (frame, x_px, y_px) rows for every frame within the
+    configured bounds, with x_px=y_px=0 on frames without a valid detection.
+    The full record, with areas and detection flags, is kept in self.buffer.
+    """
+
+    def __init__(self, video, config):
+
+        self.video=video
+        self.config=config
+        ## Frozen filter parameters, replaced only through updateConfig()
+        self.pipeline=buildPipeline(self.config)
+
+        cap=cv2.VideoCapture(self.video)
+        ## Number of frames reported by the container
+        self.frameCount=int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+
+        ## (n, 4) frame, x, y, id rows of the multi-target run continued by resume(), None otherwise
+        self.resumedTracks=None
+        self.reset()
+
+    def reset(self):
+        """Clears the background model and any recorded coordinates."""
+
+        self.background=None
+        ## Float copy of the background updated at config.backgroundUpdate, set up on the first update
+        self.backgroundAccumulator=None
+        self.fgbg=cv2.createBackgroundSubtractorMOG2()
+        self.blockOut=blockOutRegions.BlockOutMask(self.config.blockOutRegions)
+        ## (x0, y0, x1, y1) crop processed on each frame, None processes the full frame
+        self.roi=None
+        ## Block out mask of the cropped frames, set up on the first frame
+        self.roiBlockOut=None
+        self.frameShape=None
+        ## Recorded track, sized for the whole video up front
+        self.buffer=trackBuffer.TrackBuffer(self.frameCount if self.frameCount > 0 else 1024,
+                                            self.config.candidates if self.config.candidates > 1 else 0,
+                                            self.config.multiTarget)
+        ## Frame to frame linking of multi-target mode, None tracks a single target
+        self.targets=None
+        if self.config.multiTarget:
+            self.targets=multiTarget.MultiTargetTracker(self.config.maxTargetDistance, self.config.maxTargetMissed,
+                                                        self.config.assignment)
+            if self.resumedTracks is not None:
+                self.targets.restore(self.resumedTracks, self.config.start - 1)
+        ## Search window prediction, None processes every frame in full
+        self.kalman=None
+        if self.config.predictiveSearch and not self.config.multiTarget:
+            self.kalman=kalmanTracker.KalmanTracker(self.config.kalmanProcessNoise, self.config.kalmanMeasurementNoise,
+                                                    self.config.searchMargin, self.config.searchSigmas, self.config.maxLost)
+
+    def updateConfig(self, **changes):
+        """Changes filter or threshold parameters, also between two frames of a run.
+
+        Only the parameters listed in liveParameters can be changed. The
+        pipeline is rebuilt with an incremented version, which is returned.
+        """
+
+        for key in changes:
+            if key not in liveParameters:
+                raise ValueError("'%s' cannot be changed during a run." % key)
+
+        self.config=copy.copy(self.config)
+        for key, value in changes.items():
+            setattr(self.config, key, value)
+        self.pipeline=buildPipeline(self.config, self.pipeline.version + 1)
+        return self.pipeline.version
+
+    def coords(self):
+        """Returns the recorded track as an (n, 3) array of frame, x_px, y_px."""
+
+        return self.buffer.coords()
+
+    def blockRegion(self, img):
+        """Fills the block out regions of img with a uniform grey (in place)."""
+
+        return self.blockOut.apply(img)
+
+    def setupRoi(self, shape):
+        """Sets the crop of frames of the given shape from the block out regions."""
+
+        self.frameShape=tuple(shape[:2])
+        self.roi=None
+        self.roiBlockOut=self.blockOut
+
+        if self.config.cropToActive and self.blockOut:
+            bounds=self.blockOut.activeBounds(self.frameShape)
+            if bounds is not None and bounds != (0, 0, self.frameShape[1], self.frameShape[0]):
+                self.roi=bounds
+                self.roiBlockOut=self.blockOut.cropped(bounds)
+
+    def crop(self, img):
+        """Returns the view of img processed by the tracker (the whole image without a crop)."""
+
+        if self.roi is None:
+            return img
+        (x0, y0, x1, y1)=self.roi
+        return img[y0:y1, x0:x1]
+
+    def roiShape(self):
+        """Returns the (height, width) of the processed crop of the frames."""
+
+        if self.roi is None:
+            return self.frameShape
+        (x0, y0, x1, y1)=self.roi
+        return (y1-y0, x1-x0)
+
+    def localWindow(self, window):
+        """Returns a full frame (x0, y0, x1, y1) search window in the coordinates of
+        the processed crop, clipped to it, or None if it lies outside the crop."""
+
+        (height, width)=self.roiShape()
+        (dx, dy)=(0, 0) if self.roi is None else self.roi[0:2]
+        (x0, y0, x1, y1)=(max(window[0]-dx, 0), max(window[1]-dy, 0), min(window[2]-dx, width), min(window[3]-dy, height))
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return (x0, y0, x1, y1)
+
+    def prepareFrame(self, frame):
+        """Returns the cropped, grayscale and blocked out version of a BGR frame."""
+
+        if self.roiBlockOut is None:
+            self.setupRoi(frame.shape)
+
+        trackingFrame=cv2.cvtColor(self.crop(frame), cv2.COLOR_BGR2GRAY)
+        return self.roiBlockOut.apply(trackingFrame)
+
+    def prepareWindow(self, frame, window):
+        """Returns the grayscale and blocked out window (from localWindow()) of a BGR frame."""
+
+        (x0, y0, x1, y1)=window
+        trackingFrame=cv2.cvtColor(self.crop(frame)[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+        return self.roiBlockOut.applyWindow(trackingFrame, window, self.roiShape())
+
+    def backgroundSubtraction(self, trackingFrame, window=None):
+        """Returns the thresholded foreground of a blocked out grayscale frame.
+
+        With the absolute difference methods, trackingFrame can also be the
+        window (from localWindow()) of a frame once the background is set, and
+        the background is updated from trackingFrame if config.backgroundUpdate
+        is set.
+        """
+
+        method=self.config.backgroundMethod
+
+        if method == 'mog':
+            frameDelta=self.fgbg.apply(trackingFrame)
+        elif method in ('firstFrame', 'specified', 'model'):
+            if self.background is None:
+                if method == 'firstFrame':
+                    self.background=trackingFrame
+                else:
+                    background=self.config.background if method == 'specified' else self.modelBackground()
+                    if background is None:
+                        raise ValueError("No background frame was specified.")
+                    if background.shape[:2] != self.frameShape:
+                        raise ValueError("The background frame and the video are not of the same dimensions.")
+                    self.background=self.roiBlockOut.apply(self.crop(background).copy())
+            background=self.background
+            if window is not None:
+                (x0, y0, x1, y1)=window
+                background=background[y0:y1, x0:x1]
+            if background.shape != trackingFrame.shape:
+                raise ValueError("The background frame and the video are not of the same dimensions.")
+            frameDelta=cv2.absdiff(background, trackingFrame)
+        else:
+            raise ValueError("Unknown background method '%s'." % method)
+
+        foreground=cv2.threshold(frameDelta, self.pipeline.threshold, 255, cv2.THRESH_BINARY)[1]
+        if self.config.backgroundUpdate and method != 'mog':
+            self.updateBackground(trackingFrame, foreground, window)
+        return foreground
+
+    def modelBackground(self):
+        """Returns the full frame grayscale background of the 'model' method, from the cache if possible."""
+
+        return backgroundModel.loadBackground(self.video, self.config.backgroundSamples, self.config.backgroundStatistic,
+                                              cache=self.config.backgroundCache)
+
+    def updateBackground(self, trackingFrame, foreground, window=None):
+        """Blends the pixels of trackingFrame (or of its window) outside the
+        foreground into the background at the config.backgroundUpdate rate."""
+
+        if self.backgroundAccumulator is None:
+            self.background=self.background.copy()
+            self.backgroundAccumulator=self.background.astype(np.float32)
+        if window is None:
+            (height, width)=self.background.shape[:2]
+            window=(0, 0, width, height)
+        (x0, y0, x1, y1)=window
+
+        accumulator=self.backgroundAccumulator[y0:y1, x0:x1].copy()
+        cv2.accumulateWeighted(trackingFrame, accumulator, self.config.backgroundUpdate, mask=cv2.bitwise_not(foreground))
+        self.backgroundAccumulator[y0:y1, x0:x1]=accumulator
+        self.background[y0:y1, x0:x1]=cv2.convertScaleAbs(accumulator)
+
+    def filters(self, trackingFrame):
+        """Applies the median, erode, dilate and Gaussian filters of the pipeline."""
+
+        for (op, args) in self.pipeline.ops:
+            trackingFrame=op(trackingFrame, *args)
+        return trackingFrame
+
+    def areaFilter(self, areas):
+        """Returns the boolean mask of the areas within the pipeline area thresholds."""
+
+        keep=np.ones(len(areas), dtype=bool)
+        if self.pipeline.lowPassThresh is not None:
+            keep&=areas <= self.pipeline.lowPassThresh
+        if self.pipeline.highPassThresh is not None:
+            keep&=areas >= self.pipeline.highPassThresh
+        return keep
+
+    def findContours(self, trackingFrame):
+        """Returns the areas, bounding boxes and integer centroids of the valid contours.
+
+        areas is an (n,) array, boxes an (n, 4) array of x, y, width, height and
+        centroids an (n, 2) array of x, y, in the order the contours were found.
+        """
+
+        #Prevents a fatal crash due to version conflict in cv2.findContours
+        try:
+            cnts, hierachy = cv2.findContours(trackingFrame.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        except ValueError:
+            ret, cnts, hierachy = cv2.findContours(trackingFrame.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+        areas=np.array([cv2.contourArea(c) for c in cnts], dtype=float)
+        keep=self.areaFilter(areas)
+
+        centroids=np.zeros((len(cnts), 2), dtype=int)
+        for i in np.flatnonzero(keep):
+            M = cv2.moments(cnts[i])
+            if M['m00'] == 0:
+                keep[i]=False
+                continue
+            centroids[i]=(int(M['m10']/M['m00']), int(M['m01']/M['m00']))
+
+        boxes=np.array([cv2.boundingRect(cnts[i]) for i in np.flatnonzero(keep)], dtype=int).reshape(-1, 4)
+
+        return areas[keep], boxes, centroids[keep]
+
+    def findComponents(self, trackingFrame):
+        """Returns the areas, bounding boxes and sub-pixel centroids of the valid
+        8-connected components, as findContours().
+
+        All components come from one cv2.connectedComponentsWithStats call and
+        are filtered with array operations. Areas are pixel counts, which are
+        somewhat larger than the contour areas of the same blobs.
+        """
+
+        n, labels, stats, centroids=cv2.connectedComponentsWithStats(trackingFrame, connectivity=8)
+
+        #Label 0 is the background
+        areas=stats[1:, cv2.CC_STAT_AREA].astype(float)
+        keep=self.areaFilter(areas)
+
+        return areas[keep], stats[1:, :4][keep], centroids[1:][keep]
+
+    def detect(self, trackingFrame):
+        """Runs the configured blob detector on a filtered binary frame."""
+
+        if self.config.detector == 'components':
+            return self.findComponents(trackingFrame)
+        if self.config.detector == 'contours':
+            return self.findContours(trackingFrame)
+        raise ValueError("Unknown detector '%s'." % self.config.detector)
+
+    def inBounds(self, count):
+        """True if frame number count lies within the configured start/stop."""
+
+        if count < self.config.start:
+            return False
+        if self.config.stop is not None and count > self.config.stop:
+            return False
+        return True
+
+    def processFrame(self, frame, window=None):
+        """Runs background removal, filtering and blob detection on a BGR frame.
+
+        Returns the filtered binary frame (cropped to self.roi) and the arrays
+        from detect(), with boxes and centroids in full frame pixel coordinates.
+
+        window is an optional (x0, y0, x1, y1) search window in full frame
+        pixels: only its pixels are filtered and searched, and the binary frame
+        returned is that of the window. The full frame is processed instead
+        when nothing is found in the window. The MOG2 model of the 'mog'
+        method still learns from the full frame.
+        """
+
+        if self.roiBlockOut is None:
+            self.setupRoi(frame.shape)
+
+        foreground=None
+        if window is not None:
+            window=self.localWindow(window)
+        if window is not None and self.config.backgroundMethod == 'mog':
+            foreground=self.backgroundSubtraction(self.prepareFrame(frame))
+            (x0, y0, x1, y1)=window
+            trackingFrame=foreground[y0:y1, x0:x1]
+        elif window is not None and self.background is not None:
+            trackingFrame=self.backgroundSubtraction(self.prepareWindow(frame, window), window)
+        else:
+            window=None
+
+        if window is not None:
+            trackingFrame=self.filters(trackingFrame)
+            areas, boxes, centroids=self.detect(trackingFrame)
+            if len(areas) > 0:
+                return (trackingFrame, areas)+self.toFrame(boxes, centroids, window[0:2])
+
+        if foreground is None:
+            foreground=self.backgroundSubtraction(self.prepareFrame(frame))
+        trackingFrame=self.filters(foreground)
+        areas, boxes, centroids=self.detect(trackingFrame)
+
+        return (trackingFrame, areas)+self.toFrame(boxes, centroids)
+
+    def toFrame(self, boxes, centroids, origin=(0, 0)):
+        """Moves boxes and centroids detected in the crop (or at origin in it) to full frame pixel coordinates."""
+
+        offset=np.array(origin)
+        if self.roi is not None:
+            offset=offset + self.roi[0:2]
+        if offset.any():
+            boxes[:, 0:2]+=offset
+            centroids=centroids + offset
+        return boxes, centroids
+
+    def selectDetection(self, areas, centroids):
+        """Returns the (x, y) centroid and area of the largest blob, ((0, 0), 0) without any blob."""
+
+        if len(areas) == 0:
+            return (0, 0), 0
+        i=np.argmax(areas)
+        (x, y)=centroids[i]
+        return (x.item(), y.item()), areas[i].item()
+
+    def selectCandidates(self, areas, centroids):
+        """Returns the (k, 2) float centroids of the config.candidates largest blobs, largest first."""
+
+        k=min(self.config.candidates, len(areas))
+        order=np.argsort(-np.asarray(areas), kind='stable')[0:k]
+        return np.asarray(centroids, dtype=float).reshape(-1, 2)[order]
+
+    def recordTargets(self, count, areas, centroids):
+        """Links the blobs of frame count to the tracks and records one row per blob.
+
+        Returns the (blobs, 3) array of track id, x, y.
+        """
+
+        ids=self.targets.update(centroids)
+        for i in range(len(ids)):
+            self.buffer.append(count, centroids[i][0], centroids[i][1], areas[i], True, trackID=ids[i])
+        return np.column_stack((ids, np.asarray(centroids, dtype=float).reshape(-1, 2)))
+
+    def frames(self, first=1, warmup=0):
+        """Generator tracking the video frame by frame.
+
+        Yields a FrameResult for every frame read, starting at frame number
+        first. The first warmup frames read are only run through the
+        background model (to train MOG2 before the recorded frames) and are
+        not yielded. detection is the (x, y) position recorded for the frame, or None
+        when the frame lies outside the configured bounds, and candidates the
+        selectCandidates() array when config.candidates > 1 (None otherwise).
+        In multi-target mode every blob is recorded with its track id and
+        targets is the (blobs, 3) array of id, x, y of the frame. With
+        config.predictiveSearch, the frames are searched in the window
+        predicted by self.kalman (see processFrame()).
+        Closing the generator early releases the video.
+        """
+
+        self.reset()
+        source=frameSource.FrameSource(self.video, prefetch=self.config.prefetch)
+        count=1
+
+        try:
+            if first > 1:
+                if self.config.backgroundMethod == 'firstFrame':
+                    #The background is always the first frame of the video, as in a full run
+                    (grabbed, frame)=source.read()
+                    if grabbed:
+                        self.background=self.prepareFrame(frame)
+                source.seek(first-1)
+                count=first
+
+            while True:
+                if self.config.stop is not None and count > self.config.stop:
+                    break
+
+                (grabbed, frame)=source.read()
+                if not grabbed:
+                    break
+
+                if warmup > 0:
+                    self.backgroundSubtraction(self.prepareFrame(frame))
+                    warmup=warmup - 1
+                    count=count + 1
+                    continue
+
+                window=None
+                if self.kalman is not None:
+                    window=self.kalman.predict(frame.shape)
+                    if self.config.searchRefresh and count % self.config.searchRefresh == 0:
+                        window=None
+                trackingFrame, areas, boxes, centroids=self.processFrame(frame, window)
+                largest, area=self.selectDetection(areas, centroids)
+                if self.kalman is not None:
+                    if len(areas) > 0:
+                        self.kalman.update(largest, boxes[np.argmax(areas), 2:4])
+                    else:
+                        self.kalman.update(None)
+
+                detection=None
+                candidates=None
+                targets=None
+                if self.inBounds(count):
+                    detection=largest
+                    if self.targets is not None:
+                        targets=self.recordTargets(count, areas, centroids)
+                    else:
+                        if self.config.candidates > 1:
+                            candidates=self.selectCandidates(areas, centroids)
+                        self.buffer.append(count, detection[0], detection[1], area, len(areas) > 0, candidates)
+
+                yield FrameResult(count, frame, trackingFrame, areas, detection, candidates, targets)
+                count=count + 1
+        finally:
+            source.release()
+
+    def track(self, writer=None, first=1, warmup=0):
+        """Tracks the whole video without any display and returns coords().
+
+        Each recorded position is also appended to writer (a TrackWriter) if
+        given, as soon as its frame is processed.
+        """
+
+        for result in self.frames(first, warmup):
+            if writer is None:
+                continue
+            if result.targets is not None:
+                for (trackID, x, y) in result.targets:
+                    writer.append(result.count, x, y, trackID)
+            elif result.detection is not None:
+                writer.append(result.count, *result.detection)
+        return self.coords()
+
+    def resume(self, lastFrame, warmup=mogWarmup, tracks=None):
+        """Sets the run up to continue a track recorded up to frame lastFrame.
+
+        In multi-target mode tracks must hold the (n, 4) frame, x, y, id rows
+        already recorded: the linking continues from the tracks still open at
+        lastFrame and new tracks are numbered after the ids of tracks.
+
+        Returns the frame number frames() should read from. With the 'mog'
+        method, or a background updated at config.backgroundUpdate, the last
+        warmup frames before the first recorded frame train the background
+        model, which approximates an uninterrupted run (see
+        trackParallel()); with warmup=None all of them from frame 1 do, which
+        gives the same model but reads the whole video up to lastFrame again.
+        """
+
+        self.config=copy.copy(self.config)
+        self.config.start=max(self.config.start, lastFrame + 1)
+        if self.config.multiTarget:
+            if tracks is None:
+                raise ValueError("Resuming a multi-target run needs the tracks already recorded.")
+            tracks=np.asarray(tracks, dtype=float)
+            if tracks.size and (tracks.ndim != 2 or tracks.shape[1] != 4):
+                raise ValueError("The track to resume was not recorded in multi-target mode.")
+            self.resumedTracks=tracks.reshape(-1, 4)
+        if self.config.backgroundMethod == 'mog' or self.config.backgroundUpdate:
+            return 1 if warmup is None else max(1, self.config.start - warmup)
+        return self.config.start
+
+    def shards(self, workers, warmup=None):
+        """Splits the configured start/stop range into one frame range per worker.
+
+        Returns a list of (first, start, stop) frame numbers: each worker reads
+        from first, trains the background model on the frames before start and
+        records start to stop. first is frame 1 with warmup=None, or warmup
+        frames before start. The first range reads from the beginning of the
+        video, exactly like track().
+        """
+
+        start=max(1, self.config.start)
+        stop=self.frameCount if self.config.stop is None else min(self.config.stop, self.frameCount)
+        if stop < start:
+            return []
+
+        bounds=np.linspace(start, stop+1, min(workers, stop-start+1)+1).astype(int)
+        shards=[]
+        for i in range(len(bounds)-1):
+            if i == 0 or warmup is None:
+                first=1
+            else:
+                first=max(1, bounds[i]-warmup)
+            shards.append((int(first), int(bounds[i]), int(bounds[i+1]-1)))
+        return shards
+
+    def trackParallel(self, workers=None, warmup=mogWarmup):
+        """Tracks the video in parallel frame ranges and returns coords().
+
+        The start/stop range is split into contiguous ranges by shards(), each
+        tracked in a worker process with its own cv2.VideoCapture seeked to the
+        range, and the results are merged back in frame order. The absolute
+        difference methods need no warm-up. The MOG2 model of the 'mog' method
+        depends on every frame before the range, so each worker first runs the
+        warmup frames before its range through the background model only (no
+        filtering or detection). The default, mogWarmup frames (the MOG2
+        history), is an approximation of the sequential run: older frames
+        still weigh in the sequential model, and on the example video a
+        100 frame warm-up moved 26 of 88 positions by more than a pixel, so
+        shorter warm-ups are not advised. warmup=None runs all the frames from
+        frame 1 and reproduces a sequential run exactly, but as a warm-up frame
+        costs about 2/3 of a tracked frame (decoding and MOG2 dominate) it is
+        at most about 1.5 times faster than track(). Predictive search starts
+        afresh in each range. Multi-target runs and runs with
+        config.backgroundUpdate are tracked sequentially by track() instead,
+        as their state depends on every frame before.
+        """
+
+        if self.config.multiTarget or (self.config.backgroundUpdate and self.config.backgroundMethod != 'mog'):
+            #Linking the targets and the drifting background need the frames in order
+            return self.track()
+        if workers is None:
+            workers=multiprocessing.cpu_count()
+        if self.config.backgroundMethod != 'mog':
+            warmup=0
+
+        shards=self.shards(workers, warmup)
+        if len(shards) < 2 or self.frameCount <= 0:
+            return self.track()
+
+        config=self.config
+        if config.backgroundMethod == 'model':
+            #The model is built once and handed to the workers
+            config=copy.copy(config)
+            config.backgroundMethod='specified'
+            config.background=self.modelBackground()
+        jobs=[(self.video, config, shard) for shard in shards]
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results=pool.map(trackShard, jobs)
+
+        self.reset()
+        for result in results:
+            self.buffer.extend(result)
+        return self.coords()
+
+
+def trackShard(job):
+    """Worker of TrackingEngine.trackParallel(), tracks one (first, start, stop) range."""
+
+    video, config, (first, start, stop)=job
+    config=copy.copy(config)
+    config.start=start
+    config.stop=stop
+
+    engine=TrackingEngine(video, config)
+    for result in engine.frames(first, start - first):
+        pass
+    return engine.buffer.arrays()
+
+
+def candidatesPath(path):
+    """Returns the file the candidates of the track file path are saved to."""
+
+    return os.path.splitext(path)[0] + '_candidates.npy'
+
+
+def saveCoords(path, coords, metadata=None):
+    """Saves a track of frame, x_px, y_px to a header-less csv, or any other
+    format of trackStorage chosen by the extension of path (e.g. .npz) along
+    with metadata.
+
+    coords is an (n, 3) array or a TrackBuffer. The (n, k, 2) candidates of a
+    TrackBuffer that has them are saved next to the track, to candidatesPath(path).
+    Multi-target tracks ((n, 4) arrays) have a fourth column of track ids.
+    """
+
+    if isinstance(coords, trackBuffer.TrackBuffer):
+        data=pd.DataFrame(coords.coords())
+        if coords.candidates:
+            np.save(candidatesPath(path), coords['candidates'].astype(np.float32))
+    else:
+        data=pd.DataFrame(coords)
+    data.columns=['Image frame', 'x_px', 'y_px', 'track_id'][0:data.shape[1]]
+    trackStorage.saveTrack(path, data, metadata, header=False)
+
+
+def warmupFrames(text):
+    """argparse type of --warmup: a number of frames, or None for 'all'."""
+
+    if text == 'all':
+        return None
+    return int(text)
+
+
+def main(argv=None):
+
+    parser=argparse.ArgumentParser(description="Track the largest moving object in a video without a display.")
+    parser.add_argument('video', help="video file to track")
+    parser.add_argument('-o', '--output', required=True, help="csv file the pixel coordinates are written to")
+    parser.add_argument('--background', default='firstFrame', choices=['firstFrame', 'specified', 'model', 'mog'], help="background removal method")
+    parser.add_argument('--background-image', help="background image used with --background specified")
+    parser.add_argument('--statistic', default='median', choices=list(backgroundModel.statistics), help="statistic of the sampled frames used as background by --background model")
+    parser.add_argument('--samples', type=int, default=50, help="number of frames sampled by --background model")
+    parser.add_argument('--no-cache', action='store_true', help="build the background of --background model again instead of reading it from the cache")
+    parser.add_argument('--background-update', type=float, default=0., help="rate at which the background follows lighting changes (e.g. 0.01), 0 keeps it fixed")
+    parser.add_argument('--threshold', type=int, default=25, help="threshold applied after background removal")
+    parser.add_argument('--median', type=int, help="median filter kernel size")
+    parser.add_argument('--gauss', type=int, help="Gaussian filter kernel size")
+    parser.add_argument('--erode', type=int, help="erosion kernel size")
+    parser.add_argument('--dilate', type=int, help="dilation kernel size")
+    parser.add_argument('--min-area', type=float, help="ignore contours smaller than this area")
+    parser.add_argument('--max-area', type=float, help="ignore contours larger than this area")
+    parser.add_argument('--detector', default='contours', choices=['contours', 'components'], help="blob detector, components gives sub-pixel centroids")
+    parser.add_argument('--candidates', type=int, default=1, help="number of largest blobs kept per frame, saved next to the output for matching the views")
+    parser.add_argument('--multi-target', action='store_true', help="track every blob above the area threshold and write a fourth column of track ids")
+    parser.add_argument('--assignment', default='greedy', choices=['greedy', 'hungarian'], help="frame to frame assignment of multi-target mode, hungarian needs scipy")
+    parser.add_argument('--max-distance', type=float, default=50., help="largest distance in pixels a target moves between frames in multi-target mode")
+    parser.add_argument('--predictive', action='store_true', help="only search a window around the position predicted by a Kalman filter while the object is followed")
+    parser.add_argument('--search-margin', type=int, default=40, help="margin in pixels of the predictive search window around the predicted position")
+    parser.add_argument('--blocks', help="block out region file saved from the GUI (text or json)")
+    parser.add_argument('--start', type=int, default=0, help="first frame to record")
+    parser.add_argument('--stop', type=int, help="last frame to record")
+    parser.add_argument('--full-frame', action='store_true', help="process the full frame instead of the area left by the block out regions")
+    parser.add_argument('--workers', type=int, default=1, help="number of worker processes tracking frame ranges in parallel")
+    parser.add_argument('--warmup', type=warmupFrames, default=mogWarmup, help="frames run through the MOG2 model before each parallel range or a resumed run (default %(default)s, an approximation of a sequential run), 'all' reads every frame from the first and matches a sequential run exactly but is much slower")
+    parser.add_argument('--resume', action='store_true', help="continue the track already in the output file after its last frame")
+    args=parser.parse_args(argv)
+
+    config=TrackingConfig(backgroundMethod=args.background,
+                          backgroundStatistic=args.statistic,
+                          backgroundSamples=args.samples,
+                          backgroundCache=not args.no_cache,
+                          backgroundUpdate=args.background_update,
+                          threshold=args.threshold,
+                          medianSize=args.median,
+                          gaussSize=args.gauss,
+                          erodeSize=args.erode,
+                          dilateSize=args.dilate,
+                          highPassThresh=args.min_area,
+                          lowPassThresh=args.max_area,
+                          detector=args.detector,
+                          candidates=args.candidates,
+                          multiTarget=args.multi_target,
+                          assignment=args.assignment,
+                          maxTargetDistance=args.max_distance,
+                          predictiveSearch=args.predictive,
+                          searchMargin=args.search_margin,
+                          start=args.start,
+                          stop=args.stop,
+                          cropToActive=not args.full_frame)
+
+    if args.background_image:
+        config.background=cv2.cvtColor(cv2.imread(args.background_image), cv2.COLOR_BGR2GRAY)
+    if args.blocks:
+        config.blockOutRegions=readBlockFile(args.blocks)
+
+    engine=TrackingEngine(args.video, config)
+    with trackWriter.TrackWriter(args.output, resume=args.resume) as writer:
+        first=1
+        if args.resume:
+            tracks=None
+            if args.multi_target:
+                tracks=np.loadtxt(args.output, delimiter=',', ndmin=2) if writer.lastFrame > 0 else np.zeros((0, 4))
+            first=engine.resume(writer.lastFrame, args.warmup, tracks)
+        if args.workers > 1:
+            coords=engine.trackParallel(args.workers, args.warmup)
+            writer.extend(coords)
+        else:
+            coords=engine.track(writer, first, engine.config.start - first if args.resume else 0)
+    if engine.buffer.candidates and not args.resume:
+        np.save(candidatesPath(args.output), engine.buffer['candidates'].astype(np.float32))
+    if args.multi_target:
+        print("Tracked %d targets on %d frames, raw pixel coordinates saved to %s" % (len(np.unique(coords[:, 3])), len(np.unique(coords[:, 0])), args.output))
+    else:
+        print("Tracked %d frames, raw pixel coordinates saved to %s" % (len(coords), args.output))
+
+
+if __name__ == '__main__':
+    main()
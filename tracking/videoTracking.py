@@ -1,8 +1,14 @@
 import cv2
-import numpy as np
-import pandas as pd
 import os
-from PyQt5.QtWidgets import QMessageBox, QFileDialog
+import threading
+import numpy as np
+from PyQt5.QtWidgets import QMessageBox, QFileDialog, QApplication
+
+from tracking import frameSource
+from tracking import previewDisplay
+from tracking import trackingEngine
+from tracking import trackOverlay
+from tracking import trackWriter
 
 
 
@@ -18,50 +24,54 @@ class VideoTracking():
         cap = cv2.VideoCapture(self.MainWindow.video)
         self.start=0
         self.stop = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
         self.MainWindow.stop_sb.setValue(self.stop)
- 
-    def blockRegion(self,img):
-        if self.MainWindow.blockOutRegions_cb.isChecked()==True: 
-            for key in self.MainWindow.blockOutRegions: 
-                
-                if key in self.MainWindow.disabledBlockOutRegions.keys():
-                    continue
 
-                topx=self.MainWindow.blockOutRegions[key].topx            
-                topy=self.MainWindow.blockOutRegions[key].topy            
-                bottomx=self.MainWindow.blockOutRegions[key].bottomx            
-                bottomy=self.MainWindow.blockOutRegions[key].bottomy            
-                img=cv2.rectangle(img, (topx,topy),(bottomx,bottomy), 100,-1)
-        return img
+        ## Number of tracked positions shown on the video, None shows the whole track
+        self.trailPoints=None
+
+        ## Preview windows are refreshed at most previewFps times a second and
+        ## every previewEvery frames; showPreview=False tracks without display
+        self.previewFps=30
+        self.previewEvery=1
+        self.showPreview=True
+
+        ## Number of largest blobs kept per frame, saved next to the track so
+        ## Processing3D can match them across views
+        self.candidateBlobs=3
 
+        ## Track every blob passing the area thresholds, with track ids (see tracking.multiTarget)
+        self.multiTarget=False
+
+        ## Only search a window around the position predicted by a Kalman filter
+        ## (see tracking.kalmanTracker), single target only
+        self.predictiveSearch=False
+ 
     def preview(self):
 
-        cap = cv2.VideoCapture(self.MainWindow.video)
+        source = frameSource.FrameSource(self.MainWindow.video)
+        display = previewDisplay.PreviewDisplay(["Preview"], maxFps=self.previewFps, every=self.previewEvery)
         self.MainWindow.track_TE.append("Playing preview. Click video window and press 'q' or click 'Stop' button to cancel")
         
         while(True):
-            (grabbed, frame) = cap.read()
+            (grabbed, frame) = source.read()
             
-            if not grabbed:
+            if not grabbed or display.quit:
                 break                 
-            currentframe = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            height, width = currentframe.shape[:2]
-            cv2.namedWindow("Preview", cv2.WINDOW_NORMAL) 
-            cv2.imshow("Preview",currentframe)  
-            
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break  
-        cap.release()
-        cv2.destroyAllWindows()  
+            if display.due():
+                display.show(frame, prepare=lambda frame: (cv2.cvtColor(frame, cv2.COLOR_BGR2RGB),))
+        source.release()
+        display.close()
 
     def selectVideoBounds(self):
 
-        cap = cv2.VideoCapture(self.MainWindow.video)
-        length = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        #Scrubbing seeks on every trackbar move, so frames are not decoded ahead
+        source = frameSource.FrameSource(self.MainWindow.video, prefetch=0)
+        length = source.frameCount
 
         def onChange(trackbarValue):
-            cap.set(cv2.CAP_PROP_POS_FRAMES,trackbarValue)
-            err,img = cap.read()
+            source.seek(trackbarValue)
+            err,img = source.read()
             cv2.imshow("Select", img)
             pass
 
@@ -71,8 +81,8 @@ class VideoTracking():
         cv2.namedWindow('Select')
         cv2.createTrackbar( 'Start', 'Select', self.start, length, onChange )
         cv2.createTrackbar( 'Stop'  , 'Select', self.stop, length, onChange )
-        cap.set(cv2.CAP_PROP_POS_FRAMES,cv2.getTrackbarPos('Start','Select'))
-        err,img = cap.read()
+        source.seek(cv2.getTrackbarPos('Start','Select'))
+        err,img = source.read()
         cv2.imshow("Select", img)
         
         self.MainWindow.statusBar().showMessage("Press any key once frame limits have been chosen to exit.")
@@ -82,7 +92,7 @@ class VideoTracking():
          
         self.start = cv2.getTrackbarPos('Start','Select')
         self.stop   = cv2.getTrackbarPos('Stop','Select')
-        cap.release()
+        source.release()
         cv2.destroyAllWindows()   
         
         self.MainWindow.start_sb.setValue(self.start)
@@ -90,149 +100,197 @@ class VideoTracking():
 
         self.MainWindow.statusBar().showMessage("") 
 
+    def getConfig(self):
+        """Reads the tracking parameters from the GUI into a TrackingConfig.
+
+        Returns None (after warning the user) if a parameter is invalid.
+        """
+
+        config=trackingEngine.TrackingConfig()
+
+        if self.MainWindow.specifyBackground_rb.isChecked()==True:
+            config.backgroundMethod='specified'
+            config.background=getattr(self.MainWindow, 'background', None)
+        elif self.MainWindow.mog_rb.isChecked()==True:
+            config.backgroundMethod='mog'
+        elif self.MainWindow.modelBackground_rb.isChecked()==True:
+            config.backgroundMethod='model'
+        else:
+            config.backgroundMethod='firstFrame'
+
+        if self.MainWindow.medianFilterCheckbox.isChecked() == True:
+            config.medianSize=int(self.MainWindow.medianSlider.value())
+        if self.MainWindow.gaussCheckBox.isChecked() == True:
+            config.gaussSize=int(self.MainWindow.gaussSlider.value())
+
+        try:
+            if self.MainWindow.highPass_cb.isChecked():
+                config.highPassThresh=int(self.MainWindow.highPass_le.text())
+            if self.MainWindow.lowPass_cb.isChecked():
+                config.lowPassThresh=int(self.MainWindow.lowPass_le.text())
+        except ValueError:
+            self.errMessage="Contour area thresholds must be whole numbers."
+            self.errorTitle="Invalid contour threshold!"
+            self.errorMsg()
+            return None
+
+        if self.MainWindow.blockOutRegions_cb.isChecked()==True:
+            for key in self.MainWindow.blockOutRegions:
+                if key in self.MainWindow.disabledBlockOutRegions.keys():
+                    continue
+                config.blockOutRegions.append(self.MainWindow.blockOutRegions[key].toRegion())
+
+        config.start=self.MainWindow.start_sb.value()
+        config.stop=self.MainWindow.stop_sb.value()
+        config.candidates=self.candidateBlobs
+        config.multiTarget=self.multiTarget
+        config.predictiveSearch=self.predictiveSearch
+
+        return config
+
+    def liveParameterSignals(self):
+        """Signals of the widgets whose parameters can change while tracking."""
+
+        return [self.MainWindow.medianSlider.valueChanged,
+                self.MainWindow.gaussSlider.valueChanged,
+                self.MainWindow.medianFilterCheckbox.toggled,
+                self.MainWindow.gaussCheckBox.toggled,
+                self.MainWindow.highPass_cb.toggled,
+                self.MainWindow.lowPass_cb.toggled,
+                self.MainWindow.highPass_le.editingFinished,
+                self.MainWindow.lowPass_le.editingFinished]
+
+    def liveParameterChange(self):
+        """Passes filter and threshold changes made while tracking to the engine."""
+
+        config=self.getConfig()
+        if config is None:
+            return None
+        version=self.engine.updateConfig(**{key: getattr(config, key) for key in trackingEngine.liveParameters})
+        self.MainWindow.statusBar().showMessage("Tracking parameters updated (version %d)." % version)
+
+    def trackFile(self):
+        """Returns the file tracks are streamed to, 2DTracks/pixels_<video name>.csv in the project folder."""
+
+        folder=os.path.join(self.MainWindow.path, '2DTracks')
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, 'pixels_%s.csv' % self.filename)
+
+    def promptResume(self, path):
+        """Asks whether to continue the track already in path. Returns False if there is none."""
+
+        last=trackWriter.lastFrame(path)
+        if last == 0:
+            return False
+        reply = QMessageBox.question(None, 'Resume tracking?',
+                'A track up to frame %d already exists in %s. Continue it? (No starts a new track)' % (last, path),
+                QMessageBox.Yes, QMessageBox.No)
+        return reply == QMessageBox.Yes
+
     def trackVideo(self):
 
         self.MainWindow.track_TE.clear()
 
-        self.cap = cv2.VideoCapture(self.MainWindow.video)
-        self.background = None
-        self.fgbg = cv2.createBackgroundSubtractorMOG2()
-
-        count = 1
-        xcoord=[]
-        ycoord=[]
-        frame=[]
-        cx=0
-        cy=0
+        config=self.getConfig()
+        if config is None:
+            self.MainWindow.trkTrack_B.setChecked(False)
+            self.MainWindow.trkTrack_B.setText('Track')
+            return None
+
+        self.engine=trackingEngine.TrackingEngine(self.MainWindow.video, config)
+        self.trackPath=self.trackFile()
+        resume=self.promptResume(self.trackPath)
+        writer=trackWriter.TrackWriter(self.trackPath, resume=resume)
+        first=1
+        warmup=0
+        if resume:
+            tracks=np.loadtxt(self.trackPath, delimiter=',', ndmin=2) if config.multiTarget else None
+            first=self.engine.resume(writer.lastFrame, trackingEngine.mogWarmup, tracks)
+            #The frames before the resumed range only train the MOG2 model, without display
+            warmup=self.engine.config.start - first
+            self.MainWindow.track_TE.append("Resuming after frame %d." % writer.lastFrame)
+            if warmup > 0:
+                self.MainWindow.track_TE.append("Training the background model on frames %d to %d first (no preview)." % (first, first + warmup - 1))
+
+        self.MainWindow.statusBar().showMessage("Tracking. Click video window and press 'q' or click 'Stop' button to cancel.")
+        self.MainWindow.trkTrack_B.setText('Stop')
+
+        overlay=trackOverlay.TrailOverlay(maxPoints=self.trailPoints)
+        #The trail is added to here and drawn on the display's consumer thread
+        overlayLock=threading.Lock()
+
+        def drawTracking(trackingFrame, frame):
+            with overlayLock:
+                frame=overlay.apply(frame)
+            return trackingFrame, self.engine.blockRegion(frame)
+
+        missed=0
+        display=previewDisplay.PreviewDisplay(["Background removed", "Tracking"], maxFps=self.previewFps,
+                                              every=self.previewEvery, enabled=self.showPreview)
+        frames=self.engine.frames(first, warmup)
+
+        for signal in self.liveParameterSignals():
+            signal.connect(self.liveParameterChange)
 
         try:
-            self.highPassThresh=int(self.MainWindow.highPass_le.text())
-            self.lowPassThresh=int(self.MainWindow.lowPass_le.text())
-        except AttributeError:
-            pass
+            for result in frames:
 
-        while(True):
-            if count==0:
-                self.MainWindow.statusBar().showMessage("Tracking. Click video window and press 'q' or click 'Stop' button to cancel.")
-                
-            if self.MainWindow.trkTrack_B.isChecked()== False:
-                self.MainWindow.trkTrack_B.setText('Track')
-                self.MainWindow.statusBar().showMessage("")
-                break
+                #Keeps the Stop button and the live parameter widgets responsive
+                QApplication.processEvents()
+                if self.MainWindow.trkTrack_B.isChecked()== False or display.quit:
+                    break
+
+                if result.detection is not None and len(result.areas) == 0:
+                    missed=missed + 1
+                if result.targets is not None:
+                    for (trackID, x, y) in result.targets:
+                        writer.append(result.count, x, y, trackID)
+                elif result.detection is not None:
+                    writer.append(result.count, *result.detection)
+                if display.enabled:
+                    with overlayLock:
+                        overlay.add(result.detection)
+
+                if display.due():
+                    display.show(result.trackingFrame, result.frame, prepare=drawTracking)
             else:
-                self.MainWindow.trkTrack_B.setText('Stop')
-                
-            (self.grabbed, self.frame) = self.cap.read()
-
-            if not self.grabbed:
-                self.MainWindow.trkTrack_B.setChecked(False)
-                self.MainWindow.trkTrack_B.setText('Track')
-                self.MainWindow.track_TE.append("Tracking complete!")        
-                break
-            
-            rows,cols,ch = self.frame.shape
-        
+                self.MainWindow.track_TE.append("Tracking complete!")
+            self.MainWindow.track_TE.append("Frames tracked: %d, without a valid contour: %d" % (len(self.engine.buffer), missed))
 
-            self.trackingFrame = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
-            self.trackingFrame=self.blockRegion(self.trackingFrame)
-            
-            if self.MainWindow.specifyBackground_rb.isChecked()==True:
-                ret=self.useSelectedFrameBackground()
-                if ret == False:
-                    self.MainWindow.trkTrack_B.setText('Track')
-                    break
-            elif self.MainWindow.mog_rb.isChecked()==True:
-                self.mog2Subtraction()
-            elif self.MainWindow.firstFrame_rb.isChecked()==True:
-                self.useFirstFrameBackground()
-            
-            self.filters()
+        except ValueError as e:
+            self.errMessage="%s Verify your choice of background frame and try again." % str(e)
+            self.errorTitle="Error with background frame!"
+            self.errorMsg()
 
-            try:
-                cnts, hierachy = cv2.findContours(self.trackingFrame.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-            except ValueError:
-                ret, cnts, hierachy = cv2.findContours(self.trackingFrame.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)   
+        for signal in self.liveParameterSignals():
+            signal.disconnect(self.liveParameterChange)
 
-            cntarea=[0]
-            xcntcoord=[0]
-            ycntcoord=[0]
-            
-            for c in cnts:
-                if self.MainWindow.lowPass_cb.isChecked():
-                    if cv2.contourArea(c) > self.lowPassThresh:
-                        continue
-                if self.MainWindow.highPass_cb.isChecked():
-                    if cv2.contourArea(c) < self.highPassThresh:
-                        continue
-                    
-                cntarea.append(cv2.contourArea(c))
-                (x, y, w, h) = cv2.boundingRect(c)
-        
-                M = cv2.moments(c)
-                cx = int(M['m10']/M['m00'])
-                cy = int(M['m01']/M['m00'])
-                
-                xcntcoord.append(cx)
-                ycntcoord.append(cy)
-
-            self.MainWindow.track_TE.append("|------------------|")
-            if cntarea[-1]==0:
-                self.MainWindow.track_TE.append("Frame %d: No valid contours detected" % count)
-            else:
-                self.MainWindow.track_TE.append("Valid detections on frame: %d" % count)
-                for c in cntarea:
-                    c=int(c)
-                    if c == 0:
-                        continue
-                    else:
-                        self.MainWindow.track_TE.append("Frame %i coutour area: %i" % (count,c))
-
-            self.start=self.MainWindow.start_sb.value()    
-            self.stop=self.MainWindow.stop_sb.value()    
-            
-            if count > self.stop or count < self.start:
-                self.MainWindow.track_TE.append("Not within frame number bounds.")  
-            else:
-                biggestcontour=cntarea.index(max(cntarea))
-                xcoord.append(xcntcoord[biggestcontour])
-                ycoord.append(ycntcoord[biggestcontour])
-                frame.append(count)
-                self.objectCoords=np.array((frame,xcoord,ycoord),dtype=float) 
-
-            for i in range(len(xcoord)):
-                if xcoord[i]==0: 
-                    pass
-                else:
-                    cv2.circle(self.frame, (xcoord[i], ycoord[i]),6, (0, 0, 255),thickness=-1)
-                  
-            self.frame=self.blockRegion(self.frame)
-
-            cv2.namedWindow("Background removed", cv2.WINDOW_NORMAL) 
-            cv2.imshow("Background removed",self.trackingFrame)   
-
-            cv2.namedWindow("Tracking", cv2.WINDOW_NORMAL)
-            cv2.imshow("Tracking",self.frame)  
-
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                self.MainWindow.trkTrack_B.setChecked(False)
-                self.MainWindow.trkTrack_B.setText('Track')
-                self.MainWindow.statusBar().showMessage("")
-                break
-            count = count +1
-            
-        self.cap.release()
-        cv2.destroyAllWindows()
+        frames.close()
+        display.close()
+        writer.close()
+        self.MainWindow.track_TE.append("Raw pixel coordinates streamed to:")
+        self.MainWindow.track_TE.append(self.trackPath)
+
+        if resume:
+            self.objectCoords=np.loadtxt(self.trackPath, delimiter=',', ndmin=2)
+        else:
+            self.objectCoords=self.engine.buffer
+            if self.engine.buffer.candidates:
+                np.save(trackingEngine.candidatesPath(self.trackPath), self.engine.buffer['candidates'].astype(np.float32))
+
+        self.MainWindow.trkTrack_B.setChecked(False)
+        self.MainWindow.trkTrack_B.setText('Track')
         self.MainWindow.statusBar().showMessage("")
-        
+
     def saveTrack(self):
 
         try:
-            path = QFileDialog.getSaveFileName(None, 'Save File', self.MainWindow.path, 'CSV(*.csv)')[0]
+            path = QFileDialog.getSaveFileName(None, 'Save File', self.MainWindow.path, 'CSV(*.csv);;NPZ(*.npz)')[0]
+            if path == '':
+                return None
 
-            self.objectCoords=np.transpose(self.objectCoords)
-            self.objectCoords=pd.DataFrame(self.objectCoords)
-            self.objectCoords.index = np.arange(1, len(self.objectCoords) + 1)
-            self.objectCoords.to_csv(path, header=False,index=False)
+            metadata={'video': os.path.abspath(self.MainWindow.video), 'fps': self.fps}
+            trackingEngine.saveCoords(path, self.objectCoords, metadata)
             self.MainWindow.track_TE.append("Raw pixel coordinates saved to:")    
             self.MainWindow.track_TE.append(path)    
         except AttributeError:
@@ -241,50 +299,6 @@ class VideoTracking():
             self.errorMsg()
             return None   
 
-    def mog2Subtraction(self):
-
-        self.frameDelta = self.fgbg.apply(self.trackingFrame)
-        self.trackingFrame = cv2.threshold(self.frameDelta, 25, 255, cv2.THRESH_BINARY)[1]
-
-    def useFirstFrameBackground(self):
-
-        if self.background is None:
-            self.background = self.trackingFrame
-    
-        self.background=self.blockRegion(self.background)
-        self.frameDelta = cv2.absdiff(self.background, self.trackingFrame)
-        self.trackingFrame = cv2.threshold(self.frameDelta, 25, 255, cv2.THRESH_BINARY)[1]
-
-    def useSelectedFrameBackground(self):
- 
-        self.background = self.MainWindow.background
-        self.background=self.blockRegion(self.background)
-        try:
-            self.frameDelta = cv2.absdiff(self.background, self.trackingFrame)
-            self.trackingFrame = cv2.threshold(self.frameDelta, 25, 255, cv2.THRESH_BINARY)[1]
-            return True
-        except:
-            self.errMessage="Seems like your chosen background frame and the video are not of the same dimensions, or you have not chosen a background frame at all. Verify your choice of background frame and try again."
-            self.errorTitle="Error with background frame!"
-            self.errorMsg()
-            return False
-                   
-    def filters(self):
-
-        self.medianFiltersize=int(self.MainWindow.medianSlider.value())
-
-        if self.medianFiltersize % 2 == 0:
-                self.medianFiltersize=self.medianFiltersize + 1
-        
-        if self.MainWindow.medianFilterCheckbox.isChecked() == True:
-            self.trackingFrame = cv2.medianBlur(self.trackingFrame,self.medianFiltersize)
-            
-        if self.MainWindow.gaussCheckBox.isChecked() == True:
-            self.gauss=int(self.MainWindow.gaussSlider.value())
-            if self.gauss % 2 == 0:
-                self.gauss=self.gauss + 1
-            self.trackingFrame = cv2.GaussianBlur(self.trackingFrame, (self.gauss,self.gauss), 0)
-
     def errorMsg(self):
         msg = QMessageBox()
         msg.setIcon(QMessageBox.Information)
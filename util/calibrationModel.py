@@ -0,0 +1,249 @@
+"""
+Calibration model.
+
+CalibrationModel is built once from the DLT coefficients of a calibration
+(one row per camera, as saved by the calibration window) and keeps everything
+reconstruction and projection need that only depends on the calibration: the
+per camera projection matrices, the rows of the linear systems solved for
+each point and, for 2D DLT, the inverse homographies. reconstruct() and
+project() then only do the per point work, in chunks, so they can be run on
+millions of points.
+"""
+
+import numpy as np
+import pandas as pd
+
+from util import DLT
+
+
+class CalibrationModel():
+
+    """Reconstruction and projection operators of a DLT calibration.
+
+    Usage:
+        model=CalibrationModel(coefficients)
+        xyz=model.reconstruct(uvs)
+        uvs=model.project(xyz)
+
+    coefficients has one row of 8, 9, 11 or 12 DLT parameters per camera
+    (8 and 11 parameter rows get L9 or L12 = 1 appended), or 16 parameters of
+    the extended DLT whose last 5 are lens distortion terms (see
+    util.DLT.DLTdistortion).
+    """
+
+    def __init__(self, coefficients, chunkSize=65536):
+
+        Ls, nd, distortion=DLT.CameraParameters(coefficients)
+
+        ## DLT parameters, one row of 9 (2D) or 12 (3D) per camera
+        self.Ls=Ls
+        ## (nc, 5) lens distortion terms, None for the linear DLT
+        self.distortion=distortion
+        ## Number of cameras (views)
+        self.nc=Ls.shape[0]
+        ## Number of dimensions of the object space
+        self.nd=nd
+        ## Number of points solved at once, bounds the memory of the stacked systems
+        self.chunkSize=chunkSize
+
+        ## (nc, 3, nd+1) projection matrices
+        self.P=Ls.reshape(self.nc, 3, self.nd+1)
+        ## Templates of the two rows of each camera in the reconstruction systems,
+        ## P[c,0:2] - (u, v)*P[c,2], broadcast against (N, nc, 2, 1) image points
+        self.rows=self.P[np.newaxis, :, 0:2, :]
+        self.denominator=self.P[np.newaxis, :, 2:3, :]
+        ## (nc, 3, 3) inverse homographies of 2D DLT, None for 3D
+        self.Hinv=np.linalg.inv(self.P) if self.nd == 2 else None
+
+    @classmethod
+    def fromFile(cls, path):
+        """Builds the model from a calibration csv (one row of coefficients per camera, no header)."""
+
+        return cls(pd.read_csv(path, header=None).to_numpy(dtype=float))
+
+    def checkPoints(self, uvs, visible):
+        uvs=np.asarray(uvs, dtype=float)
+        if uvs.ndim == 2 and self.nc == 1:
+            uvs=uvs[:, np.newaxis, :]
+        if uvs.ndim != 3 or uvs.shape[1:] != (self.nc, 2):
+            raise ValueError('Image points must have shape (N, %d, 2), not %s.' % (self.nc, str(uvs.shape)))
+
+        finite=np.all(np.isfinite(uvs), axis=2)
+        if visible is None:
+            visible=finite
+        else:
+            visible=np.asarray(visible, dtype=bool) & finite
+            if visible.shape != uvs.shape[0:2]:
+                raise ValueError('visible must have shape %s, not %s.' % (str(uvs.shape[0:2]), str(visible.shape)))
+        return uvs, visible
+
+    def reconstruct(self, uvs, visible=None, refine=False):
+        """Reconstructs object points from their image points in every camera.
+
+        uvs is an (N, nc, 2) array and visible an optional (N, nc) boolean array
+        of the cameras that saw each point (by default, where uvs is not NaN).
+        Returns the (N, nd) object coordinates, NaN for points seen by fewer than
+        2 cameras (1 for 2D DLT). Points seen by one camera of a 2D calibration
+        use its inverse homography; the others are solved by least squares,
+        as util.DLT.DLTrecon_batch(). With refine=True, the points are then moved
+        to minimize their reprojection error (util.DLT.DLTrecon_refine()).
+        """
+
+        uvs, visible=self.checkPoints(uvs, visible)
+        if self.distortion is not None:
+            uvs=DLT.DLTundistort(self.distortion, self.Ls, uvs)
+
+        xyz=np.full((uvs.shape[0], self.nd), np.nan)
+        for start in range(0, uvs.shape[0], self.chunkSize):
+            end=start + self.chunkSize
+            xyz[start:end]=self.reconstructChunk(uvs[start:end], visible[start:end])
+            if refine:
+                xyz[start:end]=DLT.DLTrecon_refine(self.Ls, uvs[start:end], visible[start:end], xyz[start:end])
+        return xyz
+
+    def reconstructChunk(self, uvs, visible):
+        xyz=np.full((uvs.shape[0], self.nd), np.nan)
+        nmbViews=visible.sum(axis=1)
+
+        if self.nd == 2:
+            #One view: apply the inverse homography of the camera that saw the point
+            single=nmbViews == 1
+            if single.any():
+                camera=np.argmax(visible[single], axis=1)
+                uv=uvs[single][np.arange(len(camera)), camera]
+                uv1=np.concatenate((uv, np.ones((len(camera), 1))), axis=1)
+                rec=np.einsum('nij,nj->ni', self.Hinv[camera], uv1)
+                xyz[single]=rec[:, 0:2]/rec[:, 2:3]
+
+        multiple=nmbViews >= 2
+        if multiple.any():
+            uv=np.where(visible[multiple][:, :, np.newaxis], uvs[multiple], 0.)
+            M=self.rows - uv[:, :, :, np.newaxis]*self.denominator
+            M=M * visible[multiple][:, :, np.newaxis, np.newaxis]
+            M=M.reshape(uv.shape[0], 2*self.nc, self.nd+1)
+            U, S, Vh=np.linalg.svd(M, full_matrices=False)
+            xyz[multiple]=Vh[:, -1, 0:-1] / Vh[:, -1, -1:]
+
+        return xyz
+
+    def project(self, xyz):
+        """Projects (N, nd) object points into every camera, returns (N, nc, 2) image points."""
+
+        xyz=np.asarray(xyz, dtype=float)
+        if xyz.ndim != 2 or xyz.shape[1] != self.nd:
+            raise ValueError('Object points must have shape (N, %d), not %s.' % (self.nd, str(xyz.shape)))
+
+        uvs=self.linearProject(xyz)
+        if self.distortion is not None:
+            uvs=DLT.DLTdistort(self.distortion, self.Ls, uvs)
+        return uvs
+
+    def linearProject(self, xyz):
+        """Projection of (N, nd) object points by the linear DLT, without lens distortion."""
+
+        X=np.concatenate((xyz, np.ones((xyz.shape[0], 1))), axis=1)
+        uvw=np.einsum('cij,nj->nci', self.P, X)
+        return uvw[:, :, 0:2] / uvw[:, :, 2:3]
+
+    def match(self, candidates, maxResidual=20., rankPenalty=5.):
+        """Picks the candidate blob of each view that belongs to the same object.
+
+        candidates is an (N, nc, K, 2) array of the image points of up to K
+        candidate blobs per view and frame, largest first and NaN padded. All (K+1)**nc
+        combinations of one candidate or none per view are reconstructed in one
+        batch. Combinations in which any view reprojects more than maxResidual
+        pixels away are dropped, and of the others the one seen by the most
+        views with the smallest score is kept: the mean reprojection error plus
+        rankPenalty pixels times the mean rank of its candidates, so that the
+        largest blobs win unless other candidates reproject clearly better
+        (with two views a small blob anywhere along the epipolar line
+        reprojects perfectly). A reflection
+        or debris that is larger than the object in one view, or is the only
+        blob of a view, is rejected because it does not project consistently
+        into the others: the view is left out rather than forced into the
+        reconstruction. Combinations are scored with the (nd, nd) normal
+        equations of the reconstruction, much cheaper than its SVD, and only
+        the chosen one is reconstructed as by reconstruct().
+        Returns (uvs, xyz, residual): the (N, nc, 2) image points of the chosen
+        combination (NaN for the views left out), its (N, nd) reconstruction
+        and (N,) mean reprojection error in pixels (without the rank penalty), NaN where no combination
+        could be reconstructed.
+        """
+
+        candidates=np.asarray(candidates, dtype=float)
+        if candidates.ndim != 4 or candidates.shape[1] != self.nc or candidates.shape[3] != 2:
+            raise ValueError('Candidates must have shape (N, %d, K, 2), not %s.' % (self.nc, str(candidates.shape)))
+        #An extra NaN candidate per view stands for leaving the view out
+        candidates=np.concatenate((candidates, np.full(candidates.shape[0:2] + (1, 2), np.nan)), axis=2)
+        (N, nc, K)=candidates.shape[0:3]
+        if self.distortion is not None:
+            flat=candidates.transpose(0, 2, 1, 3).reshape(N*K, nc, 2)
+            candidates=DLT.DLTundistort(self.distortion, self.Ls, flat).reshape(N, K, nc, 2).transpose(0, 2, 1, 3)
+
+        ## (M, nc) candidate index of each view in every combination
+        combinations=np.stack(np.meshgrid(*[np.arange(K)]*nc, indexing='ij'), axis=-1).reshape(-1, nc)
+        M=len(combinations)
+        #The left out slot has no rank
+        ranks=np.where(combinations == K-1, 0, combinations)
+        minViews=1 if self.nd == 2 else 2
+
+        uvs=np.full((N, nc, 2), np.nan)
+        xyz=np.full((N, self.nd), np.nan)
+        residual=np.full(N, np.nan)
+        step=max(1, self.chunkSize // M)
+        for start in range(0, N, step):
+            chunk=candidates[start:start+step]
+            n=chunk.shape[0]
+            points=chunk[:, np.arange(nc)[np.newaxis, :], combinations].reshape(n*M, nc, 2)
+            visible=np.all(np.isfinite(points), axis=2)
+            rec=self.solveNormal(points, visible)
+
+            with np.errstate(invalid='ignore', divide='ignore'):
+                err=np.sqrt(np.sum((self.linearProject(rec) - points)**2, axis=2))
+            err[~visible]=0.
+            nmbViews=visible.sum(axis=1)
+            meanError=(err.sum(axis=1) / np.maximum(nmbViews, 1)).reshape(n, M)
+            meanRank=((ranks[np.newaxis]*visible.reshape(n, M, nc)).sum(axis=2) / np.maximum(nmbViews, 1).reshape(n, M))
+            score=meanError + rankPenalty*meanRank
+            nmbViews=nmbViews.reshape(n, M)
+            #Inconsistent combinations are dropped before ranking by number of views
+            consistent=(err.max(axis=1) <= maxResidual).reshape(n, M) & (nmbViews >= minViews) & np.isfinite(score)
+            nmbViews=np.where(consistent, nmbViews, 0)
+            score[~consistent | (nmbViews < nmbViews.max(axis=1, keepdims=True))]=np.inf
+
+            best=np.argmin(score, axis=1)
+            found=np.isfinite(score[np.arange(n), best])
+            chosen=(np.arange(n)*M + best)[found]
+            uvs[start:start+n][found]=points[chosen]
+            xyz[start:start+n][found]=self.reconstructChunk(points[chosen], visible[chosen])
+            residual[start:start+n][found]=meanError[np.arange(n), best][found]
+
+        if self.distortion is not None:
+            uvs=DLT.DLTdistort(self.distortion, self.Ls, uvs)
+        return uvs, xyz, residual
+
+    def solveNormal(self, uvs, visible):
+        """Least squares points of (N, nc, 2) image points from the (nd, nd) normal
+        equations of the reconstruction systems (with the last coordinate set to
+        1), NaN where they are singular."""
+
+        uv=np.where(visible[:, :, np.newaxis], uvs, 0.)
+        M=(self.rows - uv[:, :, :, np.newaxis]*self.denominator) * visible[:, :, np.newaxis, np.newaxis]
+        M=M.reshape(uv.shape[0], 2*self.nc, self.nd+1)
+        A=np.einsum('nki,nkj->nij', M[:, :, 0:-1], M[:, :, 0:-1])
+        b=-np.einsum('nki,nk->ni', M[:, :, 0:-1], M[:, :, -1])
+        xyz=np.full((uv.shape[0], self.nd), np.nan)
+        solvable=np.abs(np.linalg.det(A)) > 1e-300
+        xyz[solvable]=np.linalg.solve(A[solvable], b[solvable][:, :, np.newaxis])[:, :, 0]
+        return xyz
+
+    def reprojectionError(self, xyz, uvs, visible=None):
+        """Returns the (N, nc) pixel distances between the image points uvs and the
+        projections of the object points xyz, NaN where a camera did not see the
+        point (see reconstruct()) or the point was not reconstructed.
+        """
+
+        uvs, visible=self.checkPoints(uvs, visible)
+        err=np.sqrt(np.sum((self.project(xyz) - uvs)**2, axis=2))
+        err[~visible]=np.nan
+        return err
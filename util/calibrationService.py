@@ -0,0 +1,238 @@
+"""
+Calibration service.
+
+calibrateViews() calibrates every view (camera) of a calibration point table
+given as arrays, without the GUI, and can optionally bootstrap the
+calibration to give confidence intervals on the coefficients, the view errors
+and the reconstruction error. The bootstrap resamples of robust or refined
+calibrations are solved one by one in Python loops that hold the GIL, so they
+are split over worker processes; linear resamples are solved at once in
+NumPy in the calling process.
+
+Scripts calling calibrateViews() with workers other than 1 must guard their
+entry point with if __name__ == '__main__': on platforms that start the
+worker processes by importing the main module (Windows, macOS).
+
+Usage from a script:
+
+    points=pd.read_csv('calibrationPoints.csv')
+    xyz=points[['x', 'y', 'z']].to_numpy()
+    uvs=np.stack([points[['x_px_v1', 'y_px_v1']], points[['x_px_v2', 'y_px_v2']]], axis=1)
+    result=calibrateViews(xyz, uvs, bootstrap=2000)
+    pd.DataFrame(result.coefficients).to_csv('calibration.csv', index=False, header=False)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+
+from util import DLT
+
+
+class CalibrationResult():
+
+    """Calibration of all views returned by calibrateViews().
+
+    coefficients is the (nc, ncoefficients) array saved as the calibration
+    file, errors the reprojection error of each view (pixels) and inliers the
+    (N, nc) boolean array of the calibration points used by each view.
+    reconstructionError is the root mean square distance between the
+    calibration points and their reconstruction from all views, in object
+    units. With bootstrap, coefficientsCI is the (2, nc, ncoefficients) array
+    of lower and upper bounds of the coefficients, errorsCI the (2, nc) bounds
+    of the view errors and reconstructionErrorCI the (lower, upper) bounds of
+    the reconstruction error; they are None otherwise.
+    """
+
+    def __init__(self, coefficients, errors, inliers, reconstructionError):
+
+        self.coefficients=coefficients
+        self.errors=errors
+        self.inliers=inliers
+        self.reconstructionError=reconstructionError
+        ## Number of bootstrap calibrations the intervals come from, 0 without bootstrap
+        self.bootstrap=0
+        self.confidence=None
+        self.coefficientsCI=None
+        self.errorsCI=None
+        self.reconstructionErrorCI=None
+
+    def rejected(self):
+        """Returns {view: indices of the rejected calibration points} of the views that rejected any."""
+
+        return {view: np.flatnonzero(~self.inliers[:, view]) for view in range(self.inliers.shape[1])
+                if not self.inliers[:, view].all()}
+
+
+def checkPoints(xyz, uvs, nd):
+    xyz=np.asarray(xyz, dtype=float)
+    uvs=np.asarray(uvs, dtype=float)
+    if uvs.ndim == 2:
+        uvs=uvs[:, np.newaxis, :]
+    if xyz.ndim != 2 or xyz.shape[1] < nd:
+        raise ValueError('Object points must have shape (N, %d), not %s.' % (nd, str(xyz.shape)))
+    if uvs.ndim != 3 or uvs.shape[2] != 2 or uvs.shape[0] != xyz.shape[0]:
+        raise ValueError('Image points must have shape (%d, nc, 2), not %s.' % (xyz.shape[0], str(uvs.shape)))
+    if not (np.isfinite(xyz[:, 0:nd]).all() and np.isfinite(uvs).all()):
+        raise ValueError('The calibration points must all have object and image coordinates.')
+    minimum=6 if nd == 3 else 4
+    if xyz.shape[0] < minimum:
+        raise ValueError('%dD DLT needs at least %d calibration points, not %d.' % (nd, minimum, xyz.shape[0]))
+    return xyz[:, 0:nd], uvs
+
+
+def calibrateView(nd, xyz, uv, robust, refine, distortion, threshold, seed):
+    """Calibrates one view, returns (L, err, inliers)."""
+
+    if robust:
+        L, err, inliers=DLT.DLTcalib_robust(nd, xyz, uv, threshold=threshold, seed=seed)
+    else:
+        L, err=DLT.DLTcalib(nd, xyz, uv)
+        inliers=np.ones(len(uv), dtype=bool)
+    if refine or distortion:
+        L, err=DLT.DLTcalib_refine(nd, xyz[inliers], uv[inliers], L=L, distortion=distortion)
+    else:
+        err=np.sqrt(np.mean(DLT.DLTreprojection_error(L, xyz[inliers], uv[inliers][:, np.newaxis, :])**2))
+    return np.append(L, 1.) if len(L) in (8, 11) else L, err, inliers
+
+
+def bootstrapView(nd, xyz, uv, samples, robust, refine, distortion, threshold, seeds):
+    """Calibrations of the bootstrap samples (B, N) of the points of one view by calibrateView().
+
+    seeds holds the seed of the robust point selections of each sample, so
+    the result does not depend on how the samples are split between workers.
+
+    Returns the (B, ncoefficients) coefficients, the reprojection error of each
+    calibration on the inliers of its own sample and the (B, N) inliers of
+    each sample. Linear calibrations of all the samples are solved at once.
+    """
+
+    if not (robust or refine or distortion):
+        Ls=DLT.DLTcalib_batch(nd, xyz, uv, samples)
+        X=np.concatenate((xyz[samples], np.ones(samples.shape + (1,))), axis=2)
+        uvw=np.einsum('bij,bnj->bni', Ls.reshape(-1, 3, nd+1), X)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            err=np.sqrt(np.mean(np.sum((uvw[:, :, 0:2]/uvw[:, :, 2:3] - uv[samples])**2, axis=2), axis=1))
+        return Ls, err, np.ones(samples.shape, dtype=bool)
+
+    views=[calibrateView(nd, xyz[sample], uv[sample], robust, refine, distortion, threshold, np.random.default_rng(seed))
+           for (sample, seed) in zip(samples, seeds)]
+    Ls=np.array([L for (L, err, inliers) in views])
+    err=np.array([err for (L, err, inliers) in views])
+    inliers=np.array([inliers for (L, err, inliers) in views])
+    return Ls, err, inliers
+
+
+def biasCorrectedInterval(replicates, estimate, confidence):
+    """Bias corrected percentile interval (Efron) of an estimate from its bootstrap replicates.
+
+    replicates is a (B, ...) array of the estimate recomputed on each bootstrap
+    sample, NaN where it could not be. The percentiles are shifted by the
+    fraction of replicates below the estimate, so that a statistic the
+    resamples bias (e.g. an error fitted on duplicated points) still gets an
+    interval around its estimate. Returns the (2, ...) lower and upper bounds.
+    """
+
+    replicates=np.asarray(replicates, dtype=float)
+    estimate=np.broadcast_to(np.asarray(estimate, dtype=float), replicates.shape[1:])
+    normal=NormalDist()
+    z=normal.inv_cdf(1. - (1. - confidence)/2.)
+
+    columns=replicates.reshape(len(replicates), -1).T
+    bounds=np.full((2, len(columns)), np.nan)
+    for (i, (column, value)) in enumerate(zip(columns, estimate.ravel())):
+        column=column[np.isfinite(column)]
+        if len(column) == 0 or not np.isfinite(value):
+            continue
+        below=(np.sum(column < value) + 0.5*np.sum(column == value)) / len(column)
+        z0=normal.inv_cdf(min(max(below, 0.5/len(column)), 1. - 0.5/len(column)))
+        bounds[:, i]=np.quantile(column, [normal.cdf(2*z0 - z), normal.cdf(2*z0 + z)])
+    return bounds.reshape((2,) + replicates.shape[1:])
+
+
+def reconstructionError(coefficients, xyz, uvs, visible):
+    rec=DLT.DLTrecon_batch(coefficients, uvs, visible)
+    return np.sqrt(np.nanmean(np.sum((rec - xyz)**2, axis=1)))
+
+
+def calibrateViews(xyz, uvs, nd=3, robust=False, refine=False, distortion=False, threshold=3.,
+                   bootstrap=0, confidence=0.95, workers=None, seed=None):
+    """Calibrates every view of a calibration point table.
+
+    Inputs:
+        xyz: (N, nd) object coordinates of the calibration points
+        uvs: (N, nc, 2) image coordinates of the points in each view
+        nd: 3 for 3D DLT, 2 for 2D DLT
+        robust: reject mis-clicked points (util.DLT.DLTcalib_robust)
+        refine, distortion: refine the calibration by minimizing the
+            reprojection error, with lens distortion (util.DLT.DLTcalib_refine)
+        threshold: reprojection error in pixels above which robust rejects a point
+        bootstrap: number of bootstrap resamples of the calibration points,
+            0 for no confidence intervals. Each resample of a robust or
+            refined calibration is solved on its own, a few hundred
+            resamples are usually enough.
+        confidence: level of the percentile confidence intervals
+        workers: number of processes solving the bootstrap resamples of a
+            robust or refined calibration, one per CPU by default; 1 solves
+            them in the calling process
+        seed: seed of the random point selections
+    Returns a CalibrationResult.
+
+    The bootstrap resamples the calibration points with replacement (the
+    same resampled points in every view, so the reconstruction error can be
+    computed for each resample) and recalibrates every resample with the same
+    estimator as the coefficients (robust, refine and distortion included).
+    The errors of each resample are those of its own calibration points, as
+    for the estimates, and the intervals are bias corrected percentile
+    intervals (see biasCorrectedInterval()).
+    """
+
+    xyz, uvs=checkPoints(xyz, uvs, nd)
+    nc=uvs.shape[1]
+    if nd == 3 and nc < 2 and bootstrap:
+        raise ValueError('The reconstruction error of 3D DLT needs at least two views.')
+    seeds=np.random.SeedSequence(seed).spawn(nc + 1)
+
+    views=[calibrateView(nd, xyz, uvs[:, view], robust, refine, distortion, threshold,
+                         np.random.default_rng(seeds[view])) for view in range(nc)]
+
+    coefficients=np.array([L for (L, err, inliers) in views])
+    errors=np.array([err for (L, err, inliers) in views])
+    inliers=np.stack([inliers for (L, err, inliers) in views], axis=1)
+    result=CalibrationResult(coefficients, errors, inliers,
+                             reconstructionError(coefficients, xyz, uvs, inliers) if nc >= nd-1 else np.nan)
+    if not bootstrap:
+        return result
+
+    rng=np.random.default_rng(seeds[nc])
+    samples=rng.integers(0, len(xyz), size=(bootstrap, len(xyz)))
+    sampleSeeds=[seeds[view].spawn(1)[0].spawn(bootstrap) for view in range(nc)]
+    workers=workers or os.cpu_count() or 1
+    if workers == 1 or not (robust or refine or distortion):
+        resampled=[bootstrapView(nd, xyz, uvs[:, view], samples, robust, refine, distortion, threshold, sampleSeeds[view])
+                   for view in range(nc)]
+    else:
+        #Each view's resamples are split in one chunk per worker
+        chunks=np.array_split(np.arange(bootstrap), min(workers, bootstrap))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            jobs=[[executor.submit(bootstrapView, nd, xyz, uvs[:, view], samples[chunk], robust, refine, distortion,
+                                   threshold, sampleSeeds[view][chunk[0]:chunk[-1]+1]) for chunk in chunks]
+                  for view in range(nc)]
+            parts=[[job.result() for job in viewJobs] for viewJobs in jobs]
+        resampled=[tuple(np.concatenate(arrays) for arrays in zip(*viewParts)) for viewParts in parts]
+
+    Ls=np.stack([Ls for (Ls, err, inliers) in resampled], axis=1)
+    errs=np.stack([err for (Ls, err, inliers) in resampled], axis=1)
+    sampleInliers=np.stack([inliers for (Ls, err, inliers) in resampled], axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recErrs=np.array([reconstructionError(Ls[i], xyz[samples[i]], uvs[samples[i]], sampleInliers[i])
+                          if nc >= nd-1 else np.nan for i in range(bootstrap)])
+
+    result.bootstrap=bootstrap
+    result.confidence=confidence
+    result.coefficientsCI=biasCorrectedInterval(Ls, coefficients, confidence)
+    result.errorsCI=biasCorrectedInterval(errs, errors, confidence)
+    result.reconstructionErrorCI=tuple(biasCorrectedInterval(recErrs, result.reconstructionError, confidence))
+    return result